@@ -0,0 +1,121 @@
+import glob
+import os
+from datetime import date, timedelta
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+
+SHAPES = ['Round', 'Princess', 'Emerald', 'Asscher', 'Cushion', 'Marquise', 'Radiant', 'Oval', 'Pear', 'Heart']
+CUTS = ['Good', 'Very Good', 'Ideal', 'Astor Ideal']
+COLORS = ['K', 'J', 'I', 'H', 'G', 'F', 'E', 'D']
+CLARITIES = ['SI2', 'SI1', 'VS2', 'VS1', 'VVS2', 'VVS1', 'IF', 'FL']
+FINISHES = ['Good', 'Very Good', 'Excellent']
+FLUORESCENCES = ['None', 'Faint', 'Medium', 'Strong', 'Very Strong']
+CULETS = ['None', 'Pointed', 'Very Small', 'Small', 'Medium']
+
+ROW_CLASS = 'grid-row row TL511DiaStrikePrice'
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def synthetic_catalog(n_rows: int, seed: int = 0, stock_offset: int = 0) -> pd.DataFrame:
+    """
+    Generate a raw (string typed) diamond catalog shaped like the scrapped Blue Nile grid.
+
+    Args:
+        n_rows: Number of diamonds.
+        seed: Random seed.
+        stock_offset: First stock number, used to control overlap with a synthetic historical store.
+
+    Returns: DataFrame with the 17 columns of `BlueNileScrapper.get_column_name()`, all values are strings.
+
+    """
+    rng = np.random.RandomState(seed)
+    carat = np.round(np.clip(rng.lognormal(mean=-0.1, sigma=0.45, size=n_rows), 0.23, 20.98), 2)
+    color_idx = rng.randint(len(COLORS), size=n_rows)
+    clarity_idx = rng.randint(len(CLARITIES), size=n_rows)
+    price = (3500 * carat ** 1.8 * (1 + 0.06 * color_idx) * (1 + 0.05 * clarity_idx)
+             * rng.lognormal(0, 0.1, size=n_rows)).clip(261, 1860430).astype(int)
+    # Around one in five stones has a discount
+    discount = np.where(rng.rand(n_rows) < 0.2, (price * 0.9).astype(int), price)
+    delivery = [(date(2021, 1, 1) + timedelta(days=int(d))).strftime('%b %d').replace(' 0', ' ')
+                for d in rng.randint(365, size=n_rows)]
+
+    return pd.DataFrame({
+        'Shape': np.array(SHAPES)[rng.choice(len(SHAPES), size=n_rows, p=[.55, .07, .06, .02, .08, .02, .03, .09,
+                                                                            .05, .03])],
+        'Price': ['${:,}'.format(p) for p in price],
+        'Discount Price': ['${:,}'.format(p) for p in discount],
+        'Carat': carat.astype(str),
+        'Cut': np.array(CUTS)[rng.randint(len(CUTS), size=n_rows)],
+        'Color': np.array(COLORS)[color_idx],
+        'Clarity': np.array(CLARITIES)[clarity_idx],
+        'Polish': np.array(FINISHES)[rng.randint(len(FINISHES), size=n_rows)],
+        'Symmetry': np.array(FINISHES)[rng.randint(len(FINISHES), size=n_rows)],
+        'Fluorescence': np.array(FLUORESCENCES)[rng.randint(len(FLUORESCENCES), size=n_rows)],
+        'Depth': np.round(rng.uniform(55, 70, size=n_rows), 1).astype(str),
+        'Table': np.round(rng.uniform(52, 66, size=n_rows), 1).astype(str),
+        'L/W': np.round(rng.uniform(1, 1.8, size=n_rows), 2).astype(str),
+        'Price/Ct': ['${:,}'.format(p) for p in (discount / carat).astype(int)],
+        'Culet': np.array(CULETS)[rng.randint(len(CULETS), size=n_rows)],
+        'Stock No.': ['LD{:08d}'.format(i) for i in range(stock_offset, stock_offset + n_rows)],
+        'Delivery Date': delivery,
+    })
+
+
+def catalog_to_grid_html(df: pd.DataFrame) -> str:
+    """
+    Render a raw catalog into the Blue Nile grid rows layout expected by `BlueNileScrapper.detect_discount()`,
+    i.e. a discounted row has 'Was: ' and 'Now: ' text nodes, and each row has one wish list node after carat.
+    """
+    rows = []
+    for record in df.itertuples(index=False):
+        if record[1] != record[2]:
+            prices = '<div>Was: </div><div>{}</div><div>Now: </div><div>{}</div>'.format(record[1], record[2])
+        else:
+            prices = '<div>{}</div>'.format(record[1])
+        rest = ''.join('<div>{}</div>'.format(value) for value in record[4:])
+        rows.append('<a class="{}" href="#"><div>{}</div>{}<div>{}</div><div>Add</div>{}</a>'.format(
+            ROW_CLASS, record[0], prices, record[3], rest))
+    return '<html><body><div class="grid-body">{}</div></body></html>'.format(''.join(rows))
+
+
+def recorded_fixtures() -> List[str]:
+    """
+    Recorded grid pages saved from `DriverBlueNileScrapper.soup_list` (`str(soup)`) into benchmarks/fixtures/*.html.
+    None is committed yet: record one by `get_dynamic(keep_soup_list=True)` on a small filter set, save
+    `str(scrapper.soup_list[0])` as benchmarks/fixtures/<name>.html and re-save the baseline.
+    """
+    return sorted(glob.glob(os.path.join(FIXTURE_DIR, '*.html')))
+
+
+def synthetic_store(catalog: pd.DataFrame, n_rows: int, seed: int = 1, today: date = None) -> pd.DataFrame:
+    """
+    Generate a transformed historical store (as `data/blue_niles_df.pkl`) sharing stock numbers with given catalog.
+
+    Args:
+        catalog: Transformed catalog indexed by 'Stock No.', i.e. output of `transformation()`.
+        n_rows: Number of rows in the store.
+        seed: Random seed.
+        today: Last available date of the store, default is yesterday.
+
+    Returns: DataFrame
+
+    """
+    if today is None:
+        today = date.today() - timedelta(days=1)
+    rng = np.random.RandomState(seed)
+    store = catalog.sample(n=n_rows, replace=n_rows > catalog.shape[0], random_state=rng).copy()
+    store = store[~store.index.duplicated()]
+    # Stones only in history, not in today's scrape
+    n_old = n_rows - store.shape[0]
+    if n_old > 0:
+        old = catalog.sample(n=n_old, replace=True, random_state=rng).copy()
+        old.index = ['OLD{:08d}'.format(i) for i in range(n_old)]
+        store = pd.concat([store, old])
+    store['Price'] = (store['Price'] * rng.uniform(0.95, 1.05, size=store.shape[0])).astype(int)
+    store['Last Available Date'] = [today] * store.shape[0]
+    store['First Available Date'] = [today - timedelta(days=int(d)) for d in rng.randint(90, size=store.shape[0])]
+    store.index.name = 'Stock No.'
+    return store
@@ -0,0 +1,92 @@
+"""
+Import-time budget check of the `diamond-digger` CLI (cli.py) subcommands.
+
+Each check runs `python -X importtime` in a fresh process, so that cached modules of one check don't hide the cost of
+another. A check fails if its imports take longer than the budget, or pull in a forbidden top-level package, e.g.
+`search` must never import sklearn or selenium.
+
+To use:
+    python -m benchmarks.import_budget
+    # scale budgets on slow machines
+    python -m benchmarks.import_budget --scale 2
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name: (modules to import, budget seconds, forbidden top-level packages)
+BUDGETS = {
+    'startup': ([], 0.15, ['pandas', 'numpy', 'sklearn', 'selenium', 'bs4', 'requests']),
+    'scrape': (None, 1.5, ['sklearn']),
+    # aiohttp-only scrape backend, the selenium and requests backends must stay unloaded
+    'async_scrape': (['scrapper.async_blue_niles'], 1.5, ['sklearn', 'selenium', 'requests']),
+    'ingest': (None, 1.5, ['sklearn', 'selenium', 'requests']),
+    'train': (None, 3.0, ['selenium', 'bs4', 'requests']),
+    'score': (None, 2.5, ['selenium', 'bs4', 'requests']),
+    'search': (None, 1.2, ['sklearn', 'selenium', 'bs4', 'requests']),
+    'comparables': (None, 2.5, ['selenium', 'bs4', 'requests']),
+    'watch': (None, 1.2, ['sklearn', 'selenium', 'bs4', 'requests']),
+}
+
+
+def measure(modules: List[str]) -> Tuple[float, Dict[str, int]]:
+    """
+    Import `cli` and given modules in a fresh interpreter.
+
+    Returns: total import seconds, {imported module: self microseconds}
+
+    """
+    code = 'import cli\n' + ''.join('import {}\n'.format(module) for module in modules)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    imported = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        imported[name.strip()] = int(self_us)
+    return sum(imported.values()) / 1e6, imported
+
+
+def check(scale: float = 1.0) -> List[str]:
+    """
+    Run all budget checks.
+
+    Returns: List of report lines, lines of failed checks start with 'OVER BUDGET' or 'FORBIDDEN'.
+
+    """
+    from cli import COMMAND_MODULES
+
+    lines = ['{:<12}{:>10}{:>10}  {}'.format('command', 'seconds', 'budget', 'slowest imports')]
+    for name, (modules, budget, forbidden) in BUDGETS.items():
+        if modules is None:
+            modules = COMMAND_MODULES[name]
+        seconds, imported = measure(modules)
+        slowest = sorted(imported, key=imported.get, reverse=True)[:3]
+        line = '{:<12}{:>10.3f}{:>10.3f}  {}'.format(name, seconds, budget * scale, ', '.join(slowest))
+        leaked = sorted({module.split('.')[0] for module in imported} & set(forbidden))
+        if leaked:
+            line = 'FORBIDDEN {} '.format(','.join(leaked)) + line
+        elif seconds > budget * scale:
+            line = 'OVER BUDGET ' + line
+        lines.append(line)
+    return lines
+
+
+def main(argv: List = None):
+    parser = argparse.ArgumentParser(description='Import-time budget check of CLI subcommands.')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply all budgets, i.e. for slow machines.')
+    args = parser.parse_args(argv)
+
+    lines = check(scale=args.scale)
+    print('\n'.join(lines))
+    if any(line.startswith(('OVER BUDGET', 'FORBIDDEN')) for line in lines):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Offline replay benchmark of the ingest path: parse grid HTML -> transformation() -> update().
+
+To use:
+    # run and compare with the committed baseline
+    python -m benchmarks.ingest_benchmark
+    # larger fixtures, the 500k rows case needs around 15GB memory for html.parser
+    python -m benchmarks.ingest_benchmark --sizes 1000 50000 500000
+    # overwrite the baseline after an intended change
+    python -m benchmarks.ingest_benchmark --save-baseline
+
+No recorded Blue Nile page is committed yet, so only the synthetic cases run and are baselined. See
+`benchmarks.fixtures.recorded_fixtures()` to add one.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from datetime import date
+from typing import Dict, List
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline_ingest.json')
+DEFAULT_SIZES = [1000, 50000]
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_case(html: str, n_store: int, seed: int = 0) -> Dict:
+    """
+    Time parse -> transform -> upsert on one page of grid HTML against a synthetic store of `n_store` rows.
+    """
+    import pandas as pd
+    from bs4 import BeautifulSoup
+
+    from benchmarks.fixtures import synthetic_store
+    from customized_auto_scrapper import transformation, update
+    from scrapper.blue_niles import BlueNileScrapper
+
+    scrapper = BlueNileScrapper(url=None)
+    timings = {}
+
+    start = time.perf_counter()
+    soup = BeautifulSoup(html, "html.parser")
+    diamond_list = scrapper.get_record(soup=soup)
+    df = pd.DataFrame(diamond_list, columns=scrapper.get_column_name())
+    timings['parse'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    df.drop_duplicates(inplace=True)
+    df = transformation(df)
+    today = date.today()
+    df['Last Available Date'] = [today] * df.shape[0]
+    df['First Available Date'] = [today] * df.shape[0]
+    timings['transform'] = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store_path = os.path.join(tmp_dir, 'blue_niles_df.pkl')
+        synthetic_store(df, n_rows=n_store, seed=seed + 1).to_pickle(store_path)
+        start = time.perf_counter()
+        update(df, main_df_path=store_path, is_save=True)
+        timings['upsert'] = time.perf_counter() - start
+
+    rows = df.shape[0]
+    total = sum(timings.values())
+    return {
+        'rows': rows,
+        'seconds': {stage: round(value, 4) for stage, value in timings.items()},
+        'total_seconds': round(total, 4),
+        'rows_per_second': round(rows / total, 1) if total else None,
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+    }
+
+
+def _synthetic_case(size: int, seed: int) -> Dict:
+    from benchmarks.fixtures import catalog_to_grid_html, synthetic_catalog
+
+    html = catalog_to_grid_html(synthetic_catalog(size, seed=seed))
+    return run_case(html, n_store=2 * size, seed=seed)
+
+
+def _recorded_case(path: str) -> Dict:
+    with open(path) as f:
+        html = f.read()
+    return run_case(html, n_store=100000)
+
+
+def _isolated(func, *args) -> Dict:
+    # Each case runs in a fresh process so that peak RSS belongs to that case only
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(func, args)
+
+
+def run_benchmark(sizes: List[int] = None, seed: int = 0, include_recorded: bool = True) -> Dict:
+    from benchmarks.fixtures import recorded_fixtures
+
+    if sizes is None:
+        sizes = DEFAULT_SIZES
+    results = {}
+    for size in sizes:
+        results['synthetic_{}'.format(size)] = _isolated(_synthetic_case, size, seed)
+    if include_recorded:
+        if not recorded_fixtures():
+            print('No recorded grid pages in benchmarks/fixtures, only synthetic cases are run', file=sys.stderr)
+        for path in recorded_fixtures():
+            results['recorded_{}'.format(os.path.splitext(os.path.basename(path))[0])] = _isolated(_recorded_case, path)
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float = 0.2) -> List[str]:
+    """
+    Compare throughput and peak memory of each case with the baseline.
+
+    Returns: List of report lines, lines of regressed cases start with 'REGRESSION'.
+
+    """
+    lines = ['{:<22}{:>10}{:>14}{:>14}{:>10}{:>12}'.format('case', 'rows', 'rows/s', 'baseline', 'change', 'peak_mb')]
+    for case, result in current['results'].items():
+        base = baseline.get('results', {}).get(case)
+        line = '{:<22}{:>10}{:>14.1f}'.format(case, result['rows'], result['rows_per_second'])
+        if base is None:
+            lines.append(line + '{:>14}{:>10}{:>12.1f}'.format('-', '-', result['peak_rss_mb']))
+            continue
+        change = result['rows_per_second'] / base['rows_per_second'] - 1
+        line += '{:>14.1f}{:>9.1f}%{:>12.1f}'.format(base['rows_per_second'], 100 * change, result['peak_rss_mb'])
+        if change < -tolerance or result['peak_rss_mb'] > (1 + tolerance) * base['peak_rss_mb']:
+            line = 'REGRESSION ' + line
+        lines.append(line)
+    return lines
+
+
+def main(argv: List = None):
+    parser = argparse.ArgumentParser(description='Offline benchmark of parse -> transform -> upsert.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Synthetic fixture sizes (rows).')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-recorded', action='store_true', help='Skip recorded fixtures in benchmarks/fixtures.')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='Overwrite the baseline with this run.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative slowdown before flagging.')
+    args = parser.parse_args(argv)
+
+    current = run_benchmark(sizes=args.sizes, seed=args.seed, include_recorded=not args.no_recorded)
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    lines = compare(current, baseline, tolerance=args.tolerance)
+    print('\n'.join(lines))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(current, f, indent=2)
+            f.write('\n')
+    elif any(line.startswith('REGRESSION') for line in lines):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Benchmark of DiamondPricer training and inference: build_base_preprocessor -> preprocessor fit_transform -> fit ->
+cv_fit -> predict, timed separately on synthetic catalogs of several sizes and with several `n_jobs`, together with
+the accuracy on held out rows, so that algorithm and preprocessing changes are judged on both.
+
+To use:
+    # run and compare with the committed baseline
+    python -m benchmarks.pricer_benchmark
+    # larger catalogs and more workers, fully grown forests of the 1M rows case need around 15GB memory
+    python -m benchmarks.pricer_benchmark --sizes 10000 100000 1000000 --n-jobs 1 4 -1
+    # hot spots of each stage (cProfile only sees the main process, use --n-jobs 1), written with the report
+    python -m benchmarks.pricer_benchmark --sizes 10000 --n-jobs 1 --profile --report data/pricer_report.txt
+    # overwrite the baseline after an intended change, never from a --profile run
+    python -m benchmarks.pricer_benchmark --save-baseline
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+from datetime import date, timedelta
+from typing import Dict, List
+
+from benchmarks.ingest_benchmark import _peak_rss_mb
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT_DIR, 'benchmarks', 'baseline_pricer.json')
+DEFAULT_SIZES = [10000, 100000]
+DEFAULT_N_JOBS = [1, -1]
+STAGES = ['build_preprocessor', 'preprocess', 'fit', 'cv_fit', 'predict']
+# Small search, enough to time the cross validation machinery without multiplying fit time
+CV_GRID = {'max_depth': [8, None]}
+CV_SPLITS = 3
+
+
+def synthetic_training_set(size: int, seed: int = 0, test_fraction: float = 0.2):
+    """
+    Transformed synthetic catalog with listing dates, split into training and held out rows as
+    `TrainingSetBuilder.load()` would return them.
+
+    Returns: X_train, y_train, X_test, y_test
+    """
+    import numpy as np
+
+    from benchmarks.fixtures import synthetic_catalog
+    from customized_auto_scrapper import transformation
+    from preprocessing.dataset import TARGET_COLUMN, TrainingSetBuilder
+
+    df = transformation(synthetic_catalog(size, seed=seed))
+    rng = np.random.RandomState(seed)
+    # Listings spread over half a year, so that RollingOriginSplit has delisted stones before each origin
+    today = date.today()
+    first = rng.randint(180, size=df.shape[0])
+    last = np.minimum(first + rng.randint(60, size=df.shape[0]), 179)
+    df['First Available Date'] = [today - timedelta(days=180 - int(d)) for d in first]
+    df['Last Available Date'] = [today - timedelta(days=180 - int(d)) for d in last]
+
+    df = df[TrainingSetBuilder().columns]
+    test = rng.rand(df.shape[0]) < test_fraction
+    y = df.pop(TARGET_COLUMN)
+    return df[~test].copy(), y[~test], df[test].copy(), y[test]
+
+
+def _timed(stage: str, timings: Dict, profiles: Dict, profile: bool, func, *args, **kwargs):
+    if profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        result = profiler.runcall(func, *args, **kwargs)
+        timings[stage] = time.perf_counter() - start
+        profiles[stage] = hot_spots(profiler)
+    else:
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        timings[stage] = time.perf_counter() - start
+    return result
+
+
+def _short_path(filename: str) -> str:
+    # Paths relative to site-packages or to the repository, whichever contains the file
+    if 'site-packages' + os.sep in filename:
+        return filename.split('site-packages' + os.sep, 1)[1]
+    if filename.startswith(ROOT_DIR + os.sep):
+        return os.path.relpath(filename, ROOT_DIR)
+    return filename
+
+
+def hot_spots(profiler, top: int = 10) -> List[Dict]:
+    """
+    Functions of a cProfile run with the largest own time.
+
+    Returns: List of {'function', 'calls', 'own_seconds', 'cumulative_seconds'}, largest own time first.
+
+    """
+    import pstats
+
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+    return [{
+        'function': '{}:{}({})'.format(_short_path(filename), line, name),
+        'calls': n_calls,
+        'own_seconds': round(own, 4),
+        'cumulative_seconds': round(cumulative, 4),
+    } for (filename, line, name), (_, n_calls, own, cumulative, _) in rows]
+
+
+def run_case(size: int, n_jobs: int, seed: int = 0, tune: bool = True, profile: bool = False) -> Dict:
+    """
+    Time each training and inference stage of a DiamondPricer on a synthetic catalog of `size` rows.
+    """
+    from sklearn.metrics import mean_absolute_error, r2_score
+
+    from model.model_selection import RollingOriginSplit
+    from model.pricer import DiamondPricer
+
+    X_train, y_train, X_test, y_test = synthetic_training_set(size, seed=seed)
+    timings = {}
+    profiles = {}
+
+    pricer = DiamondPricer()
+    pricer.algo.set_params(n_jobs=n_jobs, random_state=seed)
+    preprocessor = _timed('build_preprocessor', timings, profiles, profile, pricer.build_base_preprocessor)
+    _timed('preprocess', timings, profiles, profile, preprocessor.fit_transform, X_train.copy())
+
+    _timed('fit', timings, profiles, profile, pricer.fit, X_train, y_train)
+    prediction = _timed('predict', timings, profiles, profile, pricer.predict, X_test)
+    accuracy = {'fit': {'r2': round(r2_score(y_test, prediction), 4),
+                        'mae': round(mean_absolute_error(y_test, prediction), 1)}}
+
+    if tune:
+        # Search workers run the candidates, each forest is fitted by a single process
+        tuner = DiamondPricer()
+        tuner.algo.set_params(n_jobs=1, random_state=seed)
+        tuner.cv = 'GridSearch'
+        tuner.cv_params = {
+            'estimator': tuner.pipeline,
+            'param_grid': {'algo__{}'.format(name): values for name, values in CV_GRID.items()},
+            'scoring': None,
+            'cv': RollingOriginSplit(n_splits=CV_SPLITS),
+            'refit': True,
+            'n_jobs': n_jobs,
+            'verbose': 0,
+        }
+        tuner.build_cv_pipeline()
+        _timed('cv_fit', timings, profiles, profile, tuner.cv_fit, X_train, y_train)
+        prediction = tuner.predict(X_test)
+        accuracy['cv_fit'] = {'r2': round(r2_score(y_test, prediction), 4),
+                              'mae': round(mean_absolute_error(y_test, prediction), 1),
+                              'best_params': tuner.cv_pipeline.best_params_}
+
+    result = {
+        'rows': int(X_train.shape[0]),
+        'test_rows': int(X_test.shape[0]),
+        'n_jobs': n_jobs,
+        'n_features': len(pricer.feature_name),
+        'seconds': {stage: round(timings[stage], 4) for stage in STAGES if stage in timings},
+        'predict_rows_per_second': round(X_test.shape[0] / timings['predict'], 1) if timings['predict'] else None,
+        'accuracy': accuracy,
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+        'profiled': profile,
+    }
+    if profile:
+        result['hot_spots'] = profiles
+    return result
+
+
+def _isolated(func, *args) -> Dict:
+    # Each case runs in a fresh process so that peak RSS and warm caches belong to that case only
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(func, args)
+
+
+def run_benchmark(sizes: List[int] = None, n_jobs: List[int] = None, seed: int = 0, tune: bool = True,
+                  profile: bool = False) -> Dict:
+    if sizes is None:
+        sizes = DEFAULT_SIZES
+    if n_jobs is None:
+        n_jobs = DEFAULT_N_JOBS
+    results = {}
+    for size in sizes:
+        for jobs in n_jobs:
+            results['synthetic_{}_jobs_{}'.format(size, jobs)] = _isolated(run_case, size, jobs, seed, tune, profile)
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float = 0.2, r2_tolerance: float = 0.01) -> List[str]:
+    """
+    Compare the time of each stage and the held out r2 of each case with the baseline.
+
+    Returns: List of report lines, lines of regressed cases start with 'REGRESSION'.
+
+    """
+    lines = ['{:<28}{:<20}{:>10}{:>12}{:>10}'.format('case', 'stage', 'seconds', 'baseline', 'change')]
+    for case, result in current['results'].items():
+        base = baseline.get('results', {}).get(case)
+        for stage, seconds in result['seconds'].items():
+            line = '{:<28}{:<20}{:>10.3f}'.format(case, stage, seconds)
+            base_seconds = (base or {}).get('seconds', {}).get(stage)
+            if not base_seconds:
+                lines.append(line + '{:>12}{:>10}'.format('-', '-'))
+                continue
+            change = seconds / base_seconds - 1
+            line += '{:>12.3f}{:>9.1f}%'.format(base_seconds, 100 * change)
+            # Sub-second stages are too noisy to flag
+            if change > tolerance and seconds - base_seconds > 0.5:
+                line = 'REGRESSION ' + line
+            lines.append(line)
+
+        for name, accuracy in result['accuracy'].items():
+            line = '{:<28}{:<20}{:>10.4f}'.format(case, 'r2_' + name, accuracy['r2'])
+            base_r2 = (base or {}).get('accuracy', {}).get(name, {}).get('r2')
+            if base_r2 is None:
+                lines.append(line + '{:>12}{:>10}'.format('-', '-'))
+                continue
+            line += '{:>12.4f}{:>10.4f}'.format(base_r2, accuracy['r2'] - base_r2)
+            if accuracy['r2'] < base_r2 - r2_tolerance:
+                line = 'REGRESSION ' + line
+            lines.append(line)
+    return lines
+
+
+def format_hot_spots(current: Dict) -> List[str]:
+    lines = []
+    for case, result in current['results'].items():
+        for stage, rows in result.get('hot_spots', {}).items():
+            lines.append('')
+            lines.append('{} {} hot spots'.format(case, stage))
+            lines.append('{:>10}{:>10}{:>12}  {}'.format('calls', 'own_s', 'cumul_s', 'function'))
+            for row in rows:
+                lines.append('{:>10}{:>10.3f}{:>12.3f}  {}'.format(row['calls'], row['own_seconds'],
+                                                                  row['cumulative_seconds'], row['function']))
+    return lines
+
+
+def main(argv: List = None):
+    parser = argparse.ArgumentParser(description='Benchmark of DiamondPricer training and inference stages.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Synthetic catalog sizes (rows).')
+    parser.add_argument('--n-jobs', type=int, nargs='+', default=DEFAULT_N_JOBS,
+                        help='RandomForest and GridSearchCV n_jobs values to run each size with.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-tune', action='store_true', help='Skip the cv_fit stage.')
+    parser.add_argument('--profile', action='store_true', help='Profile each stage with cProfile, adds overhead.')
+    parser.add_argument('--report', help='Also write the comparison report (and hot spots) to this path.')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='Overwrite the baseline with this run.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative slowdown before flagging.')
+    parser.add_argument('--r2-tolerance', type=float, default=0.01, help='Allowed r2 drop before flagging.')
+    args = parser.parse_args(argv)
+    if args.profile and args.save_baseline:
+        parser.error("Profiled timings include profiler overhead, don't save them as baseline.")
+
+    current = run_benchmark(sizes=args.sizes, n_jobs=args.n_jobs, seed=args.seed, tune=not args.no_tune,
+                            profile=args.profile)
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    lines = compare(current, baseline, tolerance=args.tolerance, r2_tolerance=args.r2_tolerance)
+    report = lines + format_hot_spots(current)
+    print('\n'.join(report))
+    if args.report:
+        with open(args.report, 'w') as f:
+            f.write('\n'.join(report) + '\n')
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(current, f, indent=2)
+            f.write('\n')
+    elif any(line.startswith('REGRESSION') for line in lines):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+Unified command line entry of DiamondDigger.
+
+To use:
+    python cli.py scrape --sets carat_range_1_101
+    python cli.py scrape --retailers bluenile
+    python cli.py ingest data/raw/blue_niles_raw.pkl --set-name carat_range_1_101
+    python cli.py ingest --retry-pending
+    python cli.py train --store data/blue_niles_df.parquet --n-per-stratum 2000
+    python cli.py train --feature-cache data/features
+    python cli.py score LD12345678 LD23456789
+    python cli.py search --carat 1 1.2 --shape Round --in-stock
+    python cli.py comparables LD12345678 --k 10
+    python cli.py watch add --name "1ct round" --carat 1 1.2 --shape Round --events new price_drop --min-drop 0.05
+
+Only argparse is imported at startup, each subcommand imports what it needs when it runs, so that short commands
+don't pay for selenium or the whole sklearn stack. COMMAND_MODULES lists the heavy modules of each subcommand,
+`python -m benchmarks.import_budget` checks their import time against a budget.
+"""
+import argparse
+import sys
+from typing import List
+
+
+# Modules imported by each subcommand handler, keep in sync with the imports inside the handlers
+COMMAND_MODULES = {
+    'scrape': ['customized_auto_scrapper', 'scrapper.driver_pool', 'scrapper.scheduler'],
+    'ingest': ['customized_auto_scrapper'],
+    'train': ['model.pricer', 'model.segmented', 'preprocessing.dataset', 'preprocessing.feature_store'],
+    'score': ['model.base', 'ingest.lifecycle'],
+    'search': ['query.engine'],
+    'comparables': ['query.comparables', 'model.base'],
+    'watch': ['ingest.alerts'],
+}
+
+
+def _parse_date(value: str):
+    from datetime import date
+
+    return date.fromisoformat(value)
+
+
+def scrape(args: argparse.Namespace):
+    if args.retailers:
+        from customized_auto_scrapper import run_retailers
+
+        failed = run_retailers(retailers=args.retailers, driver_class=args.driver_class,
+                               drivers_per_retailer=args.drivers_per_retailer, set_names=args.sets,
+                               metrics_path=args.metrics, log_path=args.log, snapshot_format=args.snapshot_format)
+        for retailer, set_name in failed:
+            print('Failed: {} {}'.format(retailer, set_name), file=sys.stderr)
+        return
+
+    from customized_auto_scrapper import run_daily
+
+    run_daily(driver_class=args.driver_class, set_names=args.sets, metrics_path=args.metrics, log_path=args.log,
+              snapshot_format=args.snapshot_format)
+
+
+def ingest(args: argparse.Namespace):
+    import os
+
+    import pandas as pd
+
+    from customized_auto_scrapper import ingest_pipline
+    from utils.logger import configure_logging
+    from utils.metrics import configure_metrics
+
+    configure_logging(args.log)
+    configure_metrics(args.metrics)
+    if args.retry_pending:
+        from customized_auto_scrapper import retry_pending
+
+        for path in retry_pending(model_path=args.model, predictions_path=args.predictions, cube_path=args.cube,
+                                  lifecycle_dir=args.lifecycle_dir):
+            print('Still failing: {}'.format(path), file=sys.stderr)
+    for path in args.paths:
+        set_name = args.set_name or os.path.splitext(os.path.basename(path))[0]
+        rows = ingest_pipline(pd.read_pickle(path), today=args.date, save_single_pkl=not args.no_save_single,
+                              set_name=set_name, snapshot_format=args.snapshot_format, model_path=args.model,
+                              predictions_path=args.predictions, cube_path=args.cube,
+                              lifecycle_dir=args.lifecycle_dir)
+        print('{}: {} rows ingested'.format(path, rows))
+
+
+def train(args: argparse.Namespace):
+    from model.pricer import DiamondPricer
+    from preprocessing.dataset import TrainingSetBuilder
+
+    if args.segment_by:
+        from model.segmented import SegmentedPricer
+
+        pricer = SegmentedPricer(segment_by=args.segment_by, n_jobs=args.n_jobs)
+    else:
+        pricer = DiamondPricer(cv=args.tune)
+
+    builder = TrainingSetBuilder(args.store, preprocessor_params=pricer.preprocessor_params,
+                                 lifecycle_dir=args.lifecycle_dir)
+    X, y = builder.load(start=args.start, end=args.end, n_per_stratum=args.n_per_stratum, frac=args.frac,
+                        random_state=args.random_state)
+    print('Training on {} rows'.format(X.shape[0]))
+    if args.feature_cache:
+        from preprocessing.feature_store import FeatureStore
+
+        features = FeatureStore(args.feature_cache).transform(X, pricer)
+        pricer.fit_features(features, y.values, X=X, tune=bool(args.tune))
+    else:
+        pricer.fit(X, y, tune=bool(args.tune))
+    if args.explain_global:
+        pricer.explain_global(X)
+    pricer.save(args.model)
+    print('Model saved to {}'.format(args.model))
+
+
+def score(args: argparse.Namespace):
+    import os
+
+    import pandas as pd
+
+    from ingest.lifecycle import attach_days_on_market
+    from model.base import BaseModel
+
+    if os.path.splitext(args.store)[1] == '.parquet':
+        df = pd.read_parquet(args.store, filters=[('Stock No.', 'in', args.stock_numbers)])
+        if 'Stock No.' in df.columns:
+            df.set_index('Stock No.', inplace=True)
+    else:
+        df = pd.read_pickle(args.store)
+        df = df[df.index.isin(args.stock_numbers)]
+    df = df[~df.index.duplicated(keep='last')]
+    missing = sorted(set(args.stock_numbers) - set(df.index))
+    if missing:
+        print('Not found: {}'.format(', '.join(missing)), file=sys.stderr)
+    if df.shape[0] == 0:
+        return
+
+    df = attach_days_on_market(df, lifecycle_dir=args.lifecycle_dir)
+    model = BaseModel.load(args.model)
+    result = pd.DataFrame({'Price': df['Price'].values, 'Predicted Price': model.predict(df.copy())},
+                          index=df.index)
+    if args.interval:
+        quantiles = (0.05, 0.5, 0.95)
+        interval = model.predict_interval(df.copy(), quantiles=quantiles)
+        for i, q in enumerate(quantiles):
+            result['P{:g}'.format(100 * q)] = interval[:, i]
+    print(result.round(0).to_string())
+
+
+def search(args: argparse.Namespace):
+    import pandas as pd
+
+    from query.engine import run
+
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(run(args))
+
+
+def comparables(args: argparse.Namespace):
+    import pandas as pd
+
+    from query.comparables import run
+
+    result = run(args)
+    missing = sorted(set(args.stock_numbers) - set(result['Query']))
+    if missing:
+        print('Not found: {}'.format(', '.join(missing)), file=sys.stderr)
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(result.round(3).to_string())
+
+
+def watch(args: argparse.Namespace):
+    import pandas as pd
+
+    from ingest.alerts import add_watchlist, load_watchlists, remove_watchlist
+
+    if args.action == 'add':
+        if not args.name:
+            print('watch add requires --name', file=sys.stderr)
+            sys.exit(2)
+        ranges = {key: getattr(args, key) for key in ['carat', 'price', 'price_per_carat'] if getattr(args, key)}
+        categories = {key: getattr(args, key) for key in ['shape', 'cut', 'color', 'clarity'] if getattr(args, key)}
+        watchlist = add_watchlist(args.name, ranges=ranges, categories=categories, events=args.events,
+                                  min_drop=args.min_drop, path=args.watchlists)
+        print('Watchlist {} saved'.format(watchlist['id']))
+    elif args.action == 'remove':
+        for watchlist_id in args.ids:
+            if not remove_watchlist(watchlist_id, path=args.watchlists):
+                print('Not found: {}'.format(watchlist_id), file=sys.stderr)
+    else:
+        watchlists = load_watchlists(args.watchlists)
+        with pd.option_context('display.width', 200, 'display.max_colwidth', 80):
+            print(pd.DataFrame(watchlists, columns=['id', 'name', 'ranges', 'categories', 'events', 'min_drop',
+                                                    'created']).to_string(index=False))
+
+
+def _add_search_arguments(parser: argparse.ArgumentParser):
+    # Mirrors query.engine.build_parser(), duplicated so that `--help` doesn't import pandas
+    parser.add_argument('--store', default='data/blue_niles_df.pkl', help='Historical store path.')
+    parser.add_argument('--index', default='data/blue_niles_index.pkl', help='Cached index path.')
+    for key in ['carat', 'price', 'price_per_carat']:
+        parser.add_argument('--{}'.format(key.replace('_', '-')), type=float, nargs=2, metavar=('MIN', 'MAX'))
+    for key in ['shape', 'cut', 'color', 'clarity']:
+        parser.add_argument('--{}'.format(key), nargs='+')
+    parser.add_argument('--in-stock', action='store_true', help='Only stones available in the latest scrape.')
+    parser.add_argument('--order', default='price', choices=['carat', 'price', 'price_per_carat'])
+    parser.add_argument('--desc', action='store_true', help='Largest first.')
+    parser.add_argument('--top', type=int, default=10)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='diamond-digger', description='DiamondDigger command line tools.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sub = subparsers.add_parser('scrape', help='Scrape and ingest the daily filter sets.')
+    sub.add_argument('--driver-class', default='chrome')
+    sub.add_argument('--sets', nargs='+', help='carat_range set names to run, default is all sets.')
+    sub.add_argument('--retailers', nargs='+',
+                     help='Scrape these retailers concurrently (see scrapper.adapters.ADAPTERS), i.e. bluenile.')
+    sub.add_argument('--drivers-per-retailer', type=int, default=1,
+                     help='Max browsers scraping the same retailer at the same time, only with --retailers.')
+    sub.add_argument('--snapshot-format', default='delta', choices=['delta', 'full'],
+                     help="Save each set's snapshot as a delta of the previous day, or as a full pickle.")
+    sub.add_argument('--metrics', default='data/metrics.jsonl', help='Timing spans output path.')
+    sub.add_argument('--log', default='data/log.txt', help='Rotating log file path.')
+    sub.set_defaults(func=scrape)
+
+    sub = subparsers.add_parser('ingest', help='Ingest already scraped (raw) DataFrame pickles.')
+    sub.add_argument('paths', nargs='*', help='Raw DataFrame pickle paths, as returned by the scrappers.')
+    sub.add_argument('--set-name', help='Filter set name, default is the file name.')
+    sub.add_argument('--date', type=_parse_date, help='Scrape date YYYY-MM-DD, default is today.')
+    sub.add_argument('--no-save-single', action='store_true', help="Don't save the single transformed snapshot.")
+    sub.add_argument('--snapshot-format', default='delta', choices=['delta', 'full'],
+                     help="Save the single snapshot as a delta of the previous day, or as a full pickle.")
+    sub.add_argument('--model', default='data/pricer.pkl')
+    sub.add_argument('--predictions', default='data/predictions.pkl')
+    sub.add_argument('--cube', default='data/market_cube.pkl')
+    sub.add_argument('--lifecycle-dir', default='data/lifecycle')
+    sub.add_argument('--retry-pending', action='store_true',
+                     help='First re-run post-upsert stages failed on earlier ingests, saved in data/pending.')
+    sub.add_argument('--metrics', default='data/metrics.jsonl', help='Timing spans output path.')
+    sub.add_argument('--log', default='data/log.txt', help='Rotating log file path.')
+    sub.set_defaults(func=ingest)
+
+    sub = subparsers.add_parser('train', help='Train and save a pricer from the historical store.')
+    sub.add_argument('--store', default='data/blue_niles_df.pkl', help='Historical store, pickle or parquet.')
+    sub.add_argument('--model', default='data/pricer.pkl', help='Output model path.')
+    sub.add_argument('--start', type=_parse_date, help='Keep stones still available on or after this date.')
+    sub.add_argument('--end', type=_parse_date, help='Keep stones first available on or before this date.')
+    sub.add_argument('--n-per-stratum', type=int, help='Rows sampled per Shape x carat band stratum.')
+    sub.add_argument('--frac', type=float, help='Fraction of rows uniformly sampled.')
+    sub.add_argument('--random-state', type=int, default=0)
+    sub.add_argument('--tune', choices=['GridSearch', 'RandomizedSearch'], help='Tune before fitting.')
+    sub.add_argument('--segment-by', choices=['Shape', 'carat_band'], help='Train one sub-model per segment.')
+    sub.add_argument('--n-jobs', type=int, default=-1, help='Worker processes of segmented training.')
+    sub.add_argument('--explain-global', action='store_true', help='Save global feature importance with model.')
+    sub.add_argument('--lifecycle-dir', default='data/lifecycle', help="Listing lifecycle of 'Days On Market'.")
+    sub.add_argument('--feature-cache', help='Reuse preprocessed features cached in this directory, i.e. '
+                                             'data/features, the preprocessor is fitted once per preprocessor_params.')
+    sub.set_defaults(func=train)
+
+    sub = subparsers.add_parser('score', help='Price stones of the historical store with a saved pricer.')
+    sub.add_argument('stock_numbers', nargs='+')
+    sub.add_argument('--store', default='data/blue_niles_df.pkl', help='Historical store, pickle or parquet.')
+    sub.add_argument('--model', default='data/pricer.pkl')
+    sub.add_argument('--lifecycle-dir', default='data/lifecycle')
+    sub.add_argument('--interval', action='store_true', help='Also print the 5%%-95%% fair price range.')
+    sub.set_defaults(func=score)
+
+    sub = subparsers.add_parser('search', help='Search diamonds by conditions.')
+    _add_search_arguments(sub)
+    sub.set_defaults(func=search)
+
+    sub = subparsers.add_parser('comparables', help='Find the most similar stones of listed stones.')
+    sub.add_argument('stock_numbers', nargs='+')
+    sub.add_argument('--k', type=int, default=10, help='Number of comparables per stone.')
+    sub.add_argument('--store', default='data/blue_niles_df.pkl', help='Historical store path.')
+    sub.add_argument('--model', default='data/pricer.pkl', help='Pricer defining the feature space.')
+    sub.add_argument('--index', default='data/comparables_index.pkl', help='Cached index path.')
+    sub.add_argument('--lifecycle-dir', default='data/lifecycle', help="Listing lifecycle of 'Days On Market'.")
+    sub.set_defaults(func=comparables)
+
+    sub = subparsers.add_parser('watch', help='Manage watchlists alerted on new and cheaper stones at each ingest.')
+    sub.add_argument('action', choices=['add', 'list', 'remove'])
+    sub.add_argument('ids', nargs='*', type=int, help='Watchlist ids to remove.')
+    sub.add_argument('--name', help='Watchlist name, required by add.')
+    for key in ['carat', 'price', 'price_per_carat']:
+        sub.add_argument('--{}'.format(key.replace('_', '-')), type=float, nargs=2, metavar=('MIN', 'MAX'))
+    for key in ['shape', 'cut', 'color', 'clarity']:
+        sub.add_argument('--{}'.format(key), nargs='+')
+    sub.add_argument('--events', nargs='+', choices=['new', 'price_drop'], help='Default is both.')
+    sub.add_argument('--min-drop', type=float, default=0.0, help='Minimum relative price drop, i.e. 0.05 for 5%%.')
+    sub.add_argument('--watchlists', default='data/watchlists.json', help='Watchlists file.')
+    sub.set_defaults(func=watch)
+
+    return parser
+
+
+def main(argv: List = None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
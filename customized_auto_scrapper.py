@@ -1,43 +1,133 @@
+import glob
 import logging
 import os
+import pickle
 from datetime import date
 from datetime import datetime
-from typing import List
+from typing import Dict, List
 
 import pandas as pd
 
-from scrapper.blue_niles import DriverBlueNileScrapper
+from ingest.alerts import PREVIOUS_PRICE_COLUMN, effective_price, send_alerts
+from ingest.cube import update_cube
+from ingest.lifecycle import ListingLifecycle, attach_days_on_market
+from ingest.scoring import score_changed_listings
+from ingest.snapshot import SnapshotStore
+from ingest.validation import save_quarantine, validate_raw
+from preprocessing.feature_store import FeatureStore
+from query.comparables import ComparablesIndex
+from scrapper import RETAILER_COLUMN
+from utils.logger import configure_logging, get_logger
+from utils.metrics import configure_metrics, span
 
-logging.basicConfig(filename='data/log.txt', filemode='a', format='%(asctime)s %(message)s', level=logging.INFO)
 
+LOGGER = get_logger(name="customized_auto_scrapper.py", level=logging.INFO)
 
-def auto_scrape_pipline(driver_class='chrome', url='https://www.bluenile.com/diamond-search',
-                        carat_set: List = None, price_set: List = None,
-                        save_single_pkl: bool = True, set_name: str = None):
-    logging.info('\n')
-    logging.info('================ Start Scrapping ===============')
-
-    today = date.today()
-    scrapper = DriverBlueNileScrapper(url=url, driver_class=driver_class)
-    df = scrapper.get_dynamic(carat_set=carat_set, price_set=price_set)
-
-    logging.info('===== Finish Scrapping =====')
-
-    # Drop Duplicates
-    df.drop_duplicates(inplace=True)
+# Stages run after the upsert, in order, see `run_post_upsert()`
+POST_UPSERT_STAGES = ['lifecycle', 'cube', 'alerts', 'features', 'score', 'comparables']
 
-    # Transform DataFrame
-    df = transformation(df)
 
-    logging.info('===== Finish Transformation =====')
+def auto_scrape_pipline(driver_class='chrome', url='https://www.bluenile.com/diamond-search',
+                        carat_set: List = None, price_set: List = None,
+                        save_single_pkl: bool = True, set_name: str = None, driver_pool=None,
+                        snapshot_format: str = 'delta', model_path: str = 'data/pricer.pkl',
+                        predictions_path: str = 'data/predictions.pkl',
+                        cube_path: str = 'data/market_cube.pkl', lifecycle_dir: str = 'data/lifecycle'):
+    from scrapper.blue_niles import DriverBlueNileScrapper
+
+    LOGGER.info('================ Start Scrapping ===============', extra={'set_name': set_name})
+
+    with span('filter_set', set_name=set_name) as filter_set_record:
+        today = date.today()
+        scrapper = DriverBlueNileScrapper(url=url, driver_class=driver_class, driver_pool=driver_pool)
+        df = scrapper.get_dynamic(carat_set=carat_set, price_set=price_set)
+
+        LOGGER.info('===== Finish Scrapping =====', extra={'stage': 'scrape', 'rows': df.shape[0]})
+
+        filter_set_record['rows'] = ingest_pipline(
+            df, today=today, save_single_pkl=save_single_pkl, set_name=set_name, snapshot_format=snapshot_format,
+            model_path=model_path, predictions_path=predictions_path, cube_path=cube_path, lifecycle_dir=lifecycle_dir
+        )
+
+    LOGGER.info('==================== Finish ====================',
+                extra={'stage': 'filter_set', 'set_name': set_name, 'rows': filter_set_record['rows'],
+                       'duration': filter_set_record['duration']})
+
+
+def ingest_pipline(df, today: date = None, save_single_pkl: bool = True, set_name: str = None,
+                   retailer: str = 'bluenile', snapshot_format: str = 'delta', snapshot_dir: str = 'data/snapshots',
+                   store_path: str = 'data/blue_niles_df.pkl', model_path: str = 'data/pricer.pkl',
+                   predictions_path: str = 'data/predictions.pkl', cube_path: str = 'data/market_cube.pkl',
+                   lifecycle_dir: str = 'data/lifecycle', comparables_path: str = 'data/comparables_index.pkl',
+                   feature_cache_dir: str = 'data/features', watchlist_path: str = 'data/watchlists.json',
+                   outbox_path: str = 'data/alerts_outbox.jsonl', pending_dir: str = 'data/pending') -> int:
+    """
+    Ingest one scraped (raw) DataFrame of a filter set: validate, transform, save, upsert into the main DataFrame,
+    then update lifecycle, market cube and predictions. Rows failing validation are quarantined to
+    `data/<date>/quarantine_<set>.pkl`. Stages after the upsert don't raise, failed ones are saved to `pending_dir`
+    for `retry_pending()`, see `run_post_upsert()`.
+
+    Args:
+        df: Raw DataFrame of a filter set.
+        today: Scrape date, default is today.
+        save_single_pkl: If True then save today's single (transformed) DataFrame.
+        set_name: Filter set name.
+        retailer: Retailer of rows without a RETAILER_COLUMN, see `scrapper.adapters.RetailerAdapter.normalize()`.
+        snapshot_format: Format of the single DataFrame, must be one of ['delta', 'full']. 'delta' stores changes
+            against the previous day in `snapshot_dir` (see SnapshotStore), 'full' writes
+            `data/<date>/blue_niles_df_<set>.pkl`.
+        snapshot_dir: Root directory of delta snapshots.
+        store_path: Historical store (main DataFrame) path.
+        model_path, predictions_path, cube_path, lifecycle_dir: See `score_changed_listings()`, `update_cube()` and
+            ListingLifecycle.
+        comparables_path: Comparables index, updated by today's delta if it's been built, see ComparablesIndex.
+        feature_cache_dir: Cached feature matrices, synced with the stones seen today if any, see FeatureStore.
+        watchlist_path, outbox_path: Today's delta is matched against saved watchlists if any, alerts are appended
+            to the outbox, see `send_alerts()`.
+        pending_dir: Directory of saved inputs of failed post-upsert stages.
+
+    Returns: number of ingested rows
+
+    """
+    if today is None:
+        today = date.today()
+    if snapshot_format not in ['delta', 'full']:
+        raise ValueError("Invalid snapshot_format, should be one of ['delta', 'full']")
+
+    with span('validate', set_name=set_name) as record:
+        # Drop Duplicates
+        df.drop_duplicates(inplace=True)
+
+        # Quarantine malformed rows instead of failing the whole filter set
+        df, quarantine = validate_raw(df)
+        record['rows'] = df.shape[0]
+        record['quarantined'] = quarantine.shape[0]
+        if quarantine.shape[0]:
+            save_quarantine(quarantine, today=today, set_name=set_name)
+
+    LOGGER.info('===== Finish Validation, {} rows quarantined ====='.format(quarantine.shape[0]),
+                extra=_log_fields(record))
+
+    with span('transform', set_name=set_name) as record:
+        # Transform DataFrame
+        df = transformation(df)
+        if RETAILER_COLUMN not in df.columns:
+            df[RETAILER_COLUMN] = retailer
+        record['rows'] = df.shape[0]
+
+    LOGGER.info('===== Finish Transformation =====', extra=_log_fields(record))
 
     # Save today's single df
     if save_single_pkl:
-        if not os.path.exists('./data/{}'.format(today.strftime('%Y_%m_%d'))):
-            os.mkdir('./data/{}'.format(today.strftime('%Y_%m_%d')))
-        save_pkl(df, './data/{}/blue_niles_df_{}.pkl'.format(today.strftime('%Y_%m_%d'), set_name))
+        with span('save', rows=df.shape[0], set_name=set_name, snapshot_format=snapshot_format) as record:
+            if snapshot_format == 'delta':
+                SnapshotStore(snapshot_dir).write(df, set_name=set_name, today=today)
+            else:
+                if not os.path.exists('./data/{}'.format(today.strftime('%Y_%m_%d'))):
+                    os.mkdir('./data/{}'.format(today.strftime('%Y_%m_%d')))
+                save_pkl(df, './data/{}/blue_niles_df_{}.pkl'.format(today.strftime('%Y_%m_%d'), set_name))
 
-    logging.info('===== Finish save =====')
+        LOGGER.info('===== Finish save =====', extra=_log_fields(record))
 
     # Add new columns for update
     length = df.shape[0]
@@ -45,15 +135,163 @@ def auto_scrape_pipline(driver_class='chrome', url='https://www.bluenile.com/dia
     df['First Available Date'] = [today] * length
 
     # Update DataFrame to main DataFrame
-    logging.info('===== Start update =====')
-
-    if os.path.isfile('data/blue_niles_df.pkl'):
-        update(df)
-    else:
-        save_pkl(df, 'data/blue_niles_df.pkl')
-
-    logging.info('===== Finish update and save =====')
-    logging.info('==================== Finish ====================')
+    LOGGER.info('===== Start update =====')
+
+    with span('update', rows=length, set_name=set_name) as record:
+        if os.path.isfile(store_path):
+            # Version of the store the delta applies to, see ComparablesIndex.from_store()
+            store_mtime = os.path.getmtime(store_path)
+            delta, seen = update(df, main_df_path=store_path, return_delta=True, return_seen=True)
+        else:
+            store_mtime = None
+            save_pkl(df, store_path)
+            delta = seen = df
+        record['delta_rows'] = delta.shape[0]
+
+    LOGGER.info('===== Finish update and save =====', extra=_log_fields(record))
+
+    # Stages after the upsert never fail the filter set, the set is already stored and must not be scraped again
+    run_post_upsert(seen, delta, today=today, set_name=set_name, store_mtime=store_mtime, store_path=store_path,
+                    model_path=model_path, predictions_path=predictions_path, cube_path=cube_path,
+                    lifecycle_dir=lifecycle_dir, comparables_path=comparables_path,
+                    feature_cache_dir=feature_cache_dir, watchlist_path=watchlist_path, outbox_path=outbox_path,
+                    pending_dir=pending_dir)
+
+    return length
+
+
+def run_post_upsert(df, delta, today: date, set_name: str = None, stages: List = None, store_mtime: float = None,
+                    pending_dir: str = 'data/pending', store_path: str = 'data/blue_niles_df.pkl',
+                    model_path: str = 'data/pricer.pkl', predictions_path: str = 'data/predictions.pkl',
+                    cube_path: str = 'data/market_cube.pkl', lifecycle_dir: str = 'data/lifecycle',
+                    comparables_path: str = 'data/comparables_index.pkl', feature_cache_dir: str = 'data/features',
+                    watchlist_path: str = 'data/watchlists.json',
+                    outbox_path: str = 'data/alerts_outbox.jsonl') -> List:
+    """
+    Run the stages following an upsert on today's rows and delta, each stage on its own: a failed stage is logged
+    and doesn't stop the next ones. Once the upsert is saved a second `update()` returns an empty delta, so the
+    inputs of failed stages are saved to `pending_dir/<date>_<set>.pkl` and re-run by `retry_pending()` instead of
+    scraping the set again.
+
+    Args:
+        df: Store rows of the stones seen today after the upsert, i.e. `update(df, return_seen=True)`.
+        delta: New and re-priced rows, i.e. `update(df, return_delta=True)`.
+        today: Scrape date.
+        set_name: Filter set name.
+        stages: Subset of POST_UPSERT_STAGES to run, default is all of them.
+        store_mtime: Modification time of the store before the upsert, None if the upsert created it.
+        pending_dir: Directory of saved inputs of failed stages.
+        Others: See `ingest_pipline()`.
+
+    Returns: names of failed stages
+
+    """
+    failed = []
+    for stage in (stages or POST_UPSERT_STAGES):
+        try:
+            _post_upsert_stage(stage, df, delta, today=today, set_name=set_name, store_mtime=store_mtime,
+                               store_path=store_path, model_path=model_path, predictions_path=predictions_path,
+                               cube_path=cube_path, lifecycle_dir=lifecycle_dir, comparables_path=comparables_path,
+                               feature_cache_dir=feature_cache_dir, watchlist_path=watchlist_path,
+                               outbox_path=outbox_path)
+        except Exception:
+            LOGGER.exception('===== {} of filter set {} BREAK, saved for retry ====='.format(stage, set_name))
+            failed.append(stage)
+
+    if failed:
+        os.makedirs(pending_dir, exist_ok=True)
+        path = os.path.join(pending_dir, '{}_{}.pkl'.format(today.strftime('%Y_%m_%d'), set_name))
+        with open(path, 'wb') as f:
+            pickle.dump({'df': df, 'delta': delta, 'today': today, 'set_name': set_name, 'stages': failed,
+                         'store_mtime': store_mtime}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return failed
+
+
+def _post_upsert_stage(stage: str, df, delta, today: date, set_name: str = None, store_mtime: float = None,
+                       store_path: str = None, model_path: str = None, predictions_path: str = None,
+                       cube_path: str = None, lifecycle_dir: str = None, comparables_path: str = None,
+                       feature_cache_dir: str = None, watchlist_path: str = None, outbox_path: str = None):
+    if stage == 'lifecycle':
+        # Extend availability intervals of stones seen today
+        with span('lifecycle', rows=df.shape[0], set_name=set_name) as record:
+            lifecycle = ListingLifecycle(lifecycle_dir)
+            if not lifecycle.is_seeded and os.path.isfile(store_path):
+                # Stones already in the store keep their listing history instead of starting today
+                lifecycle.seed(pd.read_pickle(store_path))
+            lifecycle.update(df.index, today=today)
+        LOGGER.info('===== Finish lifecycle =====', extra=_log_fields(record))
+
+    elif stage == 'cube':
+        # Aggregate today's slice of the market cube
+        with span('cube', rows=df.shape[0], set_name=set_name) as record:
+            update_cube(df, delta=delta, today=today, set_name=set_name, cube_path=cube_path)
+        LOGGER.info('===== Finish cube =====', extra=_log_fields(record))
+
+    elif stage == 'alerts' and watchlist_path and os.path.isfile(watchlist_path):
+        # Alert watchlists about new and cheaper stones
+        with span('alerts', rows=delta.shape[0], set_name=set_name) as record:
+            record['alerts'] = send_alerts(delta, watchlist_path=watchlist_path, outbox_path=outbox_path,
+                                           today=today).shape[0]
+        LOGGER.info('===== Finish alerts, {} sent ====='.format(record['alerts']), extra=_log_fields(record))
+
+    elif stage == 'features' and feature_cache_dir and os.path.isdir(feature_cache_dir):
+        # Sync every stone seen today into the cached feature matrices, created on first use by
+        # `cli.py train --feature-cache`: new stones are appended, listed ones have a new 'Last Available Date'
+        with span('features', rows=df.shape[0], set_name=set_name) as record:
+            FeatureStore(feature_cache_dir).update(attach_days_on_market(df, lifecycle_dir=lifecycle_dir))
+        LOGGER.info('===== Finish feature cache =====', extra=_log_fields(record))
+
+    elif stage == 'score' and model_path and os.path.isfile(model_path):
+        # Score only new and re-priced stones with the latest saved pricer
+        with span('score', rows=delta.shape[0], set_name=set_name) as record:
+            score_changed_listings(attach_days_on_market(delta, lifecycle_dir=lifecycle_dir), model_path=model_path,
+                                   predictions_path=predictions_path, today=today)
+        LOGGER.info('===== Finish scoring {} records ====='.format(delta.shape[0]), extra=_log_fields(record))
+
+    elif stage == 'comparables' and model_path and os.path.isfile(model_path) \
+            and comparables_path and os.path.isfile(comparables_path):
+        # Add new stones to the comparables index, which is built on first use by `cli.py comparables`
+        with span('comparables', rows=delta.shape[0], set_name=set_name) as record:
+            ComparablesIndex.from_store(store_path, model_path=model_path, index_path=comparables_path,
+                                        delta=attach_days_on_market(delta, lifecycle_dir=lifecycle_dir),
+                                        delta_base_mtime=store_mtime, lifecycle_dir=lifecycle_dir)
+        LOGGER.info('===== Finish comparables =====', extra=_log_fields(record))
+
+
+def retry_pending(pending_dir: str = 'data/pending', **kwargs) -> List:
+    """
+    Re-run the failed post-upsert stages saved by `run_post_upsert()`, oldest first. A file is renamed to
+    `.retrying` while its stages run and removed once they return, stages still failing are saved again by
+    `run_post_upsert()`. The upsert is already stored, so these files are the only copy of the stages' inputs: a
+    retry killed halfway leaves its `.retrying` file, which is picked up by the next call.
+
+    Args:
+        pending_dir: Directory of saved inputs of failed stages.
+        kwargs: Paths passed to `run_post_upsert()`, see `ingest_pipline()`.
+
+    Returns: paths of pending files still failing
+
+    """
+    failing = []
+    paths = glob.glob(os.path.join(pending_dir, '*.pkl')) + glob.glob(os.path.join(pending_dir, '*.pkl.retrying'))
+    for path in sorted(paths):
+        retrying_path = path if path.endswith('.retrying') else path + '.retrying'
+        os.replace(path, retrying_path)
+        with open(retrying_path, 'rb') as f:
+            pending = pickle.load(f)
+        LOGGER.info('===== Retry {} of filter set {} ({}) ====='.format(
+            ', '.join(pending['stages']), pending['set_name'], pending['today']))
+        if run_post_upsert(pending['df'], pending['delta'], today=pending['today'], set_name=pending['set_name'],
+                           stages=pending['stages'], store_mtime=pending['store_mtime'], pending_dir=pending_dir,
+                           **kwargs):
+            failing.append(retrying_path[:-len('.retrying')])
+        os.remove(retrying_path)
+    return failing
+
+
+def _log_fields(record) -> dict:
+    # Structured log fields of a finished metrics span
+    return {key: record.get(key) for key in ['stage', 'rows', 'duration', 'set_name']}
 
 
 def save_pkl(df, path=None):
@@ -92,25 +330,69 @@ def find_year(day: str):
         return datetime.strptime(day + ' {}'.format(today.year + 1), '%b %d %Y').date()
 
 
-def update(df, main_df_path='./data/blue_niles_df.pkl', is_save=True):
+def update(df, main_df_path='./data/blue_niles_df.pkl', is_save=True, return_delta=False, return_seen=False):
+    """
+    Upsert today's DataFrame into the main DataFrame.
+
+    Args:
+        df: Today's transformed DataFrame, with 'First Available Date' and 'Last Available Date'.
+        main_df_path: Main DataFrame pickle path.
+        is_save: If True then save main DataFrame, else return it.
+        return_delta: If True then also return the delta, i.e. rows of the updated main DataFrame which are new or
+            re-priced (Price or Discount Price changed) today, with the effective price before today (see
+            `effective_price()`) in PREVIOUS_PRICE_COLUMN (missing for new stones).
+        return_seen: If True then also return the rows of the updated main DataFrame of every stone in df, i.e. all
+            rows changed by the upsert ('Last Available Date' moves on for every stone still listed).
+
+    Returns: main DataFrame if not is_save, delta if return_delta, seen rows if return_seen, a tuple in this order if
+        several.
+
+    """
     main_df = pd.read_pickle(main_df_path)
 
     # Update values for existing records
     update_column = ['Price', 'Discount Price', 'Price/Ct', 'Delivery Date', 'Last Available Date']
 
-    existing_index = set(df.index) & set(main_df.index)
+    existing_index = list(set(df.index) & set(main_df.index))
+    if return_delta:
+        repriced_index = find_repriced(df, main_df, existing_index)
+        previous_price = effective_price(main_df.loc[repriced_index]).groupby(level=0).last()
     main_df.loc[existing_index, update_column] = df.loc[existing_index, update_column]
-    logging.info('===== {} records updated ====='.format(len(existing_index)))
+    LOGGER.info('===== {} records updated ====='.format(len(existing_index)))
 
     # Add new records
     new_records = df[~df.index.isin(existing_index)]
     main_df = pd.concat([main_df, new_records])
-    logging.info('===== {} new records ====='.format(new_records.shape[0]))
+    LOGGER.info('===== {} new records ====='.format(new_records.shape[0]))
 
+    output = []
     if is_save:
         save_pkl(main_df, main_df_path)
     else:
-        return main_df
+        output.append(main_df)
+    if return_delta:
+        delta = main_df[main_df.index.isin(new_records.index.union(repriced_index))]
+        delta = delta[~delta.index.duplicated(keep='last')]
+        delta = delta.assign(**{PREVIOUS_PRICE_COLUMN: previous_price.reindex(delta.index).values})
+        LOGGER.info('===== {} records re-priced ====='.format(len(repriced_index)))
+        output.append(delta)
+    if return_seen:
+        seen = main_df[main_df.index.isin(df.index)]
+        output.append(seen[~seen.index.duplicated(keep='last')])
+
+    if len(output) == 1:
+        return output[0]
+    elif output:
+        return tuple(output)
+
+
+def find_repriced(df, main_df, index, price_columns=('Price', 'Discount Price')):
+    """
+    Find stock numbers in given index whose prices in df differ from main_df.
+    """
+    new_prices = df.loc[index, list(price_columns)].groupby(level=0).last()
+    old_prices = main_df.loc[index, list(price_columns)].groupby(level=0).last().reindex(new_prices.index)
+    return new_prices.index[(new_prices.values != old_prices.values).any(axis=1)]
 
 
 ###### Hard Code Filters #####
@@ -147,28 +429,95 @@ price_range = {
     'price_range_123': [Price] * 11,
 }
 
-if __name__ == "__main__":
-    # Total hard coded filter sets are 6
-    logging.info("\n\n\nToday is {} \n".format(str(date.today())))
-    for i in range(6):
-        carat_set_name = list(carat_range.keys())[i]
-        price_set_name = list(price_range.keys())[i]
 
-        try:
-            auto_scrape_pipline(carat_set=carat_range[carat_set_name], price_set=price_range[price_set_name],
-                                set_name=carat_set_name)
-        except:
-            logging.info('filter set {}, {} BREAK!!!'.format(carat_set_name, price_set_name))
-            logging.info('TRY AGAIN')
+def run_daily(driver_class: str = 'chrome', set_names: List = None, metrics_path: str = 'data/metrics.jsonl',
+              log_path: str = 'data/log.txt', snapshot_format: str = 'delta'):
+    """
+    Scrape and ingest the hard coded filter sets, each set is retried once.
+
+    Args:
+        driver_class: Web driver class.
+        set_names: Names of carat_range sets to run, default is all 6 sets.
+        metrics_path: Per-stage timing spans output, summarize with `python -m utils.metrics`.
+        log_path: Rotating log file.
+        snapshot_format: Format of each set's single DataFrame, must be one of ['delta', 'full'].
+    """
+    from scrapper.driver_pool import DriverPool
+
+    configure_logging(log_path)
+    configure_metrics(metrics_path)
+    LOGGER.info("Today is {}".format(str(date.today())))
+    # Finish post-upsert stages failed on previous runs before today's upserts
+    retry_pending()
+    # Keep headless drivers warm across filter sets, drivers broken by a failed set are quit when the pool closes
+    with DriverPool(driver_class=driver_class) as pool:
+        for carat_set_name, price_set_name in zip(carat_range, price_range):
+            if set_names is not None and carat_set_name not in set_names:
+                continue
+
             try:
-                auto_scrape_pipline(carat_set=carat_range[carat_set_name], price_set=price_range[price_set_name],
-                                    set_name=carat_set_name)
+                auto_scrape_pipline(driver_class=driver_class, carat_set=carat_range[carat_set_name],
+                                    price_set=price_range[price_set_name], set_name=carat_set_name, driver_pool=pool,
+                                    snapshot_format=snapshot_format)
             except:
-                logging.info(
-                    'filter set {}, {} BREAK AGAIN!!! REQUIRE MANUAL CHECK!!!'.format(carat_set_name, price_set_name))
-            continue
+                LOGGER.exception('filter set {}, {} BREAK!!!'.format(carat_set_name, price_set_name))
+                LOGGER.info('TRY AGAIN')
+                try:
+                    auto_scrape_pipline(driver_class=driver_class, carat_set=carat_range[carat_set_name],
+                                        price_set=price_range[price_set_name], set_name=carat_set_name,
+                                        driver_pool=pool, snapshot_format=snapshot_format)
+                except:
+                    LOGGER.exception('filter set {}, {} BREAK AGAIN!!! REQUIRE MANUAL CHECK!!!'.format(
+                        carat_set_name, price_set_name))
+                continue
+
+            LOGGER.info('=====Finish filter set {}, {}====='.format(carat_set_name, price_set_name))
+
+
+def run_retailers(retailers: List = None, driver_class: str = 'chrome', drivers_per_retailer: int = 1,
+                  set_names: List = None, metrics_path: str = 'data/metrics.jsonl', log_path: str = 'data/log.txt',
+                  snapshot_format: str = 'delta') -> Dict:
+    """
+    Scrape several retailers concurrently and ingest them into the one store, rows are told apart by
+    RETAILER_COLUMN. Each set is retried once.
+
+    Args:
+        retailers: Retailer names registered in `scrapper.adapters.ADAPTERS`, default is all of them.
+        driver_class: Web driver class.
+        drivers_per_retailer: Max number of browsers scraping the same retailer at the same time.
+        set_names: Names of filter sets to run, default is all sets of each retailer.
+        metrics_path: Per-stage timing spans output, summarize with `python -m utils.metrics`.
+        log_path: Rotating log file.
+        snapshot_format: Format of each set's single DataFrame, must be one of ['delta', 'full'].
+
+    Returns: {(retailer, set_name): exception} of failed sets
+
+    """
+    from scrapper.adapters import ADAPTERS, get_adapter
+    from scrapper.scheduler import RetailerScheduler
+
+    configure_logging(log_path)
+    configure_metrics(metrics_path)
+    LOGGER.info("Today is {}".format(str(date.today())))
+    today = date.today()
+    retry_pending()
+
+    adapters = [get_adapter(retailer) for retailer in (retailers or list(ADAPTERS))]
+    filter_sets = {adapter.retailer: {name: sets for name, sets in adapter.filter_sets().items()
+                                      if set_names is None or name in set_names}
+                   for adapter in adapters}
 
-        logging.info('=====Finish filter set {}, {}====='.format(carat_set_name, price_set_name))
+    def sink(adapter, set_name, df):
+        # Runs in this thread only, the store and snapshots are never written concurrently
+        rows = ingest_pipline(df, today=today, set_name=set_name, retailer=adapter.retailer,
+                              snapshot_format=snapshot_format)
+        LOGGER.info('=====Finish {} filter set {}====='.format(adapter.retailer, set_name),
+                    extra={'stage': 'filter_set', 'rows': rows, 'set_name': set_name})
 
+    scheduler = RetailerScheduler(adapters, driver_class=driver_class, drivers_per_retailer=drivers_per_retailer)
+    return scheduler.run(sink, filter_sets=filter_sets)
 
 
+if __name__ == "__main__":
+    # Total hard coded filter sets are 6
+    run_daily()
@@ -0,0 +1,277 @@
+"""
+Price alerts: saved watchlists matched against each ingest's upsert delta.
+
+To use:
+    python cli.py watch add --name "1ct round" --carat 1 1.2 --shape Round --price 0 8000 --events new price_drop
+    python cli.py watch list
+    python cli.py watch remove 3
+"""
+import json
+import logging
+import os
+from datetime import date
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from query.engine import CATEGORY_COLUMNS, RANGE_COLUMNS
+from utils.logger import get_logger
+
+
+LOGGER = get_logger(name="alerts.py", level=logging.INFO)
+
+# Effective price of a re-priced stone before today's upsert, missing for new stones, see
+# `update(df, return_delta=True)`
+PREVIOUS_PRICE_COLUMN = 'Previous Price'
+EVENTS = ['new', 'price_drop']
+ALERT_COLUMNS = ['Shape', 'Carat', 'Cut', 'Color', 'Clarity', 'Price', 'Discount Price', 'Retailer']
+# Bound on delta rows x watchlists bytes held at once while matching
+MATCH_CHUNK_BYTES = 64 * 1024 ** 2
+
+
+def effective_price(df: pd.DataFrame) -> pd.Series:
+    """
+    Price a buyer pays: 'Discount Price' when there's one, else 'Price'.
+    """
+    if 'Discount Price' not in df.columns:
+        return df['Price'].astype(np.float64)
+    return df['Discount Price'].astype(np.float64).fillna(df['Price'].astype(np.float64))
+
+
+def load_watchlists(path: str = 'data/watchlists.json') -> List[Dict]:
+    if not os.path.isfile(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_watchlists(watchlists: List[Dict], path: str = 'data/watchlists.json'):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(watchlists, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def add_watchlist(name: str, ranges: Dict = None, categories: Dict = None, events: List[str] = None,
+                  min_drop: float = 0.0, path: str = 'data/watchlists.json') -> Dict:
+    """
+    Save a watchlist, i.e. the predicates of a search (see `DiamondQueryEngine.query()`) to be alerted about.
+
+    Args:
+        name: Display name.
+        ranges: Dict, {'carat' | 'price' | 'price_per_carat': (low, high)}, None bound means unbounded.
+        categories: Dict, {'shape' | 'cut' | 'color' | 'clarity': [allowed values]}.
+        events: Subset of EVENTS, 'new' for newly listed stones and 'price_drop' for re-priced cheaper ones.
+            Default is both.
+        min_drop: Minimum relative price drop of a 'price_drop' alert, i.e. 0.05 for 5%.
+        path: Watchlists file.
+
+    Returns: Dict, the saved watchlist with its id
+
+    """
+    ranges = {key: list(bound) for key, bound in (ranges or {}).items()}
+    categories = {key: list(values) for key, values in (categories or {}).items()}
+    events = list(events or EVENTS)
+    for key in ranges:
+        if key not in RANGE_COLUMNS:
+            raise ValueError("Invalid range {}, should be one of {}".format(key, list(RANGE_COLUMNS)))
+    for key in categories:
+        if key not in CATEGORY_COLUMNS:
+            raise ValueError("Invalid category {}, should be one of {}".format(key, list(CATEGORY_COLUMNS)))
+    for event in events:
+        if event not in EVENTS:
+            raise ValueError("Invalid event {}, should be one of {}".format(event, EVENTS))
+
+    watchlists = load_watchlists(path)
+    watchlist = {
+        'id': max([w['id'] for w in watchlists], default=0) + 1,
+        'name': name,
+        'ranges': ranges,
+        'categories': categories,
+        'events': events,
+        'min_drop': min_drop,
+        'created': date.today().isoformat(),
+    }
+    save_watchlists(watchlists + [watchlist], path)
+    return watchlist
+
+
+def remove_watchlist(watchlist_id: int, path: str = 'data/watchlists.json') -> bool:
+    watchlists = load_watchlists(path)
+    kept = [w for w in watchlists if w['id'] != watchlist_id]
+    save_watchlists(kept, path)
+    return len(kept) < len(watchlists)
+
+
+class WatchlistIndex:
+    """
+    Watchlists compiled into one lookup table per predicate column, whose entries are bitsets of the watchlists
+    accepting a value:
+        - interval index on Carat, Price and Price/Ct: all range bounds cut the axis into elementary segments
+          (bound points and the gaps between them), each segment stores the watchlists whose range covers it.
+        - inverted index on Shape, Cut, Color and Clarity: each value stores the watchlists allowing it, unlisted
+          values only match watchlists without a predicate on the column.
+    A delta row is matched against every watchlist at once by a binary search (or hash lookup) per column and an
+    AND of the bitsets, so matching costs O(changed rows x (log(watchlists) + watchlists / 8)) and never touches
+    the rest of the catalog.
+
+    To use:
+        index = WatchlistIndex(load_watchlists('data/watchlists.json'))
+        alerts = index.match(delta)
+    """
+    def __init__(self, watchlists: List[Dict]):
+        self.watchlists = list(watchlists)
+        self.n_watchlists = len(self.watchlists)
+        self.ids = np.array([w['id'] for w in self.watchlists], dtype=np.int64)
+        # {column: (sorted bound points, packed bitset of each segment)}
+        self.interval_index = {}
+        # {column: (pd.Index of values, packed bitset of each value followed by the unlisted value's)}
+        self.inverted_index = {}
+        self.build()
+
+    def build(self):
+        for key, col in RANGE_COLUMNS.items():
+            bounds = [w['ranges'].get(key) for w in self.watchlists]
+            if not any(bounds):
+                continue
+            points = np.unique([value for bound in bounds if bound for value in bound if value is not None])
+            # Segment 2j is the gap before points[j], segment 2j+1 is points[j] itself, the last row is the missing
+            # value's, in no range
+            table = np.zeros((2 * len(points) + 2, self.n_watchlists), dtype=bool)
+            for i, bound in enumerate(bounds):
+                low, high = bound if bound else (None, None)
+                start = 0 if low is None else 2 * np.searchsorted(points, low) + 1
+                end = 2 * len(points) if high is None else 2 * np.searchsorted(points, high) + 1
+                table[start:end + 1, i] = True
+            # A watchlist without a predicate on the column accepts missing values too
+            table[-1] = [not bound for bound in bounds]
+            self.interval_index[col] = (points, np.packbits(table, axis=1))
+
+        for key, col in CATEGORY_COLUMNS.items():
+            allowed = [w['categories'].get(key) for w in self.watchlists]
+            if not any(allowed):
+                continue
+            values = pd.Index(sorted({value for values in allowed if values for value in values}))
+            table = np.zeros((len(values) + 1, self.n_watchlists), dtype=bool)
+            for i, values_i in enumerate(allowed):
+                if values_i:
+                    table[values.get_indexer(values_i), i] = True
+                else:
+                    table[:, i] = True
+            self.inverted_index[col] = (values, np.packbits(table, axis=1))
+
+    def _segments(self, col: str, values: np.ndarray) -> np.ndarray:
+        points, _ = self.interval_index[col]
+        position = np.searchsorted(points, values)
+        on_point = np.zeros(len(values), dtype=bool)
+        inside = position < len(points)
+        on_point[inside] = points[position[inside]] == values[inside]
+        segments = 2 * position + on_point
+        # NaN sorts after every point, send it to the missing value's row instead of the last segment
+        segments[np.isnan(values)] = 2 * len(points) + 1
+        return segments
+
+    def _codes(self, col: str, values: np.ndarray) -> np.ndarray:
+        index, _ = self.inverted_index[col]
+        codes = index.get_indexer(values)
+        codes[codes < 0] = len(index)
+        return codes
+
+    def candidates(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Packed bitsets of the watchlists whose predicates accept each row.
+
+        Returns: uint8 array (len(df), ceil(n_watchlists / 8)), see `np.unpackbits`.
+
+        """
+        bits = np.full((df.shape[0], (self.n_watchlists + 7) // 8), 255, dtype=np.uint8)
+        for col, (_, table) in self.interval_index.items():
+            bits &= table[self._segments(col, df[col].values.astype(np.float64))]
+        for col, (_, table) in self.inverted_index.items():
+            bits &= table[self._codes(col, df[col].astype(str).values)]
+        return bits
+
+    def match(self, delta: pd.DataFrame, today: date = None) -> pd.DataFrame:
+        """
+        Match new and re-priced stones against every watchlist in one pass.
+
+        Args:
+            delta: New and re-priced rows with PREVIOUS_PRICE_COLUMN, i.e. `update(df, return_delta=True)`. Rows
+                without a previous price are new stones. Drops compare effective prices, see `effective_price()`.
+            today: Alert date, default is today.
+
+        Returns: pd.DataFrame of alerts, one row per (watchlist, stone) |Watchlist|Watchlist Name|Event|Stock No.|
+            ALERT_COLUMNS|Previous Price|Date|
+
+        """
+        if today is None:
+            today = date.today()
+        columns = ['Watchlist', 'Watchlist Name', 'Event', 'Stock No.'] \
+            + [col for col in ALERT_COLUMNS if col in delta.columns] + [PREVIOUS_PRICE_COLUMN, 'Date']
+        if self.n_watchlists == 0 or delta.shape[0] == 0:
+            return pd.DataFrame(columns=columns)
+
+        if PREVIOUS_PRICE_COLUMN in delta.columns:
+            previous = delta[PREVIOUS_PRICE_COLUMN].values.astype(np.float64)
+        else:
+            previous = np.full(delta.shape[0], np.nan)
+        is_new = np.isnan(previous)
+        # Relative drop of each row's effective price, 0 for new stones and price increases
+        drop = np.zeros(delta.shape[0])
+        drop[~is_new] = 1 - effective_price(delta).values[~is_new] / previous[~is_new]
+
+        wants_new = np.array(['new' in w['events'] for w in self.watchlists])
+        wants_drop = np.array(['price_drop' in w['events'] for w in self.watchlists])
+        min_drop = np.array([w.get('min_drop', 0.0) for w in self.watchlists], dtype=np.float64)
+
+        rows, positions = [], []
+        chunk_size = max(MATCH_CHUNK_BYTES // max(self.n_watchlists, 1), 1)
+        for start in range(0, delta.shape[0], chunk_size):
+            bits = self.candidates(delta.iloc[start:start + chunk_size])
+            row, position = np.nonzero(np.unpackbits(bits, axis=1, count=self.n_watchlists))
+            rows.append(row + start)
+            positions.append(position)
+        rows, positions = np.concatenate(rows), np.concatenate(positions)
+
+        # Event filter on matched pairs only
+        new_event = is_new[rows] & wants_new[positions]
+        drop_event = ~is_new[rows] & wants_drop[positions] & (drop[rows] > 0) & (drop[rows] >= min_drop[positions])
+        keep = new_event | drop_event
+        rows, positions, new_event = rows[keep], positions[keep], new_event[keep]
+
+        alerts = pd.DataFrame({
+            'Watchlist': self.ids[positions],
+            'Watchlist Name': [self.watchlists[i]['name'] for i in positions],
+            'Event': np.where(new_event, 'new', 'price_drop'),
+            'Stock No.': delta.index.values[rows],
+        })
+        for col in columns[4:-2]:
+            alerts[col] = delta[col].values[rows]
+        alerts[PREVIOUS_PRICE_COLUMN] = previous[rows]
+        alerts['Date'] = today.isoformat()
+        return alerts.sort_values(['Watchlist', 'Event', 'Price'], kind='stable').reset_index(drop=True)
+
+
+def send_alerts(delta: pd.DataFrame, watchlist_path: str = 'data/watchlists.json',
+                outbox_path: str = 'data/alerts_outbox.jsonl', today: date = None) -> pd.DataFrame:
+    """
+    Match today's upsert delta against the saved watchlists and append the alerts to the outbox, one JSON object
+    per line, for a notifier to pick up.
+
+    Args:
+        delta: New and re-priced rows, i.e. `update(df, return_delta=True)`.
+        watchlist_path: Watchlists file, see `add_watchlist()`.
+        outbox_path: JSON lines outbox path.
+        today: Alert date, default is today.
+
+    Returns: pd.DataFrame, today's alerts, see `WatchlistIndex.match()`
+
+    """
+    alerts = WatchlistIndex(load_watchlists(watchlist_path)).match(delta, today=today)
+    if alerts.shape[0]:
+        records = alerts.astype(object).where(alerts.notna(), None).to_dict(orient='records')
+        with open(outbox_path, 'a') as f:
+            f.write(''.join(json.dumps(record, default=str) + '\n' for record in records))
+    LOGGER.info("{} alerts of {} changed listings written to {}".format(alerts.shape[0], delta.shape[0],
+                                                                        outbox_path))
+    return alerts
@@ -0,0 +1,149 @@
+import logging
+import os
+from datetime import date
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from preprocessing.dataset import CARAT_BANDS
+from utils.logger import get_logger
+
+
+LOGGER = get_logger(name="cube.py", level=logging.INFO)
+
+CELL_COLUMNS = ['Shape', 'Color', 'Clarity', 'Carat Band']
+# Fixed log-spaced Price/Ct bins, so that sketches of any cells and days can be merged by adding them up
+SKETCH_EDGES = np.geomspace(100, 1e6, 65)
+SKETCH_COLUMNS = ['Bin {}'.format(i) for i in range(len(SKETCH_EDGES) - 1)]
+SUM_COLUMNS = ['Count', 'Sum Price/Ct', 'New Listings', 'Repriced Listings'] + SKETCH_COLUMNS
+
+
+def carat_band(carat: pd.Series, carat_bands: List[float] = None) -> pd.Series:
+    if carat_bands is None:
+        carat_bands = CARAT_BANDS
+    band = np.searchsorted(carat_bands, carat.astype(float).values, side='right')
+    edges = ['{}-{}'.format(low, high) for low, high in zip(carat_bands[:-1], carat_bands[1:])]
+    labels = np.array(['<{}'.format(carat_bands[0])] + edges + ['>={}'.format(carat_bands[-1])], dtype=object)
+    return pd.Series(labels[band], index=carat.index)
+
+
+def build_slice(df: pd.DataFrame, delta: pd.DataFrame = None, today: date = None, set_name: str = None) -> pd.DataFrame:
+    """
+    Aggregate one filter set's scrape of one day into cube cells.
+
+    Args:
+        df: Today's transformed DataFrame.
+        delta: New and re-priced rows, i.e. `update(df, return_delta=True)`.
+        today: Scrape date, default is today.
+        set_name: Filter set name, a day's slice is the sum of its sets.
+
+    Returns: pd.DataFrame | Date | Set | Shape | Color | Clarity | Carat Band | Count | Sum Price/Ct | ...
+
+    """
+    if today is None:
+        today = date.today()
+    df = df[~df.index.duplicated(keep='last')]
+    cells = df[['Shape', 'Color', 'Clarity']].astype(str)
+    cells['Carat Band'] = carat_band(df['Carat'])
+
+    price_per_carat = df['Price/Ct'].astype(np.float64)
+    values = pd.DataFrame({'Count': 1, 'Sum Price/Ct': price_per_carat}, index=df.index)
+    bins = np.clip(np.searchsorted(SKETCH_EDGES, price_per_carat.values, side='right') - 1, 0, len(SKETCH_COLUMNS) - 1)
+    sketch = np.zeros((df.shape[0], len(SKETCH_COLUMNS)), dtype=np.int32)
+    sketch[np.arange(df.shape[0]), bins] = 1
+    values = pd.concat([values, pd.DataFrame(sketch, columns=SKETCH_COLUMNS, index=df.index)], axis=1)
+
+    values['New Listings'] = 0
+    values['Repriced Listings'] = 0
+    if delta is not None and delta.shape[0]:
+        is_new = (delta['First Available Date'] == today).values
+        values.loc[values.index.isin(delta.index[is_new]), 'New Listings'] = 1
+        values.loc[values.index.isin(delta.index[~is_new]), 'Repriced Listings'] = 1
+
+    cube_slice = pd.concat([cells, values], axis=1).groupby(CELL_COLUMNS, as_index=False)[SUM_COLUMNS].sum()
+    cube_slice.insert(0, 'Set', set_name)
+    cube_slice.insert(0, 'Date', today)
+    return cube_slice
+
+
+def update_cube(df: pd.DataFrame, delta: pd.DataFrame = None, today: date = None, set_name: str = None,
+                cube_path: str = 'data/market_cube.pkl', is_save: bool = True) -> pd.DataFrame:
+    """
+    Replace today's slice of the given filter set in the cube, i.e. a retried set doesn't count twice.
+    Only today's rows are aggregated, older slices are kept as they are.
+
+    Returns: the updated cube if not is_save.
+
+    """
+    if today is None:
+        today = date.today()
+    cube_slice = build_slice(df, delta=delta, today=today, set_name=set_name)
+    if os.path.isfile(cube_path):
+        cube = pd.read_pickle(cube_path)
+        cube = cube[~((cube['Date'] == today) & (cube['Set'] == set_name))]
+        cube = pd.concat([cube, cube_slice], ignore_index=True)
+    else:
+        cube = cube_slice
+    LOGGER.info("Cube slice {} {}: {} cells".format(today, set_name, cube_slice.shape[0]))
+    if is_save:
+        cube.to_pickle(cube_path)
+    else:
+        return cube
+
+
+def sketch_quantile(sketch: np.ndarray, q: float) -> np.ndarray:
+    """
+    Approximate quantile of Price/Ct from histogram sketches, interpolated in log space within a bin.
+
+    Args:
+        sketch: array of shape (n_cells, n_bins).
+        q: quantile in [0, 1].
+
+    Returns: array of shape (n_cells,)
+
+    """
+    sketch = np.asarray(sketch, dtype=np.float64)
+    cumulative = np.cumsum(sketch, axis=1)
+    total = cumulative[:, -1]
+    target = q * total
+    bins = np.minimum((cumulative < target[:, None]).sum(axis=1), sketch.shape[1] - 1)
+    before = np.where(bins > 0, cumulative[np.arange(len(bins)), bins - 1], 0)
+    in_bin = sketch[np.arange(len(bins)), bins]
+    fraction = np.where(in_bin > 0, (target - before) / np.where(in_bin > 0, in_bin, 1), 0)
+    log_edges = np.log(SKETCH_EDGES)
+    result = np.exp(log_edges[bins] + fraction * (log_edges[bins + 1] - log_edges[bins]))
+    return np.where(total > 0, result, np.nan)
+
+
+def read_cube(cube_path: str = 'data/market_cube.pkl', start: date = None, end: date = None,
+              by: List[str] = None, quantiles: List[float] = (0.25, 0.5, 0.75)) -> pd.DataFrame:
+    """
+    Daily trend of Price/Ct per grade cell, rolled up to the `by` dimensions.
+
+    Args:
+        cube_path: Cube pickle path.
+        start: First date, inclusive.
+        end: Last date, inclusive.
+        by: Cell dimensions to keep, subset of CELL_COLUMNS, default is all of them.
+        quantiles: Price/Ct quantiles estimated from the merged sketches.
+
+    Returns: pd.DataFrame | Date | <by> | Count | Mean Price/Ct | Price/Ct q.. | New Listings | Repriced Listings |
+
+    """
+    if by is None:
+        by = CELL_COLUMNS
+    cube = pd.read_pickle(cube_path)
+    if start is not None:
+        cube = cube[cube['Date'] >= start]
+    if end is not None:
+        cube = cube[cube['Date'] <= end]
+
+    rolled = cube.groupby(['Date'] + list(by), as_index=False)[SUM_COLUMNS].sum()
+    result = rolled[['Date'] + list(by) + ['Count']].copy()
+    result['Mean Price/Ct'] = rolled['Sum Price/Ct'] / rolled['Count']
+    for q in quantiles:
+        result['Price/Ct q{:g}'.format(q)] = sketch_quantile(rolled[SKETCH_COLUMNS].values, q)
+    result['New Listings'] = rolled['New Listings']
+    result['Repriced Listings'] = rolled['Repriced Listings']
+    return result
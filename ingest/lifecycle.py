@@ -0,0 +1,233 @@
+import logging
+import os
+import pickle
+from datetime import date
+from typing import Iterable, List
+
+import numpy as np
+import pandas as pd
+
+from utils.logger import get_logger
+
+
+LOGGER = get_logger(name="lifecycle.py", level=logging.INFO)
+
+CURRENT_FILE = 'current.pkl'
+# Rows of current.pkl changed since it was last written, appended one pickled DataFrame per update
+JOURNAL_FILE = 'current_journal.pkl'
+CLOSED_FILE = 'closed.pkl'
+# Written once current.pkl holds the store's First/Last Available Date of stones listed before the lifecycle
+SEEDED_FILE = 'seeded'
+
+
+def _read_frames(path: str) -> List[pd.DataFrame]:
+    # Appended pickles are read back one by one until the end of the file
+    frames = []
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                frames.append(pickle.load(f))
+            except EOFError:
+                return frames
+
+
+def _append_frame(path: str, df: pd.DataFrame):
+    with open(path, 'ab') as f:
+        pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class ListingLifecycle:
+    """
+    Interval-encoded availability of each 'Stock No.': instead of one row per stone per day, a stone has one row per
+    run of consecutive available days (run-length date ranges), thus delisted and relisted stones keep their gaps.
+    Stored as two tables under `lifecycle_dir`:
+        - current.pkl: latest run of each stone | Start | End | Closed Days | Runs |, indexed by 'Stock No.'.
+          'Closed Days' is the days on market of all previous runs.
+        - closed.pkl: finished runs | Stock No. | Start | End |, append only.
+    An update only touches the rows of stones seen today, and only writes them: changed current rows are appended
+    to a journal (current_journal.pkl) replayed by `load()`, finished runs are appended to closed.pkl. current.pkl
+    is rewritten once the journal outgrows `compact_ratio` times its size.
+    Stones listed before the lifecycle existed are seeded from the historical store (see `seed()`), otherwise
+    their days on market would start at the first tracked day.
+    """
+    def __init__(self, lifecycle_dir: str = 'data/lifecycle', max_gap_days: int = 1, compact_ratio: float = 1.0):
+        """
+        Args:
+            lifecycle_dir: Directory of lifecycle tables.
+            max_gap_days: Number of missing days still counted as the same run, i.e. a failed daily scrape.
+            compact_ratio: Rewrite current.pkl when the journal holds more rows than this ratio of it.
+        """
+        self.lifecycle_dir = lifecycle_dir
+        self.max_gap_days = max_gap_days
+        self.compact_ratio = compact_ratio
+        self.current = None
+        self._journal_rows = 0
+
+    @property
+    def current_path(self) -> str:
+        return os.path.join(self.lifecycle_dir, CURRENT_FILE)
+
+    @property
+    def journal_path(self) -> str:
+        return os.path.join(self.lifecycle_dir, JOURNAL_FILE)
+
+    @property
+    def closed_path(self) -> str:
+        return os.path.join(self.lifecycle_dir, CLOSED_FILE)
+
+    @property
+    def is_seeded(self) -> bool:
+        return os.path.isfile(os.path.join(self.lifecycle_dir, SEEDED_FILE))
+
+    def load(self):
+        if os.path.isfile(self.current_path):
+            self.current = pd.read_pickle(self.current_path)
+        else:
+            self.current = pd.DataFrame({'Start': pd.Series(dtype=object), 'End': pd.Series(dtype=object),
+                                         'Closed Days': pd.Series(dtype=np.int64),
+                                         'Runs': pd.Series(dtype=np.int64)})
+            self.current.index.name = 'Stock No.'
+        self._journal_rows = 0
+        if os.path.isfile(self.journal_path):
+            changes = _read_frames(self.journal_path)
+            self._journal_rows = sum(frame.shape[0] for frame in changes)
+            current = pd.concat([self.current] + changes)
+            self.current = current[~current.index.duplicated(keep='last')]
+            self.current.index.name = 'Stock No.'
+        return self
+
+    def save(self, changed: pd.Index = None):
+        """
+        Append the current rows of changed stones to the journal, or rewrite current.pkl (and drop the journal) if
+        changed is None or the journal got too long.
+        """
+        os.makedirs(self.lifecycle_dir, exist_ok=True)
+        if changed is not None and self._journal_rows + len(changed) <= self.compact_ratio * self.current.shape[0]:
+            _append_frame(self.journal_path, self.current.loc[changed])
+            self._journal_rows += len(changed)
+            return
+        self.current.to_pickle(self.current_path + '.tmp')
+        os.replace(self.current_path + '.tmp', self.current_path)
+        if os.path.isfile(self.journal_path):
+            os.remove(self.journal_path)
+        self._journal_rows = 0
+
+    def seed(self, store: pd.DataFrame):
+        """
+        Give stones listed before the lifecycle existed their listing history from the historical store: stones
+        missing from the lifecycle get one run First -> Last Available Date, stones whose only run starts after
+        their 'First Available Date' (tracked since the lifecycle's first day) get it as Start. Run once.
+
+        Args:
+            store: Historical store, i.e. `data/blue_niles_df.pkl`.
+        """
+        if self.current is None:
+            self.load()
+        store = store.loc[~store.index.duplicated(keep='last'), ['First Available Date', 'Last Available Date']]
+        first = store['First Available Date'].reindex(self.current.index)
+        late = ((self.current['Runs'] == 1) & first.notna()).values
+        late[late] = [start > first_date for start, first_date in
+                      zip(self.current['Start'].values[late], first.values[late])]
+        self.current.loc[late, 'Start'] = first[late].values
+
+        missing = store[~store.index.isin(self.current.index)]
+        if missing.shape[0]:
+            opened = pd.DataFrame({'Start': missing['First Available Date'].values,
+                                   'End': missing['Last Available Date'].values,
+                                   'Closed Days': 0, 'Runs': 1}, index=missing.index)
+            self.current = pd.concat([self.current, opened])
+            self.current.index.name = 'Stock No.'
+
+        self.save()
+        with open(os.path.join(self.lifecycle_dir, SEEDED_FILE), 'w') as f:
+            f.write(date.today().isoformat())
+        LOGGER.info("Lifecycle seeded from the store: {} stones added, {} starts moved back".format(
+            missing.shape[0], int(late.sum())))
+        return self
+
+    def update(self, stock_numbers: Iterable, today: date = None, is_save: bool = True):
+        """
+        Mark given stones available today: extend their current run, or close it and open a new one after a gap.
+
+        Args:
+            stock_numbers: Stock numbers scraped today.
+            today: Scrape date, default is today.
+            is_save: If True then save the tables.
+        """
+        if today is None:
+            today = date.today()
+        if self.current is None:
+            self.load()
+        seen = pd.Index(stock_numbers).unique()
+        known = seen[seen.isin(self.current.index)]
+        new = seen[~seen.isin(self.current.index)]
+
+        ends = self.current.loc[known, 'End']
+        gaps = np.array([(today - end).days for end in ends.values], dtype=np.int64)
+        relisted = known[gaps > self.max_gap_days + 1]
+        continued = known[gaps <= self.max_gap_days + 1]
+
+        # Close runs of relisted stones, then open new runs for them
+        if len(relisted):
+            closed = self.current.loc[relisted, ['Start', 'End']].reset_index(drop=True)
+            closed.insert(0, 'Stock No.', relisted.values)
+            if is_save:
+                self._append_closed(closed)
+            run_days = np.array([(end - start).days for start, end in closed[['Start', 'End']].values], dtype=np.int64)
+            self.current.loc[relisted, 'Closed Days'] += run_days
+            self.current.loc[relisted, 'Runs'] += 1
+            self.current.loc[relisted, 'Start'] = today
+        # Re-running an earlier day (see `retry_pending()`) never moves an end back
+        self.current.loc[relisted.append(known[(gaps > 0) & (gaps <= self.max_gap_days + 1)]), 'End'] = today
+
+        if len(new):
+            opened = pd.DataFrame({'Start': [today] * len(new), 'End': [today] * len(new),
+                                   'Closed Days': 0, 'Runs': 1}, index=new)
+            self.current = pd.concat([self.current, opened])
+            self.current.index.name = 'Stock No.'
+
+        LOGGER.info("Lifecycle {}: {} continued, {} relisted, {} new".format(
+            today, len(continued), len(relisted), len(new)))
+        if is_save:
+            self.save(changed=seen)
+        return self
+
+    def _append_closed(self, closed: pd.DataFrame):
+        os.makedirs(self.lifecycle_dir, exist_ok=True)
+        _append_frame(self.closed_path, closed)
+
+    def days_on_market(self, stock_numbers: Iterable = None) -> pd.Series:
+        """
+        Total days on market over all runs, gaps excluded. Equals 'Last Available Date' - 'First Available Date' for
+        stones never delisted.
+        """
+        if self.current is None:
+            self.load()
+        current = self.current if stock_numbers is None else self.current.reindex(pd.Index(stock_numbers))
+        run_days = [(end - start).days if isinstance(start, date) else np.nan
+                    for start, end in current[['Start', 'End']].values]
+        return (current['Closed Days'] + pd.Series(run_days, index=current.index)).rename('Days On Market')
+
+    def intervals(self, stock_no: str) -> pd.DataFrame:
+        """
+        All availability runs of one stone, oldest first.
+        """
+        if self.current is None:
+            self.load()
+        runs = []
+        if os.path.isfile(self.closed_path):
+            closed = pd.concat(_read_frames(self.closed_path), ignore_index=True)
+            runs.append(closed.loc[closed['Stock No.'] == stock_no, ['Start', 'End']])
+        if stock_no in self.current.index:
+            runs.append(self.current.loc[[stock_no], ['Start', 'End']].reset_index(drop=True))
+        return pd.concat(runs, ignore_index=True) if runs else pd.DataFrame(columns=['Start', 'End'])
+
+
+def attach_days_on_market(df: pd.DataFrame, lifecycle_dir: str = 'data/lifecycle') -> pd.DataFrame:
+    """
+    Add 'Days On Market' column to a DataFrame indexed by 'Stock No.', used by the `in_stock_days` date feature.
+    """
+    lifecycle = ListingLifecycle(lifecycle_dir).load()
+    df = df.copy()
+    df['Days On Market'] = lifecycle.days_on_market(df.index).values
+    return df
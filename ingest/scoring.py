@@ -0,0 +1,58 @@
+import logging
+import os
+from datetime import date
+
+import pandas as pd
+
+from utils.logger import get_logger
+
+
+LOGGER = get_logger(name="scoring.py", level=logging.INFO)
+
+PREDICTION_INDEX = ['Stock No.', 'Prediction Date']
+
+
+def score_changed_listings(delta: pd.DataFrame, model_path: str = 'data/pricer.pkl',
+                           predictions_path: str = 'data/predictions.pkl', today: date = None) -> pd.DataFrame:
+    """
+    Score only the new and re-priced stones of today's upsert delta with the latest saved pricer, then upsert the
+    results into the predictions table keyed by ('Stock No.', 'Prediction Date'), next to the historical store.
+
+    Args:
+        delta: Rows of the main DataFrame which are new or re-priced, i.e. `update(df, return_delta=True)`.
+        model_path: Pricer saved by `BaseModel.save()`.
+        predictions_path: Predictions table pickle path.
+        today: Prediction date, default is today.
+
+    Returns: pd.DataFrame, today's predictions | Price | Predicted Price | Model Version |
+
+    """
+    from model.base import BaseModel
+
+    if today is None:
+        today = date.today()
+    if delta.shape[0] == 0:
+        LOGGER.info("No changed listings to score")
+        return pd.DataFrame(columns=['Price', 'Predicted Price', 'Model Version'])
+
+    model = BaseModel.load(model_path)
+    # Preprocessor imputes in place, keep the delta untouched
+    predicted = model.predict(delta.copy())
+
+    index = pd.MultiIndex.from_arrays([delta.index, [today] * delta.shape[0]], names=PREDICTION_INDEX)
+    predictions = pd.DataFrame({
+        'Price': delta['Price'].values,
+        'Predicted Price': predicted,
+        'Model Version': pd.Timestamp(os.path.getmtime(model_path), unit='s').strftime('%Y-%m-%d %H:%M:%S'),
+    }, index=index)
+
+    if os.path.isfile(predictions_path):
+        table = pd.read_pickle(predictions_path)
+        # Re-scoring the same stone on the same day replaces the old prediction
+        table = pd.concat([table[~table.index.isin(predictions.index)], predictions])
+    else:
+        table = predictions
+    table.to_pickle(predictions_path)
+
+    LOGGER.info("{} listings scored, predictions table has {} rows".format(predictions.shape[0], table.shape[0]))
+    return predictions
@@ -0,0 +1,213 @@
+import glob
+import logging
+import os
+import re
+from datetime import date, datetime
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+from utils.logger import get_logger
+
+
+LOGGER = get_logger(name="snapshot.py", level=logging.INFO)
+
+CHECKPOINT = 'checkpoint'
+DELTA = 'delta'
+SNAPSHOT_PATTERN = re.compile(r'^(\d{4}_\d{2}_\d{2})\.(checkpoint|delta)\.pkl\.gz$')
+# Level 6 writes noticeably faster than the default level 9 for nearly the same file size
+COMPRESSION = {'method': 'gzip', 'compresslevel': 6}
+
+
+class SnapshotStore:
+    """
+    Daily scrape snapshots of each filter set stored as changes against the previous snapshot, instead of one full
+    `data/<date>/blue_niles_df_<set>.pkl` per set per day. Files are gzip compressed pickles under
+    `snapshot_dir/<set_name>/`:
+        - <date>.checkpoint.pkl.gz: the full transformed DataFrame, written on the first day and every
+          `checkpoint_every` days, so that a reconstruction never replays more than that many deltas.
+        - <date>.delta.pkl.gz: {'inserted': new rows, 'removed': index of rows gone, 'changed': full rows whose
+          values changed (mostly prices and delivery dates)}.
+
+    To use:
+        store = SnapshotStore('data/snapshots')
+        store.write(df, set_name='carat_range_1_101', today=date.today())
+        df = store.reconstruct('carat_range_1_101', as_of=date(2020, 5, 1))
+
+    A reconstructed DataFrame has the same rows and values as the written one, rows may come in different order.
+    """
+    def __init__(self, snapshot_dir: str = 'data/snapshots', checkpoint_every: int = 7):
+        """
+        Args:
+            snapshot_dir: Root directory of snapshots, one sub-directory per filter set.
+            checkpoint_every: Days between full checkpoints.
+        """
+        self.snapshot_dir = snapshot_dir
+        self.checkpoint_every = checkpoint_every
+        # Last reconstructed or written snapshot of each set, {set_name: (date, DataFrame)}
+        self._cache = {}
+
+    def set_dir(self, set_name: str) -> str:
+        return os.path.join(self.snapshot_dir, str(set_name))
+
+    def snapshots(self, set_name: str) -> List[Tuple[date, str, str]]:
+        """
+        Snapshot files of a set in date order.
+
+        Returns: List of (date, kind, path), kind is one of ['checkpoint', 'delta'].
+
+        """
+        files = []
+        for path in glob.glob(os.path.join(self.set_dir(set_name), '*.pkl.gz')):
+            match = SNAPSHOT_PATTERN.match(os.path.basename(path))
+            if match:
+                files.append((datetime.strptime(match.group(1), '%Y_%m_%d').date(), match.group(2), path))
+        return sorted(files)
+
+    def _path(self, set_name: str, day: date, kind: str) -> str:
+        return os.path.join(self.set_dir(set_name), '{}.{}.pkl.gz'.format(day.strftime('%Y_%m_%d'), kind))
+
+    def reconstruct(self, set_name: str, as_of: date = None) -> pd.DataFrame:
+        """
+        Rebuild the snapshot of a set as of given date: the latest checkpoint on or before `as_of` plus the deltas
+        written after it.
+
+        Args:
+            set_name: Filter set name.
+            as_of: Date to rebuild, default is the latest snapshot. Days without a snapshot give the latest one
+                before them.
+
+        Returns: pd.DataFrame, None if the set has no snapshot on or before `as_of`.
+
+        """
+        files = [item for item in self.snapshots(set_name) if as_of is None or item[0] <= as_of]
+        if not files:
+            return None
+        cached = self._cache.get(set_name)
+        if cached is not None and cached[0] == files[-1][0]:
+            return cached[1].copy()
+
+        start = max(i for i, (_, kind, _) in enumerate(files) if kind == CHECKPOINT)
+        df = pd.read_pickle(files[start][2])
+        for _, _, path in files[start + 1:]:
+            df = apply_delta(df, pd.read_pickle(path))
+        self._cache[set_name] = (files[-1][0], df)
+        return df.copy()
+
+    def write(self, df: pd.DataFrame, set_name: str, today: date = None) -> str:
+        """
+        Store today's transformed DataFrame of a set, as a delta against the previous snapshot or as a checkpoint.
+        Writing the same day again (i.e. a retried filter set) replaces that day's snapshot. Writing a day older than
+        the latest snapshot (i.e. a backfill) also stores the following delta again against the new content, so
+        that later reconstructions keep their rows.
+
+        Args:
+            df: Today's transformed DataFrame indexed by 'Stock No.', i.e. output of `transformation()`.
+            set_name: Filter set name.
+            today: Snapshot date, default is today.
+
+        Returns: path of the written file
+
+        """
+        if today is None:
+            today = date.today()
+        os.makedirs(self.set_dir(set_name), exist_ok=True)
+        # The next delta is stored against the snapshot it follows, keep its content before that one changes
+        later = [(day, kind, path) for day, kind, path in self.snapshots(set_name) if day > today]
+        following = None
+        if later and later[0][1] == DELTA:
+            following = (later[0][0], later[0][2], self.reconstruct(set_name, as_of=later[0][0]))
+
+        for day, kind, path in self.snapshots(set_name):
+            if day == today:
+                os.remove(path)
+        self._cache.pop(set_name, None)
+        path = self._write(df, set_name, today, previous=self.reconstruct(set_name, as_of=today))
+        self._cache[set_name] = (today, df.copy())
+
+        if following is not None:
+            day, following_path, following_df = following
+            os.remove(following_path)
+            self._write(following_df, set_name, day, previous=df)
+            self._cache[set_name] = (day, following_df)
+            LOGGER.info("Snapshot {} {}: stored again against the rewritten {}".format(day, set_name, today))
+        return path
+
+    def _write(self, df: pd.DataFrame, set_name: str, day: date, previous: pd.DataFrame = None) -> str:
+        checkpoints = [d for d, kind, _ in self.snapshots(set_name) if kind == CHECKPOINT and d < day]
+        if previous is None or not checkpoints or (day - checkpoints[-1]).days >= self.checkpoint_every \
+                or list(previous.columns) != list(df.columns):
+            path = self._path(set_name, day, CHECKPOINT)
+            df.to_pickle(path, compression=COMPRESSION)
+            LOGGER.info("Snapshot {} {}: checkpoint of {} rows".format(day, set_name, df.shape[0]))
+        else:
+            delta = diff_snapshots(previous, df)
+            path = self._path(set_name, day, DELTA)
+            pd.to_pickle(delta, path, compression=COMPRESSION)
+            LOGGER.info("Snapshot {} {}: {} inserted, {} removed, {} changed of {} rows".format(
+                day, set_name, delta['inserted'].shape[0], len(delta['removed']), delta['changed'].shape[0],
+                df.shape[0]))
+        return path
+
+
+def diff_snapshots(previous: pd.DataFrame, current: pd.DataFrame) -> Dict:
+    """
+    Changes from previous to current snapshot, both indexed by unique 'Stock No.' with the same columns.
+
+    Returns: {'inserted': pd.DataFrame, 'removed': pd.Index, 'changed': pd.DataFrame}
+
+    """
+    previous = previous[~previous.index.duplicated(keep='last')]
+    current = current[~current.index.duplicated(keep='last')]
+    common = current.index.intersection(previous.index)
+
+    new_values = current.loc[common]
+    old_values = previous.loc[common, current.columns]
+    differs = (new_values != old_values) & ~(new_values.isna() & old_values.isna())
+
+    return {
+        'inserted': current[~current.index.isin(previous.index)],
+        'removed': previous.index[~previous.index.isin(current.index)],
+        'changed': new_values[differs.any(axis=1).values],
+    }
+
+
+def apply_delta(previous: pd.DataFrame, delta: Dict) -> pd.DataFrame:
+    """
+    Inverse of `diff_snapshots()`: previous snapshot plus delta gives the next snapshot.
+    """
+    df = previous.drop(index=delta['removed'])
+    changed = delta['changed']
+    if changed.shape[0]:
+        df = pd.concat([df[~df.index.isin(changed.index)], changed])
+    return pd.concat([df, delta['inserted']])
+
+
+def import_full_snapshots(data_dir: str = 'data', snapshot_dir: str = 'data/snapshots',
+                          checkpoint_every: int = 7, remove: bool = False) -> SnapshotStore:
+    """
+    Convert existing full per-set pickles `data/<date>/blue_niles_df_<set>.pkl` into delta snapshots, in date order.
+
+    Args:
+        data_dir: Directory of the dated sub-directories.
+        snapshot_dir: Root directory of snapshots.
+        checkpoint_every: Days between full checkpoints.
+        remove: If True then delete each full pickle after it's converted.
+
+    Returns: SnapshotStore
+
+    """
+    store = SnapshotStore(snapshot_dir=snapshot_dir, checkpoint_every=checkpoint_every)
+    files = []
+    for path in glob.glob(os.path.join(data_dir, '*', 'blue_niles_df_*.pkl')):
+        day_dir = os.path.basename(os.path.dirname(path))
+        set_name = os.path.splitext(os.path.basename(path))[0][len('blue_niles_df_'):]
+        try:
+            files.append((datetime.strptime(day_dir, '%Y_%m_%d').date(), set_name, path))
+        except ValueError:
+            continue
+    for day, set_name, path in sorted(files):
+        store.write(pd.read_pickle(path), set_name=set_name, today=day)
+        if remove:
+            os.remove(path)
+    return store
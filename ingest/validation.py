@@ -0,0 +1,170 @@
+import logging
+import os
+from collections import OrderedDict
+from datetime import date
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from scrapper import FIELD_COUNT_COLUMN
+from utils.logger import get_logger
+
+
+LOGGER = get_logger(name="validation.py", level=logging.INFO)
+
+RAW_COLUMNS = ['Shape', 'Price', 'Discount Price', 'Carat', 'Cut', 'Color', 'Clarity', 'Polish', 'Symmetry',
+               'Fluorescence', 'Depth', 'Table', 'L/W', 'Price/Ct', 'Culet', 'Stock No.', 'Delivery Date']
+PRICE_COLUMNS = ['Price', 'Discount Price', 'Price/Ct']
+NUMERIC_COLUMNS = ['Depth', 'Table', 'L/W']
+REASON_COLUMN = 'Reason'
+
+# Same bounds as the hard coded filters of the website
+CARAT_RANGE = (0.23, 20.98)
+PRICE_RANGE = (261, 1860430)
+
+PRICE_PATTERN = r'^\$\d{1,3}(?:,\d{3})*$'
+# `find_year()` parses 'Delivery Date' by '%b %d'
+DELIVERY_DATE_PATTERN = r'^[A-Z][a-z]{2} \d{1,2}$'
+STOCK_NO_PATTERN = r'^[A-Za-z0-9-]+$'
+
+
+def _map_unique(values: pd.Series, func, missing) -> np.ndarray:
+    """
+    Apply a vectorized string function on unique values only, then broadcast back by factorized codes. Scrapped
+    columns repeat a few grades or prices over many rows, so this is much cheaper than `.str` over all rows.
+    Missing values get `missing`.
+    """
+    codes, uniques = pd.factorize(values)
+    mapped = np.asarray(func(pd.Series(uniques, dtype=object).astype(str)))
+    return np.where(codes >= 0, mapped[codes], missing)
+
+
+def _match(values: pd.Series, pattern: str) -> np.ndarray:
+    return _map_unique(values, lambda uniques: uniques.str.match(pattern).values, missing=False).astype(bool)
+
+
+def _parse_number(values: pd.Series, strip: str = None) -> np.ndarray:
+    def parse(uniques):
+        if strip is not None:
+            uniques = uniques.str.replace(strip, '', regex=True)
+        return pd.to_numeric(uniques, errors='coerce').astype(np.float64).values
+    return _map_unique(values, parse, missing=np.nan).astype(np.float64)
+
+
+def validate_raw(df: pd.DataFrame, carat_range: Tuple[float, float] = CARAT_RANGE,
+                 price_range: Tuple[int, int] = PRICE_RANGE,
+                 price_per_carat_tolerance: float = 0.1) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Vectorized data quality checks of a raw (scrapped, string typed) DataFrame before `transformation()`.
+    Every row passing all checks can be transformed, failed rows are split out with the reasons, so that one bad row
+    doesn't abort the whole filter set.
+
+    Row checks (reason names):
+        field_count: record had more or less fields than columns, see `BlueNileScrapper.to_frame()`.
+        stock_no: missing or malformed 'Stock No.'.
+        duplicate_stock_no: 'Stock No.' already seen in an earlier row, the first one is kept.
+        price_format: price columns not formatted like '$1,234'.
+        carat_range: 'Carat' not a number within carat_range.
+        price_range: neither 'Price' nor 'Discount Price' within price_range, or discount above price.
+        numeric: 'Depth', 'Table' or 'L/W' given but not a number.
+        delivery_date: 'Delivery Date' not formatted like 'Jan 5'.
+        column_shift: a price ('$') in a non-price column, or 'Price/Ct' inconsistent with price / carat, both are
+            signs of fields moved to the wrong column.
+
+    Args:
+        df: Raw DataFrame, i.e. `DriverBlueNileScrapper.get_dynamic()`.
+        carat_range: (min, max) valid carat.
+        price_range: (min, max) valid price.
+        price_per_carat_tolerance: Max relative difference between 'Price/Ct' and price / carat.
+
+    Returns: (valid rows, quarantined rows with a REASON_COLUMN of ';' joined reasons). Both keep raw columns.
+
+    Raises:
+        ValueError: Required columns are missing, i.e. the scrapper column names changed, nothing can be trusted.
+
+    """
+    missing = [col for col in RAW_COLUMNS if col not in df.columns]
+    if missing:
+        raise ValueError("Raw DataFrame misses columns {}, check `BlueNileScrapper.get_column_name()`.".format(missing))
+
+    checks = OrderedDict()
+    if FIELD_COUNT_COLUMN in df.columns:
+        checks['field_count'] = (df[FIELD_COUNT_COLUMN] != len(RAW_COLUMNS)).values
+
+    checks['stock_no'] = ~_match(df['Stock No.'], STOCK_NO_PATTERN)
+    checks['duplicate_stock_no'] = (df['Stock No.'].duplicated(keep='first') & df['Stock No.'].notna()).values
+
+    price_format = np.zeros(df.shape[0], dtype=bool)
+    for col in PRICE_COLUMNS:
+        price_format |= ~_match(df[col], PRICE_PATTERN)
+    checks['price_format'] = price_format
+
+    carat = _parse_number(df['Carat'])
+    with np.errstate(invalid='ignore'):
+        checks['carat_range'] = ~((carat >= carat_range[0]) & (carat <= carat_range[1]))
+
+    # The website filters on one of the prices, so at least one of them should be within the range
+    price = _parse_number(df['Price'], strip=r'[$,]')
+    discount_price = _parse_number(df['Discount Price'], strip=r'[$,]')
+    with np.errstate(invalid='ignore'):
+        in_range = ((price >= price_range[0]) & (price <= price_range[1])) | \
+                   ((discount_price >= price_range[0]) & (discount_price <= price_range[1]))
+        checks['price_range'] = ~in_range | (discount_price > price)
+
+    numeric = np.zeros(df.shape[0], dtype=bool)
+    for col in NUMERIC_COLUMNS:
+        numeric |= df[col].notna().values & np.isnan(_parse_number(df[col]))
+    checks['numeric'] = numeric
+
+    checks['delivery_date'] = ~_match(df['Delivery Date'], DELIVERY_DATE_PATTERN)
+
+    # Numeric, stock number and date columns are covered by the checks above, look for prices in grade columns
+    shifted = np.zeros(df.shape[0], dtype=bool)
+    for col in RAW_COLUMNS:
+        if col not in PRICE_COLUMNS + NUMERIC_COLUMNS + ['Carat', 'Stock No.', 'Delivery Date']:
+            shifted |= _map_unique(df[col], lambda uniques: uniques.str.contains('$', regex=False).values,
+                                   missing=False).astype(bool)
+    # Price/Ct may be based on either price, only flag rows far from both
+    price_per_carat = _parse_number(df['Price/Ct'], strip=r'[$,]')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        error = np.minimum(np.abs(price / carat - price_per_carat), np.abs(discount_price / carat - price_per_carat))
+        shifted |= error > price_per_carat_tolerance * price_per_carat
+    checks['column_shift'] = shifted
+
+    failed = np.column_stack(list(checks.values()))
+    bad = failed.any(axis=1)
+    quarantine = df[bad].copy()
+    if bad.any():
+        names = np.array(list(checks))
+        quarantine[REASON_COLUMN] = [';'.join(names[row]) for row in failed[bad]]
+        counts = OrderedDict((name, int(failed[:, i].sum())) for i, name in enumerate(names) if failed[:, i].any())
+        LOGGER.warning("{} of {} rows quarantined: {}".format(int(bad.sum()), df.shape[0], dict(counts)),
+                       extra={'stage': 'validate', 'rows': int(bad.sum())})
+    else:
+        quarantine[REASON_COLUMN] = pd.Series(dtype=object)
+
+    valid = df[~bad]
+    if FIELD_COUNT_COLUMN in valid.columns:
+        valid = valid.drop(columns=FIELD_COUNT_COLUMN)
+    return valid, quarantine
+
+
+def save_quarantine(quarantine: pd.DataFrame, today: date = None, set_name: str = None,
+                    data_dir: str = 'data') -> str:
+    """
+    Save quarantined rows next to the day's single DataFrames, `data/<date>/quarantine_<set>.pkl`. Rows of the same
+    set and day (i.e. a retried filter set) are appended.
+
+    Returns: file path
+
+    """
+    if today is None:
+        today = date.today()
+    day_dir = os.path.join(data_dir, today.strftime('%Y_%m_%d'))
+    os.makedirs(day_dir, exist_ok=True)
+    path = os.path.join(day_dir, 'quarantine_{}.pkl'.format(set_name))
+    if os.path.isfile(path):
+        quarantine = pd.concat([pd.read_pickle(path), quarantine], ignore_index=True)
+    quarantine.to_pickle(path)
+    return path
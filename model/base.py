@@ -1,16 +1,12 @@
 import logging
+import pickle
 from typing import Iterable, Dict, Optional
 
+import numpy as np
+import pandas as pd
+from scipy import sparse
 from sklearn.base import BaseEstimator
-from sklearn.impute import SimpleImputer
-from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
-from sklearn.pipeline import Pipeline, FeatureUnion
-from sklearn.preprocessing import OrdinalEncoder, StandardScaler
-
-from preprocessing.imputer import DateImputer
-from preprocessing.transformer import ColumnSelector, DateDeltaTransformer, DateSplitTransformer
-from preprocessing.utils import generate_cat_preprocessor, generate_date_preprocessor, generate_feature_union, \
-    generate_num_preprocessor
+
 from utils.logger import get_logger
 
 
@@ -53,6 +49,8 @@ class BaseModel(BaseEstimator):
         self.cv_pipeline = None
 
         self.prediction = None
+        self.prediction_interval = None
+        self.global_importance = None
         self.metrics = {}
 
     def initialization(self):
@@ -70,7 +68,7 @@ class BaseModel(BaseEstimator):
             'cat': {
                 'columns': ['Shape', 'Cut', 'Color', 'Clarity', 'Polish', 'Symmetry', 'Fluorescence', 'Culet'],
                 'imputer_strategy': 'most_frequent',
-                'encoder_type': 'Ordinal',
+                'encoder_type': 'Grade',
                 'tune_params': None,
             },
             'num': {
@@ -84,6 +82,11 @@ class BaseModel(BaseEstimator):
                 'delta_types': ['deliver_days', 'in_stock_days'],
                 'imputer_strategy': None,
             },
+            # Output contract of the whole preprocessor, format should be one of ['dense', 'csr']
+            'output': {
+                'format': 'dense',
+                'dtype': 'float32',
+            },
         }
 
     def build_base_preprocessor(self, inplace: bool = False):
@@ -91,6 +94,8 @@ class BaseModel(BaseEstimator):
         Build basic features for all models, other customized features can be added by `build_preprocessor()`.
         Basic features include Categorical, Numerical, Datetime three main types.
         The specific columns are determined by self.preprocessor_params.
+        If self.preprocessor_params['output'] is given, every feature block ends in the same format and dtype, so the
+        FeatureUnion output is a dense or CSR matrix of that dtype without any upcasting copy.
 
         Args:
             inplace: bool, if true then update self.preprocessor, if false then return preprocesser.
@@ -98,18 +103,31 @@ class BaseModel(BaseEstimator):
         Returns:
 
         """
+        from preprocessing.utils import generate_cat_preprocessor, generate_date_preprocessor, \
+            generate_feature_union, generate_num_preprocessor
+
+        # Output format contract
+        output_params = {}
+        if self.preprocessor_params.get('output'):
+            output_params = {
+                'output_format': self.preprocessor_params['output'].get('format', 'dense'),
+                'dtype': np.dtype(self.preprocessor_params['output'].get('dtype', 'float32')),
+            }
+
         # Categorical Features
         cat_preprocessor, cat_feature_name, cat_tuning_dict = generate_cat_preprocessor(
-            **self.preprocessor_params['cat']
+            **self.preprocessor_params['cat'], **output_params
         )
 
         # Numerical Features
         num_preprocessor, num_feature_name, num_tuning_dict = generate_num_preprocessor(
-            **self.preprocessor_params['num']
+            **self.preprocessor_params['num'], **output_params
         )
 
         # Datetime Features
-        date_preprocessor, date_feature_name = generate_date_preprocessor(**self.preprocessor_params['date'])
+        date_preprocessor, date_feature_name = generate_date_preprocessor(
+            **self.preprocessor_params['date'], **output_params
+        )
 
         # Make total FeatureUnion
         transformer_dict_list = [
@@ -179,6 +197,198 @@ class BaseModel(BaseEstimator):
         self.prediction = self.pipeline.predict(X)
         return self.prediction
 
+    def transform_features(self, X):
+        """
+        Run X through every pipeline step before the final estimator, i.e. the fitted preprocessor.
+        Args:
+            X: iterable, Input data.
+
+        Returns: feature matrix, array-like or sparse matrix.
+
+        """
+        for _, step in self.pipeline.steps[:-1]:
+            X = step.transform(X)
+        return X
+
+    def fit_features(self, features, y, X=None, tune=False):
+        """
+        Train only the final estimator on features already transformed by the fitted preprocessor, i.e. cached by
+        `preprocessing.feature_store.FeatureStore`, so that the preprocessor isn't run again.
+        Args:
+            features: array-like or sparse matrix, rows aligned with y.
+            y: iterable, Training target.
+            X: pd.DataFrame, raw rows aligned with features, needed to tune with a date based splitter.
+            tune: bool, if True then tune the final estimator with self.cv_pipeline settings and keep the best one.
+                Only final estimator parameters can be tuned, the preprocessor is already fitted. Its statistics
+                (imputed values, scaling, categories) are computed on all rows, test folds included, so the CV scores
+                are slightly optimistic. Use `fit(X, y, tune=True)` to refit the preprocessor in each fold.
+
+        Returns: self, this model.
+
+        """
+        LOGGER.info("======== Start Training on Features ========")
+
+        algo_name, algo = self.pipeline.steps[-1]
+        if tune:
+            from sklearn.base import clone
+
+            # Same search on the final estimator alone, tuning names lose the pipeline step prefix
+            search = clone(self.cv_pipeline)
+            grid_key = 'param_grid' if hasattr(search, 'param_grid') else 'param_distributions'
+            prefix = '{}__'.format(algo_name)
+            grids = getattr(search, grid_key)
+            grids = [grids] if isinstance(grids, dict) else list(grids)
+            others = sorted({name for grid in grids for name in grid if not name.startswith(prefix)})
+            if others:
+                raise ValueError("fit_features() only tunes '{}' parameters, the preprocessor is fitted already: "
+                                 "drop {} from the grid or tune by fit().".format(algo_name, others))
+            grid = [{name[len(prefix):]: values for name, values in grid.items()} for grid in grids]
+            if len(grid) == 1:
+                grid = grid[0]
+            LOGGER.warning("Tuning on cached features, preprocessor statistics include the test folds")
+            cv = search.cv
+            if X is not None and hasattr(cv, 'split'):
+                cv = list(cv.split(X, y))
+            search.set_params(estimator=clone(algo), cv=cv, **{grid_key: grid})
+            search.fit(features, y)
+            algo = search.best_estimator_
+            self.pipeline.steps[-1] = (algo_name, algo)
+            self.algo = algo
+        else:
+            algo.fit(features, y)
+
+        LOGGER.info("======== Finish Training on Features ========")
+
+        return self
+
+    def predict_features(self, features, X=None):
+        """
+        Predict with the final estimator from features already transformed by the fitted preprocessor.
+        Args:
+            features: array-like or sparse matrix.
+            X: pd.DataFrame, raw rows aligned with features, only used by models routing rows by raw columns.
+
+        Returns: predicted y, array-like.
+
+        """
+        self.prediction = self.pipeline.steps[-1][1].predict(features)
+        return self.prediction
+
+    def predict_interval(self, X, quantiles: Iterable = (0.05, 0.5, 0.95), chunk_size: int = 100000):
+        """
+        Predict price quantiles from the per-tree predictions of a fitted forest, i.e. a "fair price range" for
+        each stone. All trees' leaves are collected by one vectorized `apply()` pass per chunk and looked up in a
+        flat array of leaf values, so the range costs about the same as the point prediction.
+        Args:
+            X: iterable, Testing data.
+            quantiles: iterable, quantiles in [0, 1] to return, the default contains the median 0.5.
+            chunk_size: int, number of rows per chunk, bounds the (chunk_size, n_trees) leaf matrix memory.
+
+        Returns: array of shape (n_samples, n_quantiles), ordered as `quantiles`.
+
+        """
+        forest = self.pipeline.steps[-1][1]
+        if not hasattr(forest, 'estimators_'):
+            raise ValueError("predict_interval() requires a fitted tree ensemble, got {}.".format(
+                type(forest).__name__))
+
+        # Flat leaf value table of all trees, tree i's node j is at offsets[i] + j
+        leaf_values = [tree.tree_.value[:, 0, 0] for tree in forest.estimators_]
+        offsets = np.cumsum([0] + [len(values) for values in leaf_values[:-1]])
+        leaf_values = np.concatenate(leaf_values)
+
+        features = self.transform_features(X)
+        quantiles = np.asarray(quantiles, dtype=float)
+        intervals = np.empty((features.shape[0], len(quantiles)), dtype=np.float64)
+        for start in range(0, features.shape[0], chunk_size):
+            leaves = forest.apply(features[start:start + chunk_size])
+            per_tree = leaf_values[leaves + offsets]
+            intervals[start:start + chunk_size] = np.quantile(per_tree, quantiles, axis=1).T
+
+        self.prediction_interval = intervals
+        return intervals
+
+    def _attribution_matrix(self, forest):
+        """
+        Stack every tree's node contributions into one sparse (total nodes, n_features) matrix: entering node j from
+        its parent p adds value[j] - value[p] to the feature split at p. The rows follow `forest.decision_path()`.
+        """
+        rows, cols, data = [], [], []
+        offset = 0
+        for tree in forest.estimators_:
+            tree_ = tree.tree_
+            values = tree_.value[:, 0, 0]
+            for children in (tree_.children_left, tree_.children_right):
+                parents = np.flatnonzero(children != -1)
+                rows.append(children[parents] + offset)
+                cols.append(tree_.feature[parents])
+                data.append(values[children[parents]] - values[parents])
+            offset += tree_.node_count
+        n_features = forest.n_features_in_ if hasattr(forest, 'n_features_in_') else forest.n_features_
+        return sparse.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                                 shape=(offset, n_features))
+
+    def explain(self, X, chunk_size: int = 10000, n_jobs: int = None):
+        """
+        Per-stone feature contributions of a fitted forest by tree-path decomposition: each prediction equals
+        `bias` plus the sum of its row of contributions. All trees' decision paths of a chunk are multiplied with a
+        precomputed node contribution matrix in one sparse product, chunks run in parallel threads.
+        Args:
+            X: iterable, Data to explain.
+            chunk_size: int, number of rows per chunk.
+            n_jobs: int, number of threads, None means 1.
+
+        Returns: contributions, bias. pd.DataFrame with columns aligned with self.feature_name, np.ndarray.
+
+        """
+        from joblib import Parallel, delayed
+
+        forest = self.pipeline.steps[-1][1]
+        if not hasattr(forest, 'estimators_'):
+            raise ValueError("explain() requires a fitted tree ensemble, got {}.".format(type(forest).__name__))
+
+        node_contributions = self._attribution_matrix(forest)
+        n_trees = len(forest.estimators_)
+        bias = np.mean([tree.tree_.value[0, 0, 0] for tree in forest.estimators_])
+
+        features = self.transform_features(X)
+
+        def explain_chunk(start):
+            indicator, _ = forest.decision_path(features[start:start + chunk_size])
+            return np.asarray((indicator @ node_contributions).todense()) / n_trees
+
+        chunks = Parallel(n_jobs=n_jobs, prefer='threads')(
+            delayed(explain_chunk)(start) for start in range(0, features.shape[0], chunk_size)
+        )
+        contributions = np.vstack(chunks) if chunks else np.empty((0, node_contributions.shape[1]))
+
+        feature_name = self.feature_name
+        if feature_name is None or len(feature_name) != contributions.shape[1]:
+            # i.e. OneHot encoder expands categorical columns
+            feature_name = ['feature_{}'.format(i) for i in range(contributions.shape[1])]
+        index = X.index if hasattr(X, 'index') else None
+        return pd.DataFrame(contributions, columns=feature_name, index=index), np.full(contributions.shape[0], bias)
+
+    def explain_global(self, X, sample_size: int = 50000, random_state: int = 0, **kwargs):
+        """
+        Global importance summary: mean absolute contribution of each feature over (a sample of) X, normalized to
+        sum 1. The summary is cached in self.global_importance, thus it's saved with the model.
+        Args:
+            X: pd.DataFrame, Data to explain, i.e. the whole inventory.
+            sample_size: int, max number of rows to explain.
+            random_state: int, random seed of sampling.
+            kwargs: arguments of `explain()`.
+
+        Returns: pd.Series, sorted descending.
+
+        """
+        if X.shape[0] > sample_size:
+            X = X.sample(n=sample_size, random_state=random_state)
+        contributions, _ = self.explain(X, **kwargs)
+        importance = contributions.abs().mean()
+        self.global_importance = (importance / importance.sum()).sort_values(ascending=False)
+        return self.global_importance
+
     def score(self, X, y, metrics: Optional[Iterable] = None):
         """
         Get Scores(Metrics) for prediction.
@@ -196,6 +406,8 @@ class BaseModel(BaseEstimator):
         if metrics is None:
             return self.pipeline.score(X, y)
 
+        from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+
         for metric in metrics:
             if metric == 'mse':
                 self.metrics['mse'] = mean_squared_error(y_true=y, y_pred=self.prediction)
@@ -205,6 +417,29 @@ class BaseModel(BaseEstimator):
                 self.metrics['r-square'] = r2_score(y_true=y, y_pred=self.prediction)
         return self.metrics
 
+    def save(self, path: str):
+        """
+        Pickle the whole model, including the fitted pipeline and cached summaries such as global_importance.
+        Args:
+            path: str, file path, i.e. 'data/pricer.pkl'.
+
+        """
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path: str):
+        """
+        Load a model saved by `save()`.
+        Args:
+            path: str, file path.
+
+        Returns: model
+
+        """
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
     def build_preprocessor(self):
         raise NotImplementedError('Need to overwrite in subclass')
 
@@ -0,0 +1,113 @@
+import hashlib
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import BaseCrossValidator
+
+
+class RollingOriginSplit(BaseCrossValidator):
+    """
+    Time-aware cross validation splitter for listings repeated across daily snapshots.
+    The distinct 'First Available Date' days are cut into `n_splits + 1` consecutive chunks, each chunk after the
+    first is one test window (stones first listed in the window). Training rows of a fold are stones whose
+    'Last Available Date' is before the window's origin, thus their price is known by then and no future price leaks
+    into training. With window='sliding' only the last `max_train_days` days before the origin are used.
+
+    Fold index arrays are computed once for given data and cached, so GridSearchCV and RandomizedSearchCV refits on
+    the same data share them. Can be given as `cv_params['cv']` of DiamondPricer.
+    """
+    def __init__(self, n_splits: int = 5, window: str = 'expanding', max_train_days: int = None, gap_days: int = 0,
+                 strict: bool = True, first_date_col: str = 'First Available Date',
+                 last_date_col: str = 'Last Available Date'):
+        """
+        Args:
+            n_splits: Number of folds (before dropping empty ones).
+            window: String, must be one of ['expanding', 'sliding'].
+            max_train_days: Training window length (days) before each origin if window is 'sliding'.
+            gap_days: Days skipped between the end of training and the origin.
+            strict: If True then train on stones delisted before the origin (no leak). If False then train on stones
+                first listed before the origin, more training rows but their latest prices may come from the future.
+            first_date_col: First available date column name.
+            last_date_col: Last available date column name.
+        """
+        self.n_splits = n_splits
+        self.window = window
+        self.max_train_days = max_train_days
+        self.gap_days = gap_days
+        self.strict = strict
+        self.first_date_col = first_date_col
+        self.last_date_col = last_date_col
+
+        self._cache_key = None
+        self._folds = None
+
+    @staticmethod
+    def _to_days(values) -> np.ndarray:
+        return pd.to_datetime(pd.Series(values)).values.astype('datetime64[D]').astype(np.int64)
+
+    def get_folds(self, X) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Compute (or get cached) fold index arrays.
+
+        Args:
+            X: pd.DataFrame, must contain first_date_col and last_date_col.
+
+        Returns: List of (train positions, test positions)
+
+        """
+        if self.window not in ['expanding', 'sliding']:
+            raise ValueError("Invalid window, should be one of ['expanding', 'sliding']")
+        if self.window == 'sliding' and not self.max_train_days:
+            raise ValueError("max_train_days is required for sliding window")
+
+        first = self._to_days(X[self.first_date_col])
+        last = self._to_days(X[self.last_date_col])
+        key = (self.n_splits, self.window, self.max_train_days, self.gap_days, self.strict,
+               hashlib.sha1(first.tobytes() + last.tobytes()).hexdigest())
+        if key == self._cache_key:
+            return self._folds
+
+        days = np.unique(first)
+        chunks = np.array_split(days, self.n_splits + 1)
+        train_end = last if self.strict else first
+        folds = []
+        for i in range(1, len(chunks)):
+            if not len(chunks[i]):
+                continue
+            origin = chunks[i][0]
+            window_end = chunks[i + 1][0] if i + 1 < len(chunks) and len(chunks[i + 1]) else days[-1] + 1
+            train_mask = train_end < origin - self.gap_days
+            if self.window == 'sliding':
+                train_mask &= train_end >= origin - self.gap_days - self.max_train_days
+            test_mask = (first >= origin) & (first < window_end)
+            if train_mask.any() and test_mask.any():
+                folds.append((np.flatnonzero(train_mask), np.flatnonzero(test_mask)))
+
+        self._cache_key = key
+        self._folds = folds
+        return folds
+
+    def split(self, X, y=None, groups=None):
+        """
+        Generate indices to split data into training and test set.
+
+        Args:
+            X: pd.DataFrame, must contain first_date_col and last_date_col.
+            y: Always ignored, exists for compatibility.
+            groups: Always ignored, exists for compatibility.
+
+        Returns: Iterator of (train positions, test positions)
+
+        """
+        for train, test in self.get_folds(X):
+            yield train, test
+
+    def get_n_splits(self, X=None, y=None, groups=None):
+        if X is None:
+            return self.n_splits
+        return len(self.get_folds(X))
+
+    def _iter_test_indices(self, X=None, y=None, groups=None):
+        for _, test in self.get_folds(X):
+            yield test
@@ -1,15 +1,8 @@
 import logging
 
-import numpy as np
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.impute import SimpleImputer
-from sklearn.model_selection import GridSearchCV, KFold, RandomizedSearchCV
 from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import OrdinalEncoder, StandardScaler
 
 from model.base import BaseModel
-from preprocessing.imputer import DateImputer
-from preprocessing.utils import generate_tuning_dict
 from utils.logger import get_logger
 
 
@@ -53,6 +46,9 @@ class DiamondPricer(BaseModel):
         # Initialize cross validation pipeline
         # Currently the cross validation pipeline is only available for algo hyper-parameters tuning
         if self.cv is not None:
+            from model.model_selection import RollingOriginSplit
+            from preprocessing.utils import generate_tuning_dict
+
             if not self.algo_params.get('tune_params'):
                 self.algo_params['tune_params'] = {
                     'n_estimators': [50, 100, 200],
@@ -65,9 +61,9 @@ class DiamondPricer(BaseModel):
                 self.cv_params = {
                     'estimator': self.pipeline,
                     'scoring': None,
-                    'cv': None,
+                    # Rolling origin folds on listing dates, random K-fold leaks future prices of repeated listings
+                    'cv': RollingOriginSplit(n_splits=5),
                     'refit': True,
-                    'iid': False,
                     'n_jobs': 10,
                     'verbose': 5,
                 }
@@ -100,6 +96,8 @@ class DiamondPricer(BaseModel):
     def build_algo(self):
         # TODO: add more choices for algorithm
         if self.algo_params['algo'] == 'RandomForestRegressor':
+            from sklearn.ensemble import RandomForestRegressor
+
             self.algo = RandomForestRegressor(**self.algo_params['params'])
 
     def build_pipeline(self, prefix=None):
@@ -108,6 +106,8 @@ class DiamondPricer(BaseModel):
         self.pipeline = Pipeline([(prefix[0], self.preprocessor), (prefix[1], self.algo)])
 
     def build_cv_pipeline(self):
+        from sklearn.model_selection import GridSearchCV, RandomizedSearchCV
+
         if self.cv == 'GridSearch':
             self.cv_pipeline = GridSearchCV(**self.cv_params)
         elif self.cv == 'RandomizedSearch':
@@ -0,0 +1,176 @@
+import logging
+import os
+import shutil
+import tempfile
+from typing import Dict, List
+
+import joblib
+import numpy as np
+from scipy import sparse
+from sklearn.base import clone
+from sklearn.metrics import r2_score
+
+from model.pricer import DiamondPricer
+from preprocessing.dataset import CARAT_BANDS
+from utils.logger import get_logger
+
+
+LOGGER = get_logger(name="segmented.py", level=logging.INFO)
+
+OTHER_SEGMENT = '_other'
+
+
+def _fit_segment(algo, features, y, index):
+    # Fancy indexing a memmap only copies this segment's rows into the worker
+    return algo.fit(features[index], y[index])
+
+
+class SegmentedPricer(DiamondPricer):
+    """
+    Pricer training one sub-model per diamond segment (Shape or carat band) instead of one global model.
+    The preprocessor is shared and fitted once, its feature matrix is memory-mapped and shared by worker processes,
+    each fitting one segment's sub-model in parallel. Segments smaller than `min_segment_size` are pooled into one
+    `_other` sub-model, which also prices segments never seen in training.
+    Cross validation tuning is not supported, tune sub-model `algo_params` with DiamondPricer on a single segment.
+    """
+    def __init__(self, preprocessor_params=None, algo_params=None, segment_by: str = 'Shape',
+                 carat_bands: List = None, min_segment_size: int = 500, n_jobs: int = -1):
+        """
+        Args:
+            preprocessor_params: Dict, see BaseModel.
+            algo_params: Dict, see BaseModel, every sub-model is built from it.
+            segment_by: String, must be one of ['Shape', 'carat_band'].
+            carat_bands: List, carat band edges if segment_by is 'carat_band', default is CARAT_BANDS.
+            min_segment_size: int, segments with fewer rows are pooled into the `_other` sub-model.
+            n_jobs: int, number of worker processes to fit sub-models.
+        """
+        self.segment_by = segment_by
+        self.carat_bands = carat_bands
+        self.min_segment_size = min_segment_size
+        self.n_jobs = n_jobs
+        self.segment_models = {}
+        super().__init__(preprocessor_params, algo_params, cv=None, cv_params=None)
+
+    def segment(self, X) -> np.ndarray:
+        """
+        Segment label of each row.
+        """
+        if self.segment_by == 'Shape':
+            return X['Shape'].astype(str).values
+        elif self.segment_by == 'carat_band':
+            carat_bands = CARAT_BANDS if self.carat_bands is None else self.carat_bands
+            band = np.searchsorted(carat_bands, X['Carat'].astype(float).values, side='right')
+            return np.array(['carat_band_{}'.format(b) for b in band], dtype=object)
+        else:
+            raise ValueError("Invalid segment_by, should be one of ['Shape', 'carat_band']")
+
+    def _route(self, labels: np.ndarray) -> Dict:
+        """
+        Group row positions by the sub-model pricing them, {segment: row positions}.
+        """
+        segments, inverse = np.unique(labels, return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.cumsum(np.bincount(inverse, minlength=len(segments)))[:-1]
+        routes = {}
+        for seg, index in zip(segments, np.split(order, bounds)):
+            key = seg if seg in self.segment_models else OTHER_SEGMENT
+            routes[key] = np.concatenate([routes[key], index]) if key in routes else index
+        return routes
+
+    def fit(self, X, y, tune=False):
+        """
+        Fit the shared preprocessor once, then fit all segment sub-models in parallel.
+
+        Args:
+            X: pd.DataFrame, Training data.
+            y: iterable, Training target.
+            tune: bool, not supported.
+
+        Returns: self, this model.
+
+        """
+        if tune:
+            raise ValueError("SegmentedPricer doesn't support tuning, tune a DiamondPricer per segment instead.")
+        return self.fit_features(self.preprocessor.fit_transform(X), y, X=X)
+
+    def fit_features(self, features, y, X=None, tune=False):
+        """
+        Fit all segment sub-models in parallel from features already transformed by the fitted preprocessor.
+
+        Args:
+            features: array-like or sparse matrix, rows aligned with y.
+            y: iterable, Training target.
+            X: pd.DataFrame, raw rows aligned with features, required to segment rows.
+            tune: bool, not supported.
+
+        Returns: self, this model.
+
+        """
+        if tune:
+            raise ValueError("SegmentedPricer doesn't support tuning, tune a DiamondPricer per segment instead.")
+        if X is None:
+            raise ValueError("SegmentedPricer needs the raw rows X to segment features.")
+        LOGGER.info("======== Start Training ========")
+
+        labels = self.segment(X)
+        y = np.asarray(y)
+
+        segments, counts = np.unique(labels, return_counts=True)
+        jobs = {}
+        small = np.isin(labels, segments[counts < self.min_segment_size])
+        for seg in segments[counts >= self.min_segment_size]:
+            jobs[seg] = np.flatnonzero(labels == seg)
+        if small.any():
+            jobs[OTHER_SEGMENT] = np.flatnonzero(small)
+        LOGGER.info("======== {} segments: {} ========".format(
+            len(jobs), {seg: len(index) for seg, index in jobs.items()}))
+
+        tmp_dir = tempfile.mkdtemp(prefix='segmented_pricer_')
+        try:
+            # Cached features (see FeatureStore) are memory-mapped already
+            if not sparse.issparse(features) and not isinstance(features, np.memmap):
+                path = os.path.join(tmp_dir, 'features.mmap')
+                joblib.dump(np.ascontiguousarray(features), path)
+                features = joblib.load(path, mmap_mode='r')
+            models = joblib.Parallel(n_jobs=self.n_jobs)(
+                joblib.delayed(_fit_segment)(clone(self.algo), features, y, index) for index in jobs.values()
+            )
+        finally:
+            del features
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self.segment_models = dict(zip(jobs, models))
+        LOGGER.info("======== Finish Training ========")
+        return self
+
+    def predict(self, X):
+        """
+        Predict with the sub-model of each row's segment, one vectorized batch per segment.
+
+        Args:
+            X: pd.DataFrame, Testing data.
+
+        Returns: predicted y, array-like.
+
+        """
+        return self.predict_features(self.preprocessor.transform(X), X)
+
+    def predict_features(self, features, X=None):
+        """
+        Predict from features already transformed by the fitted preprocessor, X is required to route rows.
+        """
+        if X is None:
+            raise ValueError("SegmentedPricer needs the raw rows X to route features.")
+        prediction = np.empty(features.shape[0], dtype=np.float64)
+        for seg, index in self._route(self.segment(X)).items():
+            if seg not in self.segment_models:
+                raise ValueError("No sub-model for {} rows of unseen segments, there's no `{}` sub-model since all "
+                                 "training segments are large enough.".format(len(index), OTHER_SEGMENT))
+            prediction[index] = self.segment_models[seg].predict(features[index])
+        self.prediction = prediction
+        return self.prediction
+
+    def score(self, X, y, metrics=None):
+        if metrics is None:
+            return r2_score(y_true=y, y_pred=self.predict(X))
+        return super().score(X, y, metrics=metrics)
@@ -0,0 +1,193 @@
+import os
+from datetime import date
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from ingest.lifecycle import ListingLifecycle
+
+
+DATE_COLUMNS = ['First Available Date', 'Last Available Date', 'Delivery Date']
+TARGET_COLUMN = 'Price'
+CARAT_BANDS = [0, 0.5, 0.7, 1, 1.5, 2, 3, 21]
+
+
+def export_parquet(pkl_path: str = 'data/blue_niles_df.pkl', parquet_path: str = 'data/blue_niles_df.parquet',
+                   row_group_size: int = 100000):
+    """
+    Convert the pickled historical store into parquet, which can be read by columns and row groups.
+    Requires `pyarrow`.
+    """
+    df = pd.read_pickle(pkl_path)
+    df.to_parquet(parquet_path, engine='pyarrow', row_group_size=row_group_size)
+
+
+class TrainingSetBuilder:
+    """
+    Build training sets from the historical store by reading only the columns used by the model.
+    Parquet stores (see `export_parquet()`) are read lazily by row groups, so that memory stays bounded by the
+    sample size rather than the store size. Pickle stores are loaded once and pruned right away.
+
+    To use:
+        builder = TrainingSetBuilder('data/blue_niles_df.parquet', preprocessor_params=pricer.preprocessor_params)
+        X, y = builder.load(start=date(2020, 4, 1), n_per_stratum=2000)
+        pricer.fit(X, y)
+        for X_block, y_block in builder.iter_blocks(pricer.preprocessor, block_size=100000):
+            ...
+    """
+    def __init__(self, path: str = 'data/blue_niles_df.pkl', preprocessor_params: Dict = None,
+                 target: str = TARGET_COLUMN, batch_size: int = 100000, lifecycle_dir: str = None):
+        """
+        Args:
+            path: Historical store path, '.parquet' is read lazily, others are read by `pd.read_pickle`.
+            preprocessor_params: Dict, `BaseModel.preprocessor_params`, the feature columns are taken from it.
+                If None then use `BaseModel.load_base_preprocessor_params()` columns.
+            target: Target column name.
+            batch_size: Number of rows per batch when reading parquet.
+            lifecycle_dir: Listing lifecycle directory, if given then rows get its 'Days On Market' like the scored
+                rows do (see `attach_days_on_market()`), so `in_stock_days` is the same feature at fit and predict
+                time.
+        """
+        self.path = path
+        self.target = target
+        self.batch_size = batch_size
+        self.lifecycle_dir = lifecycle_dir
+
+        if preprocessor_params is None:
+            cat_columns = ['Shape', 'Cut', 'Color', 'Clarity', 'Polish', 'Symmetry', 'Fluorescence', 'Culet']
+            num_columns = ['Carat', 'Depth', 'Table', 'L/W']
+        else:
+            cat_columns = list(preprocessor_params['cat']['columns'])
+            num_columns = list(preprocessor_params['num']['columns'])
+        self.columns = cat_columns + num_columns + DATE_COLUMNS + [target]
+        # Stratification columns must be read even if the model doesn't use them
+        for col in ['Shape', 'Carat']:
+            if col not in self.columns:
+                self.columns.append(col)
+
+    @property
+    def is_parquet(self) -> bool:
+        return os.path.splitext(self.path)[1] == '.parquet'
+
+    def _iter_batches(self, columns: List[str] = None, batch_size: int = None) -> Iterator[pd.DataFrame]:
+        if columns is None:
+            columns = self.columns
+        if batch_size is None:
+            batch_size = self.batch_size
+        if self.is_parquet:
+            import pyarrow.parquet as pq
+
+            parquet_file = pq.ParquetFile(self.path)
+            index_columns = [col for col in parquet_file.schema_arrow.names if col == 'Stock No.']
+            for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns + index_columns):
+                df = batch.to_pandas()
+                if 'Stock No.' in df.columns:
+                    df.set_index('Stock No.', inplace=True)
+                yield df
+        else:
+            df = pd.read_pickle(self.path)[columns]
+            for start in range(0, df.shape[0], batch_size):
+                yield df.iloc[start:start + batch_size]
+
+    @staticmethod
+    def _filter(df: pd.DataFrame, start: date = None, end: date = None, available_on: date = None) -> pd.DataFrame:
+        mask = np.ones(df.shape[0], dtype=bool)
+        if start is not None:
+            mask &= (df['Last Available Date'] >= start).values
+        if end is not None:
+            mask &= (df['First Available Date'] <= end).values
+        if available_on is not None:
+            mask &= ((df['First Available Date'] <= available_on) & (df['Last Available Date'] >= available_on)).values
+        return df[mask]
+
+    @staticmethod
+    def strata(df: pd.DataFrame, carat_bands: List[float] = None) -> pd.Series:
+        """
+        Stratum label of each row: Shape x carat band.
+        """
+        if carat_bands is None:
+            carat_bands = CARAT_BANDS
+        band = np.searchsorted(carat_bands, df['Carat'].astype(float).values, side='right')
+        return df['Shape'].astype(str) + '_' + pd.Series(band, index=df.index).astype(str)
+
+    def count_strata(self, start: date = None, end: date = None, available_on: date = None,
+                     carat_bands: List[float] = None) -> pd.Series:
+        """
+        Number of rows in each stratum, reading only the stratification and date columns.
+        """
+        counts = []
+        for df in self._iter_batches(['Shape', 'Carat', 'First Available Date', 'Last Available Date']):
+            df = self._filter(df, start=start, end=end, available_on=available_on)
+            counts.append(self.strata(df, carat_bands).value_counts())
+        if not counts:
+            return pd.Series(dtype=int)
+        return pd.concat(counts).groupby(level=0).sum()
+
+    def iter_frames(self, start: date = None, end: date = None, available_on: date = None,
+                    n_per_stratum: int = None, frac: float = None, carat_bands: List[float] = None,
+                    random_state: int = 0, batch_size: int = None) -> Iterator[pd.DataFrame]:
+        """
+        Lazily yield filtered (and sampled) batches of the feature, date and target columns.
+
+        Args:
+            start: Keep stones still available on or after this date.
+            end: Keep stones first available on or before this date.
+            available_on: Keep stones available on this date.
+            n_per_stratum: Expected number of rows sampled from each Shape x carat band stratum.
+                Needs one extra pass over two columns to count strata.
+            frac: Fraction of rows uniformly sampled, ignored if n_per_stratum is given.
+            carat_bands: Carat band edges for stratification, default is CARAT_BANDS.
+            random_state: Random seed of sampling.
+            batch_size: Number of rows read per batch before filtering, default is self.batch_size.
+        """
+        rng = np.random.RandomState(random_state)
+        lifecycle = ListingLifecycle(self.lifecycle_dir).load() if self.lifecycle_dir else None
+        rates = None
+        if n_per_stratum is not None:
+            counts = self.count_strata(start=start, end=end, available_on=available_on, carat_bands=carat_bands)
+            rates = (n_per_stratum / counts).clip(upper=1.0)
+
+        for df in self._iter_batches(batch_size=batch_size):
+            df = self._filter(df, start=start, end=end, available_on=available_on)
+            if rates is not None:
+                rate = self.strata(df, carat_bands).map(rates).fillna(0).values
+                df = df[rng.rand(df.shape[0]) < rate]
+            elif frac is not None:
+                df = df[rng.rand(df.shape[0]) < frac]
+            if df.shape[0]:
+                if lifecycle is not None:
+                    df = df.assign(**{'Days On Market': lifecycle.days_on_market(df.index).values})
+                yield df
+
+    def load(self, **kwargs) -> Tuple[pd.DataFrame, pd.Series]:
+        """
+        Load the whole (filtered and sampled) training set, see `iter_frames()` for arguments.
+
+        Returns: X, y. pd.DataFrame, pd.Series
+
+        """
+        frames = list(self.iter_frames(**kwargs))
+        df = pd.concat(frames) if frames else pd.DataFrame(columns=self.columns)
+        y = df.pop(self.target)
+        return df, y
+
+    def iter_blocks(self, preprocessor, block_size: Optional[int] = None, dtype=np.float32,
+                    **kwargs) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Yield NumPy (or CSR, if the preprocessor outputs CSR) blocks transformed by a fitted preprocessor, see
+        `iter_frames()` for filter arguments.
+
+        Args:
+            preprocessor: Fitted preprocessor, i.e. `BaseModel.preprocessor` after fitting.
+            block_size: Number of rows per block, default is self.batch_size.
+            dtype: Dtype of feature blocks.
+
+        Returns: Iterator of (X_block, y_block)
+
+        """
+        for df in self.iter_frames(batch_size=block_size, **kwargs):
+            y = df[self.target].values
+            X = preprocessor.transform(df.drop(columns=self.target))
+            yield (X.astype(dtype, copy=False) if sparse.issparse(X) else np.asarray(X, dtype=dtype)), y
@@ -0,0 +1,260 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from preprocessing.dataset import DATE_COLUMNS
+from utils.logger import get_logger
+
+
+LOGGER = get_logger(name="feature_store.py", level=logging.INFO)
+
+FEATURE_FILE = 'features.f32'
+META_FILE = 'meta.pkl'
+PREPROCESSOR_FILE = 'preprocessor.pkl'
+# Optional input of the 'in_stock_days' feature, see DateDeltaTransformer
+EXTRA_COLUMNS = ['Days On Market']
+
+
+def params_hash(preprocessor_params: Dict) -> str:
+    """
+    Stable hash of `BaseModel.preprocessor_params`, the same parameters give the same features.
+    """
+    text = json.dumps(preprocessor_params, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+
+def input_columns(preprocessor_params: Dict, columns: List[str]) -> List[str]:
+    """
+    Columns read by the base preprocessor, a row's features only change when one of them changes.
+    """
+    used = list(preprocessor_params['cat']['columns']) + list(preprocessor_params['num']['columns']) \
+        + DATE_COLUMNS + EXTRA_COLUMNS
+    return [col for col in used if col in columns]
+
+
+def row_hashes(df: pd.DataFrame, columns: List[str]) -> np.ndarray:
+    return pd.util.hash_pandas_object(df[columns], index=False).values
+
+
+class FeatureStore:
+    """
+    On-disk cache of the preprocessed float32 feature matrix of the historical store, so that fitting, scoring and
+    tuning iterations don't run the whole FeatureUnion over the same rows again.
+
+    Entries are keyed by `<preprocessor_params hash>_<fit version>` under `cache_dir/<key>/`, the fit version is
+    the hash of the rows the preprocessor was fitted on:
+        - preprocessor.pkl: the preprocessor, fitted on the rows of the `transform()` creating the entry.
+        - features.f32: raw C-order float32 rows, opened as a read-only memmap.
+        - meta.pkl: feature_name, stock numbers of the rows and of the fitted rows, a hash of each row's input
+          columns.
+    Rows are keyed by 'Stock No.'. A `transform()` of already cached rows only hashes them and opens the memmap,
+    otherwise only new stones (appended to the file) and stones whose input columns changed (i.e. a new
+    'Last Available Date', rewritten in place) are transformed. Once more than `max_unfitted_fraction` of the
+    transformed rows are stones the preprocessor wasn't fitted on, the store has moved on: the preprocessor is fitted
+    again on the new rows under a new fit version and the old entry is dropped.
+
+    To use:
+        store = FeatureStore('data/features')
+        features = store.transform(X, pricer)
+        pricer.fit_features(features, y, X=X)
+        pricer.predict_features(store.transform(X_test, pricer), X_test)
+    """
+    def __init__(self, cache_dir: str = 'data/features', chunk_size: int = 100000,
+                 max_unfitted_fraction: float = 0.2):
+        """
+        Args:
+            cache_dir: Root directory of cache entries.
+            chunk_size: Number of rows transformed at a time, bounds the memory of DataFrame copies.
+            max_unfitted_fraction: Refit the preprocessor when a larger fraction of `transform()` rows are stones it
+                wasn't fitted on.
+        """
+        self.cache_dir = cache_dir
+        self.chunk_size = chunk_size
+        self.max_unfitted_fraction = max_unfitted_fraction
+
+    def entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def entries(self, params_key: str = None) -> List[str]:
+        """
+        Keys of all entries, or of the entries of one `params_hash()`.
+        """
+        pattern = '*' if params_key is None else '{}_*'.format(params_key)
+        return sorted(os.path.basename(os.path.dirname(path))
+                      for path in glob.glob(os.path.join(self.cache_dir, pattern, META_FILE)))
+
+    def _load_meta(self, key: str) -> Dict:
+        with open(os.path.join(self.entry_dir(key), META_FILE), 'rb') as f:
+            return pickle.load(f)
+
+    def _save_meta(self, key: str, meta: Dict):
+        path = os.path.join(self.entry_dir(key), META_FILE)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def load_preprocessor(self, key: str):
+        with open(os.path.join(self.entry_dir(key), PREPROCESSOR_FILE), 'rb') as f:
+            return pickle.load(f)
+
+    def features(self, key: str) -> np.memmap:
+        """
+        All cached rows of an entry as a read-only memmap, rows are in the order of `meta['index']`.
+        """
+        meta = self._load_meta(key)
+        if meta['index'].shape[0] == 0:
+            return np.empty((0, len(meta['feature_name'])), dtype=np.float32)
+        return np.memmap(os.path.join(self.entry_dir(key), FEATURE_FILE), dtype=np.float32, mode='r',
+                         shape=(meta['index'].shape[0], len(meta['feature_name'])))
+
+    def _transform(self, preprocessor, df: pd.DataFrame):
+        # Preprocessor imputes in place, transform copies chunk by chunk
+        for start in range(0, df.shape[0], self.chunk_size):
+            features = preprocessor.transform(df.iloc[start:start + self.chunk_size].copy())
+            if hasattr(features, 'toarray'):
+                raise ValueError("FeatureStore only caches dense features, set preprocessor_params['output'] "
+                                 "format to 'dense'.")
+            yield np.ascontiguousarray(features, dtype=np.float32)
+
+    def _create(self, df: pd.DataFrame, model, columns: List[str]) -> str:
+        from sklearn.base import clone
+
+        hashes = row_hashes(df, columns)
+        key = '{}_{}'.format(params_hash(model.preprocessor_params), hashlib.sha1(hashes.tobytes()).hexdigest()[:12])
+        os.makedirs(self.entry_dir(key), exist_ok=True)
+        preprocessor = clone(model.preprocessor).fit(df.copy())
+        with open(os.path.join(self.entry_dir(key), PREPROCESSOR_FILE), 'wb') as f:
+            pickle.dump(preprocessor, f, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(os.path.join(self.entry_dir(key), FEATURE_FILE), 'wb') as f:
+            for block in self._transform(preprocessor, df):
+                f.write(block.tobytes())
+        self._save_meta(key, {
+            'feature_name': list(model.feature_name),
+            'preprocessor_params': model.preprocessor_params,
+            'columns': columns,
+            'index': df.index.copy(),
+            'fit_index': df.index.copy(),
+            'row_hash': hashes,
+        })
+        LOGGER.info("Feature cache {} created, {} rows".format(key, df.shape[0]))
+        return key
+
+    def _drop(self, key: str):
+        shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+
+    def sync(self, key: str, df: pd.DataFrame) -> Dict:
+        """
+        Bring an existing entry up to date with given rows: append new stones and rewrite changed ones.
+        Cached stones missing from df are kept.
+
+        Args:
+            key: Entry key, see `entries()`.
+            df: Rows indexed by 'Stock No.' with the input columns, duplicated stock numbers keep the last row.
+
+        Returns: {'appended': int, 'changed': int}
+
+        """
+        meta = self._load_meta(key)
+        df = df[~df.index.duplicated(keep='last')]
+        missing = [col for col in meta['columns'] if col not in df.columns]
+        if missing:
+            raise ValueError("Rows miss input columns {} of the feature cache.".format(missing))
+
+        hashes = row_hashes(df, meta['columns'])
+        positions = meta['index'].get_indexer(df.index)
+        new = positions < 0
+        changed = ~new
+        changed[changed] = meta['row_hash'][positions[changed]] != hashes[changed]
+        if not new.any() and not changed.any():
+            return {'appended': 0, 'changed': 0}
+
+        preprocessor = self.load_preprocessor(key)
+        path = os.path.join(self.entry_dir(key), FEATURE_FILE)
+        if changed.any():
+            features = np.memmap(path, dtype=np.float32, mode='r+',
+                                 shape=(meta['index'].shape[0], len(meta['feature_name'])))
+            rows = positions[changed]
+            start = 0
+            for block in self._transform(preprocessor, df[changed]):
+                features[rows[start:start + block.shape[0]]] = block
+                start += block.shape[0]
+            features.flush()
+            del features
+            meta['row_hash'][rows] = hashes[changed]
+        if new.any():
+            with open(path, 'ab') as f:
+                for block in self._transform(preprocessor, df[new]):
+                    f.write(block.tobytes())
+            meta['index'] = meta['index'].append(df.index[new])
+            meta['row_hash'] = np.concatenate([meta['row_hash'], hashes[new]])
+        self._save_meta(key, meta)
+
+        counts = {'appended': int(new.sum()), 'changed': int(changed.sum())}
+        LOGGER.info("Feature cache {} synced: {} appended, {} changed of {} rows".format(
+            key, counts['appended'], counts['changed'], meta['index'].shape[0]))
+        return counts
+
+    def transform(self, X: pd.DataFrame, model, refit: bool = False) -> np.ndarray:
+        """
+        Features of X from the cache entry of the model's preprocessor_params, computing only missing or changed
+        rows. If there's no entry, or too many rows of X are stones the entry's preprocessor wasn't fitted on, the
+        preprocessor is fitted on X in a new entry. The entry's fitted preprocessor is put into the model
+        (`model.preprocessor` and the pipeline's first step), so that `fit_features()` and `predict()` use the same
+        features.
+
+        Args:
+            X: Rows indexed by 'Stock No.', i.e. `TrainingSetBuilder.load()` or the historical store.
+            model: BaseModel, only its preprocessor_params, preprocessor and feature_name are used.
+            refit: If True then always fit the preprocessor again on X.
+
+        Returns: float32 (len(X), n_features) array aligned with X. The read-only memmap itself if X has exactly
+            the cached rows in cached order, else a copy of the selected rows.
+
+        """
+        stale = self.entries(params_hash(model.preprocessor_params))
+        key = stale.pop() if stale else None
+        if key is not None and not refit:
+            unfitted = 1 - X.index.isin(self._load_meta(key)['fit_index']).mean() if X.shape[0] else 0.0
+            if unfitted > self.max_unfitted_fraction:
+                LOGGER.info("Feature cache {}: {:.0%} of rows are unfitted stones, refitting".format(key, unfitted))
+                refit = True
+        if key is None or refit:
+            if key is not None:
+                stale.append(key)
+            key = self._create(X[~X.index.duplicated(keep='last')], model,
+                               input_columns(model.preprocessor_params, X.columns))
+        else:
+            self.sync(key, X)
+        for old in stale:
+            if old != key:
+                self._drop(old)
+
+        preprocessor = self.load_preprocessor(key)
+        model.preprocessor = preprocessor
+        if model.pipeline is not None:
+            model.pipeline.steps[0] = (model.pipeline.steps[0][0], preprocessor)
+        meta = self._load_meta(key)
+        model.feature_name = list(meta['feature_name'])
+
+        features = self.features(key)
+        if meta['index'].equals(X.index):
+            return features
+        return features[meta['index'].get_indexer(X.index)]
+
+    def update(self, df: pd.DataFrame) -> Dict:
+        """
+        Sync every cache entry with the rows of the historical store changed by an upsert, i.e. all stones seen in a
+        scrape (`update(df, return_seen=True)`), whose 'Last Available Date' moved on.
+
+        Returns: {key: {'appended': int, 'changed': int}}
+
+        """
+        return {key: self.sync(key, df) for key in self.entries()}
@@ -19,9 +19,10 @@ class DateImputer(BaseEstimator, TransformerMixin):
             last_available_date: Default 'latest', impute with latest date.
             deliver_date: Default 'latest', impute with latest date.
         """
-        self.fad = first_available_date
-        self.lad = last_available_date
-        self.dd = deliver_date
+        # Keep parameter names as attributes, so that `get_params()` and `clone()` in cross validation work
+        self.first_available_date = first_available_date
+        self.last_available_date = last_available_date
+        self.deliver_date = deliver_date
 
         # self.na_index stores all null index
         self.na_index = None
@@ -38,11 +39,11 @@ class DateImputer(BaseEstimator, TransformerMixin):
             X: Input data. Only support for pd.DataFrame.
 
         """
-        if self.fad == 'earliest':
+        if self.first_available_date == 'earliest':
             self.imputed_values['First Available Date'] = X['First Available Date'].dropna().min()
-        if self.lad == 'latest':
+        if self.last_available_date == 'latest':
             self.imputed_values['Last Available Date'] = X['Last Available Date'].dropna().max()
-        if self.dd == 'latest':
+        if self.deliver_date == 'latest':
             self.imputed_values['Delivery Date'] = X['Delivery Date'].dropna().max()
 
         # Change fit flag
@@ -2,6 +2,7 @@ from typing import List
 
 import numpy as np
 import pandas as pd
+from scipy import sparse
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.preprocessing import LabelEncoder
 
@@ -10,13 +11,21 @@ class ColumnSelector(BaseEstimator, TransformerMixin):
     """
     Transformer to filter columns, split input dataset into multiple pre-process pipeline.
     """
-    def __init__(self, col_name: List):
+    def __init__(self, col_name: List, optional_col_name: List = None):
+        """
+        Args:
+            col_name: List, columns must be in input.
+            optional_col_name: List, columns selected only if they are in input.
+        """
         self.col_name = col_name
+        self.optional_col_name = optional_col_name
 
     def fit(self, X, y=None):
         return self
 
     def transform(self, X: pd.DataFrame, y=None):
+        if self.optional_col_name:
+            return X[list(self.col_name) + [col for col in self.optional_col_name if col in X.columns]]
         return X[self.col_name]
 
 
@@ -76,9 +85,103 @@ class DateDeltaTransformer(BaseEstimator, TransformerMixin):
             delta = (X['Delivery Date'] - X['Last Available Date']).apply(lambda x: x.days)
         elif self.delta_type == 'in_stock_days':
             delta = (X['Last Available Date'] - X['First Available Date']).apply(lambda x: x.days)
+            # Days on market from listing lifecycle excludes delisted gaps, see ingest.lifecycle
+            if 'Days On Market' in X.columns:
+                delta = X['Days On Market'].fillna(delta)
         elif self.delta_type == 'customized' and self.former_date and self.later_date:
             delta = (X[self.later_date] - X[self.former_date]).apply(lambda x: x.days)
         else:
             raise ValueError("Invalid input")
         # Reshape 1-D array to 2-D array so that can be merged in FeatureUnion() with other features.
         return delta.values.reshape(-1, 1)
+
+
+# Grade orders of diamond categorical columns, from the worst (or least) grade to the best (or most).
+# Shape has no natural order, the list only fixes a stable code for each shape.
+GRADE_ORDERS = {
+    'Shape': ['Round', 'Princess', 'Emerald', 'Asscher', 'Cushion', 'Marquise', 'Radiant', 'Oval', 'Pear', 'Heart'],
+    'Cut': ['Fair', 'Good', 'Very Good', 'Ideal', 'Astor Ideal'],
+    'Color': ['M', 'L', 'K', 'J', 'I', 'H', 'G', 'F', 'E', 'D'],
+    'Clarity': ['I3', 'I2', 'I1', 'SI2', 'SI1', 'VS2', 'VS1', 'VVS2', 'VVS1', 'IF', 'FL'],
+    'Polish': ['Poor', 'Fair', 'Good', 'Very Good', 'Excellent'],
+    'Symmetry': ['Poor', 'Fair', 'Good', 'Very Good', 'Excellent'],
+    'Fluorescence': ['None', 'Faint', 'Medium', 'Strong', 'Very Strong'],
+    'Culet': ['None', 'Pointed', 'Very Small', 'Small', 'Medium', 'Slightly Large', 'Large', 'Very Large',
+              'Extremely Large'],
+}
+
+
+class DiamondGradeEncoder(BaseEstimator, TransformerMixin):
+    """
+    Encoder mapping diamond categorical grades into int8 codes in domain order (i.e. Color 'K' < 'J' < ... < 'D'),
+    instead of the alphabetical order of OrdinalEncoder. Each column is encoded by a lookup table precomputed in
+    fit(), unknown categories fall into a single `unknown_value` bucket.
+    """
+    def __init__(self, columns: List, orders: dict = None, unknown_value: int = -1):
+        """
+        Args:
+            columns: List, column names of input in order, used to find the grade order of each column.
+            orders: Dict, {column: [categories from low to high]}, overwrites GRADE_ORDERS for given columns.
+                Columns without any order are encoded by their sorted categories seen in fit().
+            unknown_value: int, code for categories not in the grade order.
+        """
+        self.columns = columns
+        self.orders = orders
+        self.unknown_value = unknown_value
+
+    def fit(self, X, y=None):
+        X = pd.DataFrame(np.asarray(X, dtype=object), columns=self.columns)
+        orders = dict(GRADE_ORDERS, **(self.orders or {}))
+
+        self.categories_ = []
+        self.lookup_ = []
+        for col in self.columns:
+            categories = orders.get(col)
+            if categories is None:
+                categories = sorted(X[col].dropna().astype(str).unique())
+            if len(categories) > np.iinfo(np.int8).max:
+                raise ValueError("Too many categories in column {} for int8 codes".format(col))
+            self.categories_.append(list(categories))
+            # Hash based lookup table, category -> position
+            self.lookup_.append(pd.Index(categories))
+        return self
+
+    def transform(self, X, y=None):
+        X = np.asarray(X, dtype=object)
+        encoded = np.empty(X.shape, dtype=np.int8)
+        for i, lookup in enumerate(self.lookup_):
+            codes = lookup.get_indexer(X[:, i])
+            codes[codes == -1] = self.unknown_value
+            encoded[:, i] = codes
+        return encoded
+
+
+class FeatureFormatter(BaseEstimator, TransformerMixin):
+    """
+    Transformer to cast features into the preprocessor output contract: dense ndarray or CSR matrix of given dtype.
+    Placed at the end of each feature pipeline, so that FeatureUnion stacks blocks of the same format and dtype
+    without upcasting or densifying. Inputs already in the right format pass through without copy.
+    """
+    def __init__(self, output_format: str = 'dense', dtype=np.float32):
+        """
+        Args:
+            output_format: String, must be one of ['dense', 'csr'].
+            dtype: Output dtype, default np.float32.
+        """
+        self.output_format = output_format
+        self.dtype = dtype
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X, y=None):
+        if self.output_format == 'dense':
+            if sparse.issparse(X):
+                return X.toarray().astype(self.dtype, copy=False)
+            return np.asarray(X, dtype=self.dtype)
+        elif self.output_format == 'csr':
+            if sparse.issparse(X):
+                return X.tocsr().astype(self.dtype, copy=False)
+            return sparse.csr_matrix(np.asarray(X, dtype=self.dtype))
+        else:
+            raise ValueError("Invalid output_format, should be one of ['dense', 'csr']")
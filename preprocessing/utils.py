@@ -8,7 +8,8 @@ from sklearn.pipeline import Pipeline, FeatureUnion
 from sklearn.preprocessing import MinMaxScaler, OneHotEncoder, OrdinalEncoder, StandardScaler
 
 from preprocessing.imputer import DateImputer
-from preprocessing.transformer import ColumnSelector, DateDeltaTransformer, DateSplitTransformer
+from preprocessing.transformer import ColumnSelector, DateDeltaTransformer, DateSplitTransformer, DiamondGradeEncoder, \
+    FeatureFormatter
 
 
 def generate_tuning_dict(tune_params: Dict = None):
@@ -66,38 +67,49 @@ def generate_feature_union(transformer_dict_list: List):
     return feature_union, tuning_dict
 
 
-def generate_cat_preprocessor(columns, imputer_strategy='most_frequent', encoder_type='Ordinal', tune_params=None):
+def generate_cat_preprocessor(columns, imputer_strategy='most_frequent', encoder_type='Ordinal', tune_params=None,
+                              output_format=None, dtype=np.float32):
     """
     Helper function to generate categorical features preprocessor pipeline [ColumnSelector, SimpleImputer, Encoder].
 
     Args:
         columns: Iterable, List of categorical columns supposed to be fed into model.
         imputer_strategy: String, `strategy` parameter of SimpleImputer. Default is 'most_frequent'.
-        encoder_type: String, if 'Ordinal' then use OrdinalEncoder, if 'OneHot' then use OneHotEncoder.
+        encoder_type: String, if 'Ordinal' then use OrdinalEncoder, if 'OneHot' then use OneHotEncoder,
+            if 'Grade' then use DiamondGradeEncoder, which encodes grades in domain order.
         tune_params: Dict, tuning parameters dict, the keys should be in ['selector', 'imputer', 'encoder'],
             which are steps of the Pipeline, i.e. {'imputer': {'strategy': ['most_frequent', 'mean', 'median']}}.
+        output_format: String, one of ['dense', 'csr']. If given then add a FeatureFormatter step casting output
+            into this format and `dtype`. If None then keep each encoder's own output.
+        dtype: Output dtype of encoder and FeatureFormatter, default np.float32.
 
     Returns: preprocessor, feature names, tuning hyper-parameters. Pipeline, List, Dict.
 
     """
     if encoder_type == 'Ordinal':
-        encoder = OrdinalEncoder()
+        encoder = OrdinalEncoder() if output_format is None else OrdinalEncoder(dtype=dtype)
     elif encoder_type == 'OneHot':
-        encoder = OneHotEncoder()
+        encoder = OneHotEncoder() if output_format is None else \
+            OneHotEncoder(sparse=output_format == 'csr', dtype=dtype)
+    elif encoder_type == 'Grade':
+        encoder = DiamondGradeEncoder(columns=list(columns))
     else:
-        raise ValueError("Invalid encoder_type, should be one of ['Ordinal', 'OneHot']")
+        raise ValueError("Invalid encoder_type, should be one of ['Ordinal', 'OneHot', 'Grade']")
 
     cat_preprocessor = Pipeline([
         ('selector', ColumnSelector(columns)),
         ('imputer', SimpleImputer(strategy=imputer_strategy)),
         ('encoder', encoder),
     ])
+    if output_format is not None:
+        cat_preprocessor.steps.append(('formatter', FeatureFormatter(output_format=output_format, dtype=dtype)))
     feature_name = list(columns)
     tuning_dict = generate_tuning_dict(tune_params)
     return cat_preprocessor, feature_name, tuning_dict
 
 
-def generate_num_preprocessor(columns, imputer_strategy='median', scaler_type='Standard', tune_params=None):
+def generate_num_preprocessor(columns, imputer_strategy='median', scaler_type='Standard', tune_params=None,
+                              output_format=None, dtype=np.float32):
     """
     Helper function to generate numerical features preprocessor pipeline [ColumnSelector, SimpleImputer, Scaler].
 
@@ -107,6 +119,8 @@ def generate_num_preprocessor(columns, imputer_strategy='median', scaler_type='S
         scaler_type: String, if 'Standard' then use StandardScaler, if 'MinMax' then use MinMaxScaler.
         tune_params: Dict, tuning parameters dict, the keys should be in ['selector', 'imputer', 'scaler'],
             which are steps of the Pipeline, i.e. {'imputer': {'strategy': ['most_frequent', 'mean', 'median']}}.
+        output_format: String, one of ['dense', 'csr']. If given then add a FeatureFormatter step.
+        dtype: Output dtype of FeatureFormatter, default np.float32.
 
     Returns: preprocessor, feature names, tuning hyper-parameters. Pipeline, List, Dict.
 
@@ -123,12 +137,14 @@ def generate_num_preprocessor(columns, imputer_strategy='median', scaler_type='S
         ('imputer', SimpleImputer(strategy=imputer_strategy)),
         ('scaler', scaler)
     ])
+    if output_format is not None:
+        num_preprocessor.steps.append(('formatter', FeatureFormatter(output_format=output_format, dtype=dtype)))
     feature_name = list(columns)
     tuning_dict = generate_tuning_dict(tune_params)
     return num_preprocessor, feature_name, tuning_dict
 
 
-def generate_date_preprocessor(split_cols, delta_types, imputer_strategy=None):
+def generate_date_preprocessor(split_cols, delta_types, imputer_strategy=None, output_format=None, dtype=np.float32):
     """
     Helper function to generate numerical features preprocessor pipeline [ColumnSelector, DateImputer, DateTransformer].
     tune_params is invalid input here since there aren't tunable parameters in Pipeline currently.
@@ -137,6 +153,8 @@ def generate_date_preprocessor(split_cols, delta_types, imputer_strategy=None):
         split_cols: Iterable, columns put into DateSplitTransformer to split.
         delta_types: Iterable, each element should be valid parameter of `DateDeltaTransformer.delta_type`.
         imputer_strategy: Dict, parameters of DateImputer.
+        output_format: String, one of ['dense', 'csr']. If given then add a FeatureFormatter step.
+        dtype: Output dtype of FeatureFormatter, default np.float32.
 
     Returns: preprocessor, feature names. Pipeline, List
 
@@ -157,10 +175,13 @@ def generate_date_preprocessor(split_cols, delta_types, imputer_strategy=None):
 
     date_feature_union, _ = generate_feature_union(splitter + delta)
     date_preprocessor = Pipeline([
-            ('selector', ColumnSelector(['First Available Date', 'Last Available Date', 'Delivery Date'])),
+            ('selector', ColumnSelector(['First Available Date', 'Last Available Date', 'Delivery Date'],
+                                        optional_col_name=['Days On Market'])),
             ('imputer', DateImputer(**imputer_strategy)),
             ('date_feature', date_feature_union)
         ])
+    if output_format is not None:
+        date_preprocessor.steps.append(('formatter', FeatureFormatter(output_format=output_format, dtype=dtype)))
     feature_name = np.array([trans['transformer'].split_feature_name for trans in splitter]).flatten().tolist()
     feature_name += delta_types
     return date_preprocessor, feature_name
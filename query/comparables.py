@@ -0,0 +1,344 @@
+"""
+Comparable stones search over the pricer's feature space.
+
+To use:
+    python -m query.comparables LD12345678 --k 10
+"""
+import argparse
+import logging
+import os
+import pickle
+from typing import Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+from ingest.lifecycle import attach_days_on_market
+from utils.logger import get_logger
+
+
+LOGGER = get_logger(name="comparables.py", level=logging.INFO)
+
+# Grade and shape features of the base preprocessor, dates are returned with comparables but never compared
+DEFAULT_FEATURES = ['cut', 'color', 'clarity', 'polish', 'symmetry', 'fluorescence', 'culet',
+                    'carat', 'depth', 'table', 'l/w']
+# Carat drives price the most, a grade step should count less than a large carat difference
+DEFAULT_WEIGHTS = {'carat': 3.0}
+DISPLAY_COLUMNS = ['Shape', 'Carat', 'Cut', 'Color', 'Clarity', 'Price', 'Discount Price', 'Price/Ct',
+                   'First Available Date', 'Last Available Date']
+
+
+class ComparablesIndex:
+    """
+    k-nearest-neighbour index of stones over (a subset of) the pricer's `feature_name` space. Each feature is
+    divided by its standard deviation so that grades and carat are comparable, then multiplied by its weight.
+    Stones are only compared within the same partition (default 'Shape'), one KD-tree per partition.
+
+    The index grows incrementally: rows added by `update()` go to a per-partition buffer searched by brute force
+    next to the tree, and a partition's tree is rebuilt only when its buffer exceeds `rebuild_fraction` of the tree.
+    Re-priced stones only update their prices and dates.
+
+    To use:
+        index = ComparablesIndex.from_store('data/blue_niles_df.pkl', 'data/pricer.pkl')
+        index.query_stock(['LD12345678'], k=10)
+        index.query(new_stones, model, k=10)
+    """
+    def __init__(self, features: List[str] = None, weights: Dict[str, float] = None, partition_by: str = 'Shape',
+                 leaf_size: int = 40, rebuild_fraction: float = 0.1):
+        """
+        Args:
+            features: Names in the model's `feature_name` to compare, default is DEFAULT_FEATURES.
+            weights: {feature: weight}, features not given weigh 1, default is DEFAULT_WEIGHTS.
+            partition_by: Column whose values must match exactly, None means one partition.
+            leaf_size: KD-tree leaf size.
+            rebuild_fraction: Rebuild a partition's tree when its buffer is larger than this fraction of the tree.
+        """
+        self.features = features
+        self.weights = weights
+        self.partition_by = partition_by
+        self.leaf_size = leaf_size
+        self.rebuild_fraction = rebuild_fraction
+
+        self.frame = None
+        self.points = None
+        # Partition label of each frame row
+        self.labels = None
+        self.columns = None
+        self.scale = None
+        # {partition value: {'tree': KDTree, 'positions': tree row -> frame row, 'buffer': frame rows not in tree,
+        #                    'buffer_points': (buffer points, their squared norms)}}
+        self.partitions = {}
+        self.source_mtime = None
+        self.model_mtime = None
+
+    def _features(self, X: pd.DataFrame, model) -> np.ndarray:
+        # Preprocessor imputes in place, keep X untouched
+        features = model.transform_features(X.copy())
+        if hasattr(features, 'toarray'):
+            features = features.toarray()
+        return np.asarray(features, dtype=np.float64)[:, self.columns]
+
+    def _partition_labels(self, X: pd.DataFrame) -> np.ndarray:
+        if self.partition_by is None:
+            return np.zeros(X.shape[0], dtype=object)
+        return X[self.partition_by].astype(str).values
+
+    def _build_tree(self, label):
+        from sklearn.neighbors import KDTree
+
+        partition = self.partitions[label]
+        positions = np.concatenate([partition['positions'], partition['buffer']])
+        partition['positions'] = positions
+        partition['buffer'] = np.empty(0, dtype=np.int64)
+        partition['buffer_points'] = None
+        partition['tree'] = KDTree(self.points[positions], leaf_size=self.leaf_size)
+
+    def build(self, df: pd.DataFrame, model):
+        """
+        Build the index from a DataFrame shaped like `data/blue_niles_df.pkl`.
+
+        Args:
+            df: Historical store, duplicated stock numbers keep the last row.
+            model: Fitted pricer, see `BaseModel.transform_features()`.
+
+        Raises:
+            ValueError: A compared feature is not in `model.feature_name`, i.e. OneHot encoded categories.
+
+        """
+        features = self.features or DEFAULT_FEATURES
+        weights = DEFAULT_WEIGHTS if self.weights is None else self.weights
+        missing = [name for name in features if name not in (model.feature_name or [])]
+        if missing:
+            raise ValueError("Features {} not in model.feature_name {}.".format(missing, model.feature_name))
+        self.columns = [model.feature_name.index(name) for name in features]
+
+        df = df[~df.index.duplicated(keep='last')]
+        points = self._features(df, model)
+        std = points.std(axis=0)
+        self.scale = np.array([weights.get(name, 1.0) for name in features]) / np.where(std > 0, std, 1.0)
+        self.points = points * self.scale
+        self.frame = df[[col for col in DISPLAY_COLUMNS if col in df.columns]]
+
+        self.partitions = {}
+        labels = self.labels = self._partition_labels(df)
+        for label in pd.unique(labels):
+            self.partitions[label] = {'positions': np.flatnonzero(labels == label),
+                                      'buffer': np.empty(0, dtype=np.int64)}
+            self._build_tree(label)
+        return self
+
+    def update(self, delta: pd.DataFrame, model) -> int:
+        """
+        Add today's new stones and refresh prices and dates of re-priced ones.
+
+        Args:
+            delta: New or re-priced rows of the historical store, i.e. `update(df, return_delta=True)`.
+            model: Fitted pricer the index was built with.
+
+        Returns: number of partitions whose tree was rebuilt
+
+        """
+        delta = delta[~delta.index.duplicated(keep='last')]
+        existing = delta.index.isin(self.frame.index)
+        changed = delta[existing]
+        if changed.shape[0]:
+            columns = [col for col in self.frame.columns if col in changed.columns]
+            frame = self.frame.copy()
+            frame.loc[changed.index, columns] = changed[columns]
+            self.frame = frame
+
+        new = delta[~existing]
+        if new.shape[0] == 0:
+            return 0
+        start = self.frame.shape[0]
+        self.points = np.vstack([self.points, self._features(new, model) * self.scale])
+        self.frame = pd.concat([self.frame, new[self.frame.columns.intersection(new.columns)]])
+
+        rebuilt = 0
+        labels = self._partition_labels(new)
+        self.labels = np.concatenate([self.labels, labels])
+        for label in pd.unique(labels):
+            positions = start + np.flatnonzero(labels == label)
+            if label not in self.partitions:
+                self.partitions[label] = {'positions': np.empty(0, dtype=np.int64), 'buffer': positions}
+            else:
+                partition = self.partitions[label]
+                partition['buffer'] = np.concatenate([partition['buffer'], positions])
+            partition = self.partitions[label]
+            if len(partition['buffer']) > self.rebuild_fraction * len(partition['positions']):
+                self._build_tree(label)
+                rebuilt += 1
+            else:
+                # Brute force searched points and their squared norms
+                buffered = self.points[partition['buffer']]
+                partition['buffer_points'] = (buffered, (buffered ** 2).sum(axis=1))
+        return rebuilt
+
+    def _search(self, points: np.ndarray, labels: np.ndarray, k: int, exclude: np.ndarray = None):
+        # Nearest frame rows and distances of each point, -1 and inf where a partition has fewer than k stones
+        n_neighbors = k + (exclude is not None)
+        positions = np.full((len(points), n_neighbors), -1, dtype=np.int64)
+        distances = np.full((len(points), n_neighbors), np.inf)
+        for label in set(labels):
+            if label not in self.partitions:
+                continue
+            rows = np.flatnonzero(labels == label)
+            partition = self.partitions[label]
+            candidates_d, candidates_p = [], []
+            if len(partition['positions']):
+                n = min(n_neighbors, len(partition['positions']))
+                dist, ind = partition['tree'].query(points[rows], k=n)
+                candidates_d.append(dist)
+                candidates_p.append(partition['positions'][ind])
+            if len(partition['buffer']):
+                buffered, norms = partition['buffer_points']
+                # |a - b|^2 = |a|^2 + |b|^2 - 2ab, without a (rows, buffer, features) temporary
+                squared = (points[rows] ** 2).sum(axis=1)[:, None] + norms[None, :] - 2 * points[rows] @ buffered.T
+                ind = partition['buffer'][None, :]
+                if squared.shape[1] > n_neighbors:
+                    ind = np.argpartition(squared, n_neighbors - 1, axis=1)[:, :n_neighbors]
+                    squared = np.take_along_axis(squared, ind, axis=1)
+                    ind = partition['buffer'][ind]
+                candidates_d.append(np.sqrt(np.maximum(squared, 0)))
+                candidates_p.append(np.broadcast_to(ind, squared.shape))
+            dist = np.hstack(candidates_d)
+            pos = np.hstack(candidates_p)
+            if exclude is not None:
+                dist = np.where(pos == exclude[rows, None], np.inf, dist)
+            n = min(n_neighbors, dist.shape[1])
+            order = np.argsort(dist, axis=1, kind='stable')[:, :n]
+            distances[rows, :n] = np.take_along_axis(dist, order, axis=1)
+            positions[rows, :n] = np.take_along_axis(pos, order, axis=1)
+        if exclude is not None:
+            positions, distances = positions[:, :k], distances[:, :k]
+        positions[np.isinf(distances)] = -1
+        return positions, distances
+
+    def _result(self, query_index: pd.Index, positions: np.ndarray, distances: np.ndarray) -> pd.DataFrame:
+        # One DataFrame from numpy columns, `take()` plus inserting columns costs several times more
+        found = positions >= 0
+        rows, ranks = np.nonzero(found)
+        selected = positions[found]
+        data = {'Query': query_index[rows], 'Rank': ranks + 1, 'Distance': distances[found]}
+        data.update((col, self.frame[col].values[selected]) for col in self.frame.columns)
+        return pd.DataFrame(data, index=self.frame.index[selected])
+
+    def query(self, X: pd.DataFrame, model, k: int = 10) -> pd.DataFrame:
+        """
+        Comparable stones of given (i.e. not yet listed) stones.
+
+        Args:
+            X: Stones to compare, with the model's input columns.
+            model: Fitted pricer the index was built with.
+            k: Number of comparables per stone.
+
+        Returns: pd.DataFrame indexed by comparables' 'Stock No.', | Query | Rank | Distance | DISPLAY_COLUMNS |
+
+        """
+        positions, distances = self._search(self._features(X, model) * self.scale, self._partition_labels(X), k)
+        return self._result(X.index, positions, distances)
+
+    def neighbors(self, stock_numbers: Iterable[str], k: int = 10):
+        """
+        Raw nearest neighbours of indexed stones without building a DataFrame, the stone itself is excluded.
+        Unknown stock numbers are skipped.
+
+        Returns: (query positions, neighbour positions, distances), positions are rows of `self.frame`, the last two
+            are (n_queries, k) arrays with -1 and inf where a partition has fewer than k other stones
+
+        """
+        positions = self.frame.index.get_indexer(list(stock_numbers))
+        positions = positions[positions >= 0]
+        neighbors, distances = self._search(self.points[positions], self.labels[positions], k, exclude=positions)
+        return positions, neighbors, distances
+
+    def query_stock(self, stock_numbers: Iterable[str], k: int = 10) -> pd.DataFrame:
+        """
+        Comparable stones of indexed stones, see `neighbors()`.
+
+        Returns: pd.DataFrame, see `query()`
+
+        """
+        positions, neighbors, distances = self.neighbors(stock_numbers, k=k)
+        return self._result(self.frame.index[positions], neighbors, distances)
+
+    def save(self, path: str):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path: str):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    @classmethod
+    def from_store(cls, store_path: str = 'data/blue_niles_df.pkl', model_path: str = 'data/pricer.pkl',
+                   index_path: str = 'data/comparables_index.pkl', delta: pd.DataFrame = None,
+                   delta_base_mtime: float = None, lifecycle_dir: str = None, **kwargs):
+        """
+        Load the cached index if it's built from the current store and model, else rebuild and cache it.
+        If `delta` is given, a cached index of the current model is updated by it instead of being rebuilt, only if
+        the index is built from the store version the delta applies to: a delta skipped in between (i.e. a failed
+        ingest stage) means rows missing from the index, thus a rebuild.
+
+        Args:
+            store_path: Historical store path.
+            model_path: Pricer saved by `BaseModel.save()`, a new model means a new feature space and a rebuild.
+            index_path: Cached index path, None means no cache.
+            delta: Rows just upserted into the store, see `update()`.
+            delta_base_mtime: Modification time of the store before the delta's upsert.
+            lifecycle_dir: Listing lifecycle directory, if given then a rebuilt index gets 'Days On Market' like the
+                delta does, see `attach_days_on_market()`.
+            kwargs: Arguments of `ComparablesIndex()` used when rebuilding.
+        """
+        from model.base import BaseModel
+
+        store_mtime = os.path.getmtime(store_path)
+        model_mtime = os.path.getmtime(model_path)
+        model = None
+        if index_path and os.path.isfile(index_path):
+            index = cls.load(index_path)
+            if index.model_mtime == model_mtime:
+                if index.source_mtime == store_mtime:
+                    return index
+                if delta is not None and delta_base_mtime is not None and index.source_mtime == delta_base_mtime:
+                    model = BaseModel.load(model_path)
+                    index.update(delta, model)
+                    index.source_mtime = store_mtime
+                    index.save(index_path)
+                    return index
+                LOGGER.info("Comparables index is behind the store, rebuilding")
+
+        if model is None:
+            model = BaseModel.load(model_path)
+        store = pd.read_pickle(store_path)
+        if lifecycle_dir:
+            store = attach_days_on_market(store, lifecycle_dir=lifecycle_dir)
+        index = cls(**kwargs).build(store, model)
+        index.source_mtime = store_mtime
+        index.model_mtime = model_mtime
+        if index_path:
+            index.save(index_path)
+        return index
+
+
+def build_parser(parser: argparse.ArgumentParser = None) -> argparse.ArgumentParser:
+    if parser is None:
+        parser = argparse.ArgumentParser(description='Find comparable stones of listed stones.')
+    parser.add_argument('stock_numbers', nargs='+')
+    parser.add_argument('--k', type=int, default=10, help='Number of comparables per stone.')
+    parser.add_argument('--store', default='data/blue_niles_df.pkl', help='Historical store path.')
+    parser.add_argument('--model', default='data/pricer.pkl', help='Pricer defining the feature space.')
+    parser.add_argument('--index', default='data/comparables_index.pkl', help='Cached index path.')
+    parser.add_argument('--lifecycle-dir', default='data/lifecycle', help="Listing lifecycle of 'Days On Market'.")
+    return parser
+
+
+def run(args: argparse.Namespace) -> pd.DataFrame:
+    index = ComparablesIndex.from_store(args.store, args.model, args.index, lifecycle_dir=args.lifecycle_dir)
+    return index.query_stock(args.stock_numbers, k=args.k)
+
+
+if __name__ == "__main__":
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(run(build_parser().parse_args()))
@@ -0,0 +1,186 @@
+"""
+Condition-based diamond search over the historical store.
+
+To use:
+    python -m query.engine --carat 1 1.2 --price 0 8000 --shape Round --color D E F --order price_per_carat --top 10
+"""
+import argparse
+import os
+import pickle
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+RANGE_COLUMNS = {'carat': 'Carat', 'price': 'Price', 'price_per_carat': 'Price/Ct'}
+CATEGORY_COLUMNS = {'shape': 'Shape', 'cut': 'Cut', 'color': 'Color', 'clarity': 'Clarity'}
+DISPLAY_COLUMNS = ['Shape', 'Carat', 'Cut', 'Color', 'Clarity', 'Price', 'Discount Price', 'Price/Ct',
+                   'First Available Date', 'Last Available Date']
+
+
+class DiamondQueryEngine:
+    """
+    Search engine over the historical store with secondary indexes:
+        - sorted index (argsort + sorted values) on Carat, Price and Price/Ct for range predicates.
+        - inverted index (row positions of each category) on Shape, Cut, Color and Clarity.
+    A query starts from the most selective predicate, whose candidates are found by binary search or posting lists,
+    then checks the remaining predicates on candidates only and picks the top-N by argpartition. No full scan.
+    """
+    def __init__(self):
+        self.frame = None
+        self.sorted_index = {}
+        self.inverted_index = {}
+        self.codes = {}
+        self.categories = {}
+        self.latest_date = None
+        self.source_mtime = None
+
+    def build(self, df: pd.DataFrame):
+        """
+        Build all indexes from a DataFrame shaped like `data/blue_niles_df.pkl`.
+        """
+        df = df[[col for col in DISPLAY_COLUMNS if col in df.columns]]
+        self.frame = df
+        for col in RANGE_COLUMNS.values():
+            values = df[col].values.astype(np.float64)
+            order = np.argsort(values, kind='stable')
+            self.sorted_index[col] = (values[order], order)
+        for col in CATEGORY_COLUMNS.values():
+            codes, categories = pd.factorize(df[col].astype(str))
+            order = np.argsort(codes, kind='stable')
+            bounds = np.cumsum(np.bincount(codes, minlength=len(categories)))[:-1]
+            self.codes[col] = codes
+            self.categories[col] = pd.Index(categories)
+            self.inverted_index[col] = dict(zip(categories, np.split(order, bounds)))
+        if 'Last Available Date' in df.columns and df.shape[0]:
+            self.latest_date = df['Last Available Date'].max()
+        return self
+
+    def _range(self, col: str, low: float = None, high: float = None) -> np.ndarray:
+        values, order = self.sorted_index[col]
+        start = 0 if low is None else np.searchsorted(values, low, side='left')
+        end = len(values) if high is None else np.searchsorted(values, high, side='right')
+        return order[start:end]
+
+    def _range_size(self, col: str, low: float = None, high: float = None) -> int:
+        values, _ = self.sorted_index[col]
+        start = 0 if low is None else np.searchsorted(values, low, side='left')
+        end = len(values) if high is None else np.searchsorted(values, high, side='right')
+        return max(end - start, 0)
+
+    def _category(self, col: str, values: Iterable[str]) -> np.ndarray:
+        lists = [self.inverted_index[col][value] for value in values if value in self.inverted_index[col]]
+        return np.sort(np.concatenate(lists)) if lists else np.empty(0, dtype=np.int64)
+
+    def _category_size(self, col: str, values: Iterable[str]) -> int:
+        return sum(len(self.inverted_index[col].get(value, ())) for value in values)
+
+    def query(self, ranges: Dict[str, Tuple] = None, categories: Dict[str, List[str]] = None,
+              in_stock: bool = False, order_by: str = 'price', ascending: bool = True, top: int = 10) -> pd.DataFrame:
+        """
+        Args:
+            ranges: Dict, {'carat' | 'price' | 'price_per_carat': (low, high)}, None bound means unbounded.
+            categories: Dict, {'shape' | 'cut' | 'color' | 'clarity': [allowed values]}.
+            in_stock: If True then keep only stones available on the latest scrape date.
+            order_by: String, one of ['price', 'price_per_carat', 'carat'], i.e. 'price_per_carat' for best value.
+            ascending: If True then cheapest (smallest) first.
+            top: Number of stones to return, None means all.
+
+        Returns: pd.DataFrame of matched stones indexed by 'Stock No.'
+
+        """
+        ranges = {RANGE_COLUMNS[key]: bound for key, bound in (ranges or {}).items()}
+        categories = {CATEGORY_COLUMNS[key]: list(values) for key, values in (categories or {}).items()}
+
+        # Start from the most selective predicate
+        sizes = [(self._range_size(col, *bound), 'range', col) for col, bound in ranges.items()]
+        sizes += [(self._category_size(col, values), 'category', col) for col, values in categories.items()]
+        if sizes:
+            _, kind, first_col = min(sizes)
+            if kind == 'range':
+                candidates = self._range(first_col, *ranges.pop(first_col))
+            else:
+                candidates = self._category(first_col, categories.pop(first_col))
+        else:
+            candidates = np.arange(self.frame.shape[0])
+
+        # Check the rest predicates on candidates only
+        for col, (low, high) in ranges.items():
+            values = self.frame[col].values[candidates]
+            mask = np.ones(len(candidates), dtype=bool)
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values <= high
+            candidates = candidates[mask]
+        for col, values in categories.items():
+            allowed = np.zeros(len(self.categories[col]), dtype=bool)
+            allowed[self.categories[col].get_indexer([v for v in values if v in self.categories[col]])] = True
+            candidates = candidates[allowed[self.codes[col][candidates]]]
+        if in_stock and self.latest_date is not None:
+            candidates = candidates[self.frame['Last Available Date'].values[candidates] == self.latest_date]
+
+        # Top-N
+        keys = self.frame[RANGE_COLUMNS[order_by]].values[candidates].astype(np.float64)
+        if not ascending:
+            keys = -keys
+        if top is not None and top < len(candidates):
+            part = np.argpartition(keys, top)[:top]
+            candidates, keys = candidates[part], keys[part]
+        candidates = candidates[np.argsort(keys, kind='stable')]
+        return self.frame.iloc[candidates]
+
+    def save(self, path: str):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path: str):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    @classmethod
+    def from_store(cls, store_path: str = 'data/blue_niles_df.pkl', index_path: str = 'data/blue_niles_index.pkl'):
+        """
+        Load the cached indexes if they are built from the current store, else rebuild and cache them.
+        """
+        store_mtime = os.path.getmtime(store_path)
+        if index_path and os.path.isfile(index_path):
+            engine = cls.load(index_path)
+            if engine.source_mtime == store_mtime:
+                return engine
+        engine = cls().build(pd.read_pickle(store_path))
+        engine.source_mtime = store_mtime
+        if index_path:
+            engine.save(index_path)
+        return engine
+
+
+def build_parser(parser: argparse.ArgumentParser = None) -> argparse.ArgumentParser:
+    if parser is None:
+        parser = argparse.ArgumentParser(description='Search diamonds by conditions.')
+    parser.add_argument('--store', default='data/blue_niles_df.pkl', help='Historical store path.')
+    parser.add_argument('--index', default='data/blue_niles_index.pkl', help='Cached index path.')
+    for key in RANGE_COLUMNS:
+        parser.add_argument('--{}'.format(key.replace('_', '-')), type=float, nargs=2, metavar=('MIN', 'MAX'))
+    for key in CATEGORY_COLUMNS:
+        parser.add_argument('--{}'.format(key), nargs='+')
+    parser.add_argument('--in-stock', action='store_true', help='Only stones available in the latest scrape.')
+    parser.add_argument('--order', default='price', choices=list(RANGE_COLUMNS))
+    parser.add_argument('--desc', action='store_true', help='Largest first.')
+    parser.add_argument('--top', type=int, default=10)
+    return parser
+
+
+def run(args: argparse.Namespace) -> pd.DataFrame:
+    engine = DiamondQueryEngine.from_store(args.store, args.index)
+    ranges = {key: tuple(getattr(args, key)) for key in RANGE_COLUMNS if getattr(args, key) is not None}
+    categories = {key: getattr(args, key) for key in CATEGORY_COLUMNS if getattr(args, key) is not None}
+    return engine.query(ranges=ranges, categories=categories, in_stock=args.in_stock, order_by=args.order,
+                        ascending=not args.desc, top=args.top)
+
+
+if __name__ == "__main__":
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(run(build_parser().parse_args()))
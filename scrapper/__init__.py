@@ -0,0 +1,6 @@
+# Columns shared with the ingest side, kept here so that it doesn't import the scrappers (selenium, requests)
+
+# Raw field count of records which don't fit the expected columns, i.e. when the grid layout changes
+FIELD_COUNT_COLUMN = 'Field Count'
+# Retailer of each row in the normalized store
+RETAILER_COLUMN = 'Retailer'
@@ -0,0 +1,160 @@
+from typing import Dict, List
+
+from bs4 import BeautifulSoup
+import pandas as pd
+
+from scrapper import FIELD_COUNT_COLUMN, RETAILER_COLUMN
+from scrapper.blue_niles import FILTER_ELEMENTS, BlueNileScrapper, DriverBlueNileScrapper, set_input_by_element_name
+
+
+# The normalized store keeps Blue Nile's raw columns, other retailers map their columns onto them
+NORMALIZED_COLUMNS = ['Shape', 'Price', 'Discount Price', 'Carat', 'Cut', 'Color', 'Clarity', 'Polish', 'Symmetry',
+                      'Fluorescence', 'Depth', 'Table', 'L/W', 'Price/Ct', 'Culet', 'Stock No.', 'Delivery Date']
+
+
+class RetailerAdapter:
+    """
+    Everything retailer specific of a driver scrapper: url, filter inputs, grid row parsing and how its columns map
+    onto NORMALIZED_COLUMNS. The browser control (launch, scroll, paging through filter sets) is shared, see
+    RetailerDriverScrapper.
+
+    To add a retailer, subclass it and register the class in ADAPTERS:
+        class ExampleAdapter(RetailerAdapter):
+            retailer = 'example'
+            url = 'https://www.example.com/diamonds'
+            columns = ['Stock #', 'Shape', 'Carat', ...]
+            column_mapping = {'Stock #': 'Stock No.'}
+            filter_elements = {'carat_min': 'minCarat', 'carat_max': 'maxCarat', ...}
+
+            def get_record(self, soup):
+                return [row.get_text(';').split(';') for row in soup.find_all('tr', class_='result')]
+    """
+    # Retailer name, also the value of RETAILER_COLUMN
+    retailer = None
+    url = None
+    # Raw column names in the order of fields returned by `get_record()`
+    columns = NORMALIZED_COLUMNS
+    # {raw column: normalized column}, unmapped columns keep their names, columns out of NORMALIZED_COLUMNS are dropped
+    column_mapping = {}
+    # HTML element names of the filter inputs, keys are ['carat_min', 'carat_max', 'price_min', 'price_max']
+    filter_elements = FILTER_ELEMENTS
+    # Prepended to stock numbers so that they never collide with another retailer's, default is '<retailer>-'
+    stock_prefix = None
+
+    def get_column_name(self) -> List:
+        return list(self.columns)
+
+    def get_record(self, soup: BeautifulSoup) -> List:
+        """
+        Parse the grid rows of a loaded page.
+
+        Returns: list of records, each one a list of strings in the order of `columns`
+
+        """
+        raise NotImplementedError
+
+    def set_filter(self, driver, element_name: str, value: float, click_pause_time: int = 1):
+        """
+        Set a single filter input of the loaded page, default types the value and presses enter.
+        """
+        set_input_by_element_name(driver, element_name=element_name, value=value, click_pause_time=click_pause_time)
+
+    def set_name(self, set_name: str) -> str:
+        """
+        Filter set name used by the ingestion (snapshots, quarantine and cube), qualified by the retailer.
+        """
+        return '{}_{}'.format(self.retailer, set_name)
+
+    def filter_sets(self) -> Dict:
+        """
+        Default filter sets of the retailer, {set_name: (carat_set, price_set)}, one page over the whole range.
+        """
+        return {'all': ([[0.23, 20.98]], [[261, 1860430]])}
+
+    def normalize(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Map a raw DataFrame of the retailer onto NORMALIZED_COLUMNS plus RETAILER_COLUMN, values are kept as raw
+        strings for `validate_raw()` and `transformation()`. Missing columns are filled by None.
+
+        Returns: pd.DataFrame
+
+        """
+        df = df.rename(columns=self.column_mapping)
+        columns = NORMALIZED_COLUMNS + [FIELD_COUNT_COLUMN] if FIELD_COUNT_COLUMN in df.columns \
+            else NORMALIZED_COLUMNS
+        df = df.reindex(columns=columns)
+        prefix = '{}-'.format(self.retailer) if self.stock_prefix is None else self.stock_prefix
+        if prefix:
+            df['Stock No.'] = prefix + df['Stock No.'].astype(str)
+        df[RETAILER_COLUMN] = self.retailer
+        return df
+
+
+class BlueNileAdapter(RetailerAdapter):
+    """
+    Blue Nile, parsed by BlueNileScrapper. Stock numbers and set names are kept as they are, so that the existing
+    store and snapshots carry on.
+    """
+    retailer = 'bluenile'
+    url = 'https://www.bluenile.com/diamond-search'
+    stock_prefix = ''
+
+    def __init__(self):
+        self._parser = BlueNileScrapper(self.url)
+
+    def get_column_name(self) -> List:
+        return self._parser.get_column_name()
+
+    def get_record(self, soup: BeautifulSoup) -> List:
+        return self._parser.get_record(soup=soup)
+
+    def set_name(self, set_name: str) -> str:
+        return set_name
+
+    def filter_sets(self) -> Dict:
+        from customized_auto_scrapper import carat_range, price_range
+
+        return {carat_set_name: (carat_range[carat_set_name], price_range[price_set_name])
+                for carat_set_name, price_set_name in zip(carat_range, price_range)}
+
+
+# {retailer: adapter class}
+ADAPTERS = {
+    BlueNileAdapter.retailer: BlueNileAdapter,
+}
+
+
+def get_adapter(retailer: str) -> RetailerAdapter:
+    if retailer not in ADAPTERS:
+        raise ValueError("Invalid retailer, should be one of {}".format(list(ADAPTERS)))
+    return ADAPTERS[retailer]()
+
+
+class RetailerDriverScrapper(DriverBlueNileScrapper):
+    """
+    DriverBlueNileScrapper driven by a RetailerAdapter, so that any registered retailer is scrapped by the same
+    launch, filter, scroll and parse steps.
+    """
+
+    def __init__(self, adapter: RetailerAdapter, driver_class='chrome', driver_pool=None):
+        """
+        Args:
+            adapter: Retailer adapter.
+            driver_class: Use chrome driver to scrap, different system has it's own driver.
+            driver_pool: DriverPool, if given then borrow warm drivers from the pool instead of launching new ones.
+        """
+        super().__init__(url=adapter.url, driver_class=driver_class, driver_pool=driver_pool)
+        self.adapter = adapter
+        self.filter_elements = adapter.filter_elements
+
+    def get_column_name(self, soup: BeautifulSoup = None, class_name: str = None) -> List:
+        return self.adapter.get_column_name()
+
+    def get_record(self, soup: BeautifulSoup = None, class_name: str = None) -> List:
+        if soup is None:
+            soup = self.soup
+        return self.adapter.get_record(soup)
+
+    def _set_filter_by_element_name(self, element_name: str = None, value: float = None, click_pause_time: int = 1):
+        self.adapter.set_filter(self.driver, element_name=element_name, value=value,
+                                click_pause_time=click_pause_time)
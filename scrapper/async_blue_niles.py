@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from urllib.parse import urlparse
+
+import aiohttp
+import pandas as pd
+from bs4 import BeautifulSoup
+
+from scrapper.blue_niles import BlueNileScrapper
+from utils.logger import get_logger
+
+
+LOGGER = get_logger(name="async_blue_niles.py", level=logging.INFO)
+
+
+class HostRateLimiter:
+    """
+    Per-host rate limiter for asyncio tasks. Requests to the same host are spaced out by at least
+    `1 / rate` seconds, while requests to different hosts don't block each other.
+    """
+    def __init__(self, rate: float = 2.0):
+        """
+        Args:
+            rate: Max requests per second for each host. If None or <= 0 then no limit.
+        """
+        self.rate = rate
+        self._locks = {}
+        self._last_call = {}
+
+    async def wait(self, url: str):
+        if not self.rate or self.rate <= 0:
+            return
+        host = urlparse(url).netloc
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            interval = 1.0 / self.rate
+            elapsed = time.monotonic() - self._last_call.get(host, 0.0)
+            if elapsed < interval:
+                await asyncio.sleep(interval - elapsed)
+            self._last_call[host] = time.monotonic()
+
+
+class AsyncRequestsBlueNileScrapper(BlueNileScrapper):
+    """
+    Child class of BlueNileScrapper engined by asyncio & aiohttp. Same as RequestsBlueNileScrapper it can only scrape
+    the first window of each page, but many shape or filter urls are fetched concurrently over one pooled client.
+    HTML parsing is CPU bound, thus it's handed off to a thread pool to keep the event loop free for fetching.
+    """
+
+    def __init__(self, urls: List[str] = None, headers: Dict = None, max_concurrency: int = 8,
+                 rate_limit: float = 2.0, parse_workers: int = 4, timeout: float = 30):
+        """
+        Args:
+            urls: List of web urls to scrape, i.e. one url per shape or filter set.
+            headers: Request headers, see RequestsBlueNileScrapper for an example.
+            max_concurrency: Max number of in-flight requests, also the size of connection pool.
+            rate_limit: Max requests per second for each host.
+            parse_workers: Number of threads to parse HTML.
+            timeout: Total timeout (second) for each request.
+        """
+        super().__init__(urls[0] if urls else None)
+        self.urls = urls or []
+        self.headers = headers
+        self.max_concurrency = max_concurrency
+        self.rate_limit = rate_limit
+        self.parse_workers = parse_workers
+        self.timeout = timeout
+
+        # Urls failed to fetch or parse in the last run, {url: exception}
+        self.failed_urls = {}
+
+    def _parse(self, content: bytes) -> List:
+        """
+        Parse single page content into records. Runs in worker thread, so never touch self.soup here.
+        """
+        soup = BeautifulSoup(content, "html.parser")
+        return self.get_record(soup=soup)
+
+    async def _fetch_and_parse(self, session: aiohttp.ClientSession, url: str, semaphore: asyncio.Semaphore,
+                               limiter: HostRateLimiter, executor: ThreadPoolExecutor) -> List:
+        async with semaphore:
+            await limiter.wait(url)
+            async with session.get(url, headers=self.headers) as response:
+                response.raise_for_status()
+                content = await response.read()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self._parse, content)
+
+    async def get_async(self, urls: List[str] = None) -> pd.DataFrame:
+        """
+        Coroutine version of `get()`, can be awaited inside a running event loop.
+
+        Args:
+            urls: List of web urls, default is self.urls.
+
+        Returns: pd.DataFrame
+
+        """
+        if urls is None:
+            urls = self.urls
+        self.failed_urls = {}
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        limiter = HostRateLimiter(self.rate_limit)
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+
+        with ThreadPoolExecutor(max_workers=self.parse_workers) as executor:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                results = await asyncio.gather(
+                    *[self._fetch_and_parse(session, url, semaphore, limiter, executor) for url in urls],
+                    return_exceptions=True
+                )
+
+        diamond_list = []
+        for url, result in zip(urls, results):
+            if isinstance(result, Exception):
+                self.failed_urls[url] = result
+                LOGGER.warning("Failed to scrape {}: {!r}".format(url, result))
+            else:
+                diamond_list += result
+
+        self.df = self.to_frame(diamond_list)
+        return self.df
+
+    def get(self, urls: List[str] = None) -> pd.DataFrame:
+        """
+        Load DataFrame from all given urls concurrently.
+
+        Args:
+            urls: List of web urls, default is self.urls.
+
+        Returns: pd.DataFrame
+
+        """
+        return asyncio.run(self.get_async(urls))
@@ -7,10 +7,18 @@ import bs4
 from bs4 import BeautifulSoup
 import numpy as np
 import pandas as pd
-import requests
-from selenium import webdriver
-from selenium.common.exceptions import StaleElementReferenceException
-from selenium.webdriver.common.keys import Keys
+
+from scrapper import FIELD_COUNT_COLUMN
+from utils.metrics import span
+
+
+# HTML element names of the carat and price filter inputs
+FILTER_ELEMENTS = {
+    'carat_min': 'carat-min-input',
+    'carat_max': 'carat-max-input',
+    'price_min': 'price-min-input',
+    'price_max': 'price-max-input',
+}
 
 
 class BlueNileScrapper:
@@ -88,16 +96,46 @@ class BlueNileScrapper:
         Returns: single record
 
         """
-        record = element.get_text(';').split(';')
-        # Check if the diamond has discount price, if not will copy the origin price as discount price
-        if record[1] == 'Was: ':
-            del record[1]
-            del record[2]
-        else:
-            record.insert(2, record[1])
-        del record[4]
+        raw = element.get_text(';').split(';')
+        record = list(raw)
+        try:
+            # Check if the diamond has discount price, if not will copy the origin price as discount price
+            if record[1] == 'Was: ':
+                del record[1]
+                del record[2]
+            else:
+                record.insert(2, record[1])
+            del record[4]
+        except IndexError:
+            # Unexpected layout, keep it as is and let validation quarantine it
+            return raw
         return record
 
+    def to_frame(self, diamond_list: List, column_name: List = None) -> pd.DataFrame:
+        """
+        Build the raw DataFrame from records. Records with an unexpected number of fields are cut or padded to the
+        columns instead of failing the whole page, their raw field count is kept in FIELD_COUNT_COLUMN (only added
+        if there's any) for validation to quarantine them.
+
+        Args:
+            diamond_list: List of records, i.e. `get_record()`.
+            column_name: Column names, default is `get_column_name()`.
+
+        Returns: pd.DataFrame
+
+        """
+        if column_name is None:
+            column_name = self.get_column_name()
+        n_columns = len(column_name)
+        field_count = [len(record) for record in diamond_list]
+        if all(count == n_columns for count in field_count):
+            return pd.DataFrame(diamond_list, columns=column_name)
+
+        padding = [None] * n_columns
+        df = pd.DataFrame([(record + padding)[:n_columns] for record in diamond_list], columns=column_name)
+        df[FIELD_COUNT_COLUMN] = field_count
+        return df
+
 
 class RequestsBlueNileScrapper(BlueNileScrapper):
     """
@@ -123,11 +161,13 @@ class RequestsBlueNileScrapper(BlueNileScrapper):
         Returns: pd.DataFrame
 
         """
+        import requests
+
         s = requests.session()
         self.soup = BeautifulSoup(s.get(self.url, headers=self.headers).content, "html.parser")
         column_name = self.get_column_name()
         diamond_list = self.get_record()
-        self.df = pd.DataFrame(diamond_list, columns=column_name)
+        self.df = self.to_frame(diamond_list, column_name)
         return self.df
 
 
@@ -136,29 +176,44 @@ class DriverBlueNileScrapper(BlueNileScrapper):
     Child class of BlueNileScrapper engined by selenium.webdriver, can load completed data by controlling web driver.
     """
 
-    def __init__(self, url=None, driver_class='chrome'):
+    def __init__(self, url=None, driver_class='chrome', driver_pool=None):
         """
         Args:
             url: Web url, should manually input 'https://www.bluenile.com/diamond-search'.
             driver_class: Use chrome driver to scrap, different system has it's own driver.
+            driver_pool: DriverPool, if given then borrow warm drivers from the pool instead of launching new ones.
         """
         super().__init__(url)
         self.driver = None
         self.driver_class = driver_class
+        self.driver_pool = driver_pool
         # Find correct driver absolute path
         self.driver_path = os.path.abspath("./{}driver_{}".format(driver_class, platform.system()))
         self.soup_list = []
+        # Number of pages loaded by current driver, used by driver_pool to recycle drivers
+        self.page_count = 0
+        self.filter_elements = FILTER_ELEMENTS
 
     def _launch_driver(self):
         if self.driver is None:
-            if self.driver_class == 'chrome':
-                self.driver = webdriver.Chrome(self.driver_path)
-            self.driver.get(self.url)
-            time.sleep(1)
+            with span('launch', pooled=self.driver_pool is not None):
+                if self.driver_pool is not None:
+                    self.driver = self.driver_pool.acquire()
+                elif self.driver_class == 'chrome':
+                    from selenium import webdriver
+
+                    self.driver = webdriver.Chrome(self.driver_path)
+                self.page_count = 1
+                self.driver.get(self.url)
+                time.sleep(1)
 
     def _quit_driver(self):
-        self.driver.quit()
+        if self.driver_pool is not None:
+            self.driver_pool.release(self.driver, pages=self.page_count)
+        else:
+            self.driver.quit()
         self.driver = None
+        self.page_count = 0
 
     def _scroll(self, scroll_number: int = None, scroll_pause_time: int = None):
         """
@@ -171,6 +226,8 @@ class DriverBlueNileScrapper(BlueNileScrapper):
             scroll_pause_time: The pause time (second) for each scrolling.
         """
         if scroll_number:
+            from selenium.webdriver.common.keys import Keys
+
             if scroll_pause_time is None:
                 scroll_pause_time = 0.5
             window = self.driver.find_element_by_tag_name("body")
@@ -217,20 +274,20 @@ class DriverBlueNileScrapper(BlueNileScrapper):
         self._launch_driver()
 
         # Set filter
-        self._set_filter_by_element_name(element_name='carat-max-input', value=carat_input[1])
-        self._set_filter_by_element_name(element_name='carat-min-input', value=carat_input[0])
-
-        self._set_filter_by_element_name(element_name='price-max-input', value=price_input[1])
-        self._set_filter_by_element_name(element_name='price-min-input', value=price_input[0])
+        self.set_filters(carat_input, price_input)
 
         # Scroll down
-        self._scroll(scroll_number=scroll_number, scroll_pause_time=scroll_pause_time)
+        with span('scroll', carat=carat_input, price=price_input):
+            self._scroll(scroll_number=scroll_number, scroll_pause_time=scroll_pause_time)
+        self.page_count += 1
 
         # Scrape
-        self.soup = BeautifulSoup(self.driver.page_source, "html.parser")
-        column_name = self.get_column_name()
-        diamond_list = self.get_record()
-        self.df = pd.DataFrame(diamond_list, columns=column_name)
+        with span('parse', carat=carat_input, price=price_input) as record:
+            self.soup = BeautifulSoup(self.driver.page_source, "html.parser")
+            column_name = self.get_column_name()
+            diamond_list = self.get_record()
+            self.df = self.to_frame(diamond_list, column_name)
+            record['rows'] = len(diamond_list)
 
         if is_quit:
             self._quit_driver()
@@ -288,7 +345,7 @@ class DriverBlueNileScrapper(BlueNileScrapper):
             if keep_soup_list:
                 self.soup_list.append(self.soup)
 
-        self.df = pd.DataFrame(diamond_list, columns=column_name)
+        self.df = self.to_frame(diamond_list, column_name)
 
         self._quit_driver()
         return self.df
@@ -322,11 +379,7 @@ class DriverBlueNileScrapper(BlueNileScrapper):
             price_filter = price_set[page]
 
             # Set filter
-            self._set_filter_by_element_name(element_name='carat-max-input', value=carat_filter[1])
-            self._set_filter_by_element_name(element_name='carat-min-input', value=carat_filter[0])
-
-            self._set_filter_by_element_name(element_name='price-max-input', value=price_filter[1])
-            self._set_filter_by_element_name(element_name='price-min-input', value=price_filter[0])
+            self.set_filters(carat_filter, price_filter)
 
             soup = BeautifulSoup(self.driver.page_source, "html.parser")
             all_diamonds = soup.find_all(
@@ -339,31 +392,57 @@ class DriverBlueNileScrapper(BlueNileScrapper):
 
         return distribution_df
 
-    def _set_filter_by_element_name(self, element_name: str = None, value: float = None, click_pause_time: int = 1):
+    def set_filters(self, carat_input: List, price_input: List):
         """
-        Helper function to find and set specific filter.
+        Set carat and price filters, max before min so that the range is never empty in between.
 
         Args:
-            element_name: HTML element name of filter.
-            value: The input value of filter.
-            click_pause_time: The pause time (second) for each click
+            carat_input: [Min Carat, Max Carat].
+            price_input: [Min Price, Max Price].
+        """
+        self._set_filter_by_element_name(element_name=self.filter_elements['carat_max'], value=carat_input[1])
+        self._set_filter_by_element_name(element_name=self.filter_elements['carat_min'], value=carat_input[0])
+
+        self._set_filter_by_element_name(element_name=self.filter_elements['price_max'], value=price_input[1])
+        self._set_filter_by_element_name(element_name=self.filter_elements['price_min'], value=price_input[0])
 
+    def _set_filter_by_element_name(self, element_name: str = None, value: float = None, click_pause_time: int = 1):
         """
-        # Use try & except to avoid StaleElementReferenceException, should have better method
-        # https://stackoverflow.com/questions/27003423/staleelementreferenceexception-on-python-selenium
-        try:
-            element = self.driver.find_element_by_name(element_name)
-            time.sleep(click_pause_time)
-            element.click()
-            time.sleep(click_pause_time)
-            element.send_keys('{}'.format(value))
-
-        except StaleElementReferenceException:
-            element = self.driver.find_element_by_name(element_name)
-            time.sleep(click_pause_time)
-            element.click()
-            time.sleep(click_pause_time)
-            element.send_keys('{}'.format(value))
-
-        element.send_keys(Keys.ENTER)
+        Helper function to find and set specific filter, see `set_input_by_element_name()`.
+        """
+        set_input_by_element_name(self.driver, element_name=element_name, value=value,
+                                  click_pause_time=click_pause_time)
+
+
+def set_input_by_element_name(driver, element_name: str = None, value: float = None, click_pause_time: int = 1):
+    """
+    Find an input element by name, type the value and press enter.
+
+    Args:
+        driver: Web driver.
+        element_name: HTML element name of filter.
+        value: The input value of filter.
+        click_pause_time: The pause time (second) for each click
+
+    """
+    from selenium.common.exceptions import StaleElementReferenceException
+    from selenium.webdriver.common.keys import Keys
+
+    # Use try & except to avoid StaleElementReferenceException, should have better method
+    # https://stackoverflow.com/questions/27003423/staleelementreferenceexception-on-python-selenium
+    try:
+        element = driver.find_element_by_name(element_name)
         time.sleep(click_pause_time)
+        element.click()
+        time.sleep(click_pause_time)
+        element.send_keys('{}'.format(value))
+
+    except StaleElementReferenceException:
+        element = driver.find_element_by_name(element_name)
+        time.sleep(click_pause_time)
+        element.click()
+        time.sleep(click_pause_time)
+        element.send_keys('{}'.format(value))
+
+    element.send_keys(Keys.ENTER)
+    time.sleep(click_pause_time)
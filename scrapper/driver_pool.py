@@ -0,0 +1,134 @@
+import os
+import platform
+import queue
+import threading
+from typing import List
+
+from selenium import webdriver
+
+
+# Url patterns never needed for scraping the grid: images, fonts and tracking scripts.
+BLOCKED_URLS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.svg', '*.webp', '*.ico', '*.mp4',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*', '*facebook.net*',
+    '*hotjar.com*', '*optimizely.com*', '*bing.com*', '*pinterest.com*', '*criteo.com*',
+]
+
+
+class DriverPool:
+    """
+    Pool of warm web drivers shared across scrappers, so that the browser startup and static assets loading is paid
+    once per pool instead of once per filter set. Drivers are recycled after `max_pages` pages to cap the memory
+    leaked by long living browser sessions.
+
+    To use:
+        with DriverPool(driver_class='chrome') as pool:
+            scrapper = DriverBlueNileScrapper(url=url, driver_pool=pool)
+            df = scrapper.get_dynamic(carat_set=carat_set, price_set=price_set)
+    """
+    def __init__(self, driver_class: str = 'chrome', driver_path: str = None, size: int = 1,
+                 headless: bool = True, block_resources: bool = True, blocked_urls: List = None,
+                 max_pages: int = 100):
+        """
+        Args:
+            driver_class: Use chrome driver to scrap, different system has it's own driver.
+            driver_path: Driver absolute path, default is './<driver_class>driver_<OS>'.
+            size: Max number of idle drivers kept warm in the pool.
+            headless: If True then launch browser without window.
+            block_resources: If True then block images, fonts and tracking scripts.
+            blocked_urls: Url patterns to block, default is BLOCKED_URLS.
+            max_pages: Number of loaded pages after which a driver is quit and replaced.
+        """
+        self.driver_class = driver_class
+        if driver_path is None:
+            driver_path = os.path.abspath("./{}driver_{}".format(driver_class, platform.system()))
+        self.driver_path = driver_path
+        self.size = size
+        self.headless = headless
+        self.block_resources = block_resources
+        self.blocked_urls = BLOCKED_URLS if blocked_urls is None else blocked_urls
+        self.max_pages = max_pages
+
+        self._idle = queue.Queue()
+        # Every driver created by the pool and its loaded page count, {driver: pages}
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def _create_driver(self):
+        if self.driver_class != 'chrome':
+            raise ValueError("Invalid driver_class, should be one of ['chrome']")
+
+        options = webdriver.ChromeOptions()
+        if self.headless:
+            options.add_argument('--headless')
+            options.add_argument('--disable-gpu')
+            # Infinite loading depends on viewport height, keep a desktop sized window
+            options.add_argument('--window-size=1920,1080')
+        if self.block_resources:
+            options.add_experimental_option('prefs', {
+                'profile.managed_default_content_settings.images': 2,
+                'profile.managed_default_content_settings.media_stream': 2,
+            })
+
+        driver = webdriver.Chrome(self.driver_path, options=options)
+        if self.block_resources and hasattr(driver, 'execute_cdp_cmd'):
+            driver.execute_cdp_cmd('Network.enable', {})
+            driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': self.blocked_urls})
+        with self._lock:
+            self._pages[driver] = 0
+        return driver
+
+    def acquire(self):
+        """
+        Get an idle warm driver, or launch a new one if there's none.
+
+        Returns: web driver
+
+        """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._create_driver()
+
+    def release(self, driver, pages: int = 1, discard: bool = False):
+        """
+        Give a driver back to the pool.
+
+        Args:
+            driver: Web driver got from `acquire()`.
+            pages: Number of pages loaded by the driver since it's acquired.
+            discard: If True then quit the driver anyway, i.e. the driver is in a broken state.
+        """
+        with self._lock:
+            self._pages[driver] = self._pages.get(driver, 0) + pages
+            recycle = discard or self._pages[driver] >= self.max_pages or self._idle.qsize() >= self.size
+        if recycle:
+            self._quit(driver)
+        else:
+            self._idle.put(driver)
+
+    def _quit(self, driver):
+        with self._lock:
+            self._pages.pop(driver, None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        """
+        Quit all drivers created by the pool, including the ones never released.
+        """
+        while not self._idle.empty():
+            self._idle.get_nowait()
+        with self._lock:
+            drivers = list(self._pages)
+        for driver in drivers:
+            self._quit(driver)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,122 @@
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List
+
+import pandas as pd
+
+from scrapper.adapters import RetailerAdapter, RetailerDriverScrapper
+from utils.logger import get_logger
+from utils.metrics import span
+
+
+LOGGER = get_logger(name="scheduler.py", level=logging.INFO)
+
+
+class RetailerScheduler:
+    """
+    Scrape the filter sets of several retailers concurrently. Scraping is bound by page loading and scrolling pauses,
+    so each retailer gets its own warm DriverPool and up to `drivers_per_retailer` browsers, while different
+    retailers never wait for each other. Scrapped DataFrames are handed to `sink` in the calling thread one at a
+    time, in completion order, so the sink can write to the single store without locking.
+
+    To use:
+        scheduler = RetailerScheduler([BlueNileAdapter(), ExampleAdapter()])
+        failed = scheduler.run(sink=lambda adapter, set_name, df: ingest_pipline(df, set_name=set_name))
+    """
+    def __init__(self, adapters: List[RetailerAdapter], driver_class: str = 'chrome', drivers_per_retailer: int = 1,
+                 max_workers: int = None):
+        """
+        Args:
+            adapters: Retailer adapters, retailer names should be unique.
+            driver_class: Web driver class.
+            drivers_per_retailer: Max number of browsers scraping the same retailer at the same time.
+            max_workers: Max number of browsers in total, default is one per retailer and driver.
+        """
+        self.adapters = adapters
+        self.driver_class = driver_class
+        self.drivers_per_retailer = drivers_per_retailer
+        self.max_workers = max_workers or len(adapters) * drivers_per_retailer
+
+    def _create_pool(self, adapter: RetailerAdapter):
+        from scrapper.driver_pool import DriverPool
+
+        return DriverPool(driver_class=self.driver_class, size=self.drivers_per_retailer)
+
+    def _scrape(self, adapter: RetailerAdapter, set_name: str, carat_set: List, price_set: List, pool,
+                semaphore: threading.Semaphore) -> pd.DataFrame:
+        with semaphore:
+            with span('filter_set', retailer=adapter.retailer, set_name=set_name) as record:
+                scrapper = RetailerDriverScrapper(adapter, driver_class=self.driver_class, driver_pool=pool)
+                df = adapter.normalize(scrapper.get_dynamic(carat_set=carat_set, price_set=price_set))
+                record['rows'] = df.shape[0]
+        LOGGER.info('===== Finish Scrapping {} {} ====='.format(adapter.retailer, set_name),
+                    extra={'stage': 'scrape', 'rows': df.shape[0], 'set_name': set_name,
+                           'duration': record['duration']})
+        return df
+
+    def run(self, sink: Callable, filter_sets: Dict = None, retries: int = 1) -> Dict:
+        """
+        Scrape all filter sets of all retailers.
+
+        Args:
+            sink: Called as sink(adapter, set_name, df) for each scrapped set, df is normalized by the adapter and
+                set_name is qualified by `adapter.set_name()`.
+            filter_sets: {retailer: {set_name: (carat_set, price_set)}}, default is `adapter.filter_sets()`.
+            retries: Number of times a failed set is scrapped again.
+
+        Returns: {(retailer, set_name): exception} of sets failed after all retries, or whose sink failed
+
+        """
+        filter_sets = filter_sets or {}
+        pools = {adapter.retailer: self._create_pool(adapter) for adapter in self.adapters}
+        semaphores = {adapter.retailer: threading.BoundedSemaphore(self.drivers_per_retailer)
+                      for adapter in self.adapters}
+        failed = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                # {future: (adapter, set_name, carat_set, price_set, attempt)}
+                pending = {}
+
+                def submit(adapter, set_name, carat_set, price_set, attempt):
+                    future = executor.submit(self._scrape, adapter, set_name, carat_set, price_set,
+                                             pools[adapter.retailer], semaphores[adapter.retailer])
+                    pending[future] = (adapter, set_name, carat_set, price_set, attempt)
+
+                # Interleave retailers, so that every retailer starts scraping at once
+                jobs = [[(adapter, set_name, carat_set, price_set) for set_name, (carat_set, price_set)
+                         in filter_sets.get(adapter.retailer, adapter.filter_sets()).items()]
+                        for adapter in self.adapters]
+                for step in range(max(map(len, jobs), default=0)):
+                    for retailer_jobs in jobs:
+                        if step < len(retailer_jobs):
+                            submit(*retailer_jobs[step], attempt=0)
+
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        adapter, set_name, carat_set, price_set, attempt = pending.pop(future)
+                        key = (adapter.retailer, set_name)
+                        try:
+                            df = future.result()
+                        except Exception as e:
+                            LOGGER.exception('{} filter set {} BREAK!!!'.format(*key))
+                            if attempt < retries:
+                                LOGGER.info('TRY AGAIN')
+                                submit(adapter, set_name, carat_set, price_set, attempt=attempt + 1)
+                            else:
+                                failed[key] = e
+                            continue
+
+                        try:
+                            sink(adapter, adapter.set_name(set_name), df)
+                        except Exception as e:
+                            LOGGER.exception('{} filter set {} ingestion BREAK!!!'.format(*key))
+                            failed[key] = e
+        finally:
+            for pool in pools.values():
+                pool.close()
+
+        for retailer, set_name in failed:
+            LOGGER.error('{} filter set {} FAILED!!! REQUIRE MANUAL CHECK!!!'.format(retailer, set_name))
+        return failed
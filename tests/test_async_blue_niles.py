@@ -0,0 +1,107 @@
+"""
+AsyncRequestsBlueNileScrapper against a local aiohttp stub server serving synthetic grid pages.
+
+To use:
+    python -m pytest tests
+"""
+import asyncio
+import time
+
+from aiohttp import web
+
+from benchmarks.fixtures import catalog_to_grid_html, synthetic_catalog
+from scrapper.async_blue_niles import AsyncRequestsBlueNileScrapper
+
+
+N_PAGES = 6
+ROWS_PER_PAGE = 5
+
+
+class StubGrid:
+    """
+    Serves `/page/<i>` grid pages after `delay` seconds, recording the start time of each request and the highest
+    number of requests in flight at once.
+    """
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.pages = [synthetic_catalog(ROWS_PER_PAGE, seed=i, stock_offset=i * ROWS_PER_PAGE)
+                      for i in range(N_PAGES)]
+        self.starts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.starts.append((request.host, time.monotonic()))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            page = self.pages[int(request.match_info['i'])]
+            return web.Response(text=catalog_to_grid_html(page), content_type='text/html')
+        finally:
+            self.in_flight -= 1
+
+
+def scrape(stub: StubGrid, hosts=('127.0.0.1',), **kwargs):
+    """
+    Start the stub server, scrape every page from each host in turn with the given scrapper arguments and stop the
+    server.
+
+    Returns: scraped DataFrame, scrapper
+
+    """
+    async def run():
+        app = web.Application()
+        app.router.add_get('/page/{i}', stub.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        urls = ['http://{}:{}/page/{}'.format(hosts[i % len(hosts)], port, i) for i in range(N_PAGES)]
+        scrapper = AsyncRequestsBlueNileScrapper(urls=urls, **kwargs)
+        try:
+            return await scrapper.get_async(), scrapper
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(run())
+
+
+def test_parsed_rows():
+    stub = StubGrid()
+    df, scrapper = scrape(stub, rate_limit=None)
+
+    assert scrapper.failed_urls == {}
+    assert df.shape[0] == N_PAGES * ROWS_PER_PAGE
+    assert list(df.columns) == scrapper.get_column_name()
+    for page in stub.pages:
+        rows = df.set_index('Stock No.').loc[page['Stock No.']]
+        assert (rows[['Price', 'Discount Price', 'Carat', 'Color']].values
+                == page.set_index('Stock No.')[['Price', 'Discount Price', 'Carat', 'Color']].values).all()
+
+
+def test_concurrency_bound():
+    stub = StubGrid(delay=0.1)
+    df, _ = scrape(stub, rate_limit=None, max_concurrency=2)
+
+    assert df.shape[0] == N_PAGES * ROWS_PER_PAGE
+    assert stub.max_in_flight == 2
+
+
+def test_rate_limit_per_host():
+    rate = 10.0
+    stub = StubGrid()
+    df, _ = scrape(stub, hosts=('127.0.0.1', 'localhost'), rate_limit=rate)
+
+    assert df.shape[0] == N_PAGES * ROWS_PER_PAGE
+
+    for host in ['127.0.0.1', 'localhost']:
+        starts = sorted(start for name, start in stub.starts if name.startswith(host + ':'))
+        assert len(starts) == N_PAGES // 2
+        # Requests to one host are spaced out by 1 / rate, margin for timer resolution and server-side arrival jitter
+        assert min(b - a for a, b in zip(starts, starts[1:])) >= 0.8 / rate
+    # Hosts don't wait for each other: the first request of each host starts right away
+    first = [min(start for name, start in stub.starts if name.startswith(host + ':'))
+             for host in ['127.0.0.1', 'localhost']]
+    assert abs(first[0] - first[1]) < 0.5 / rate
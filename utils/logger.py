@@ -1,8 +1,255 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
 import sys
+import threading
+from datetime import datetime
+from typing import Optional
+
+
+# Structured fields, pass them by `extra`, i.e. LOGGER.info("msg", extra={'stage': 'update', 'rows': 10})
+STRUCTURED_FIELDS = ('stage', 'rows', 'duration', 'set_name')
+
+# Inherited by child processes (joblib / GridSearchCV workers, multiprocessing), which send their records to the
+# process that configured logging
+ENV_LOG_JSON = 'DIAMOND_DIGGER_LOG_JSON'
+ENV_LOG_PID = 'DIAMOND_DIGGER_LOG_PID'
+ENV_LOG_ADDRESS = 'DIAMOND_DIGGER_LOG_ADDRESS'
+ENV_LOG_AUTHKEY = 'DIAMOND_DIGGER_LOG_AUTHKEY'
+
+TEXT_FORMAT = "%(asctime)s %(levelname)-4s %(filename)s:%(lineno)d - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class TextFormatter(logging.Formatter):
+    """
+    Human readable line: the logger context (if any), the usual caller information and structured fields at the end.
+    """
+    def __init__(self):
+        super().__init__(fmt=TEXT_FORMAT, datefmt=DATE_FORMAT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        context = getattr(record, 'context', None)
+        if context:
+            line = context + " " + line
+        fields = ['{}={}'.format(key, getattr(record, key)) for key in STRUCTURED_FIELDS
+                  if getattr(record, key, None) is not None]
+        if fields:
+            line += " | " + " ".join(fields)
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, structured fields are kept as typed values so logs can be loaded by `pd.read_json`.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'file': record.filename,
+            'line': record.lineno,
+            'process': record.process,
+            'message': record.getMessage(),
+        }
+        for key in ('context',) + STRUCTURED_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _ContextFilter(logging.Filter):
+    def __init__(self, context: str):
+        super().__init__()
+        self.context = context
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, 'context', None) is None:
+            record.context = self.context
+        return True
+
+
+def _is_child_process() -> bool:
+    parent_pid = os.environ.get(ENV_LOG_PID)
+    return parent_pid is not None and parent_pid != str(os.getpid())
+
+
+class _ProcessHandler(logging.handlers.QueueHandler):
+    """
+    Records of the process that configured logging go through the queue to its sinks, the sinks are configured on
+    the first record if `configure_logging()` wasn't called. Child processes (forked or spawned workers) don't own
+    the sinks, as rotating one file from several processes corrupts it: each one sends its records over its own
+    connection to the configuring process, whose receiver puts them into the same queue. If the configuring
+    process can't be reached, records are written to the child's stderr.
+    """
+    def __init__(self):
+        super().__init__(queue.SimpleQueue())
+        self.connection = None
+        self.connection_pid = None
+        self.stderr_handler = None
+
+    def emit(self, record: logging.LogRecord):
+        if not _is_child_process():
+            _ensure_configured()
+            super().emit(record)
+            return
+        record = self.prepare(record)
+        try:
+            self._connect().send(record)
+        except (OSError, EOFError, KeyError, ValueError):
+            self.connection = None
+            if self.stderr_handler is None:
+                self.stderr_handler = logging.StreamHandler(stream=sys.stderr)
+                self.stderr_handler.setFormatter(JsonFormatter() if os.environ.get(ENV_LOG_JSON) else TextFormatter())
+            self.stderr_handler.handle(record)
+
+    def _connect(self):
+        # A forked grandchild must not write to its parent's connection
+        if self.connection is None or self.connection_pid != os.getpid():
+            from multiprocessing.connection import Client
+
+            self.connection = Client(os.environ[ENV_LOG_ADDRESS], authkey=bytes.fromhex(os.environ[ENV_LOG_AUTHKEY]))
+            self.connection_pid = os.getpid()
+        return self.connection
+
+
+def _receive(connection, records: queue.SimpleQueue):
+    # One thread per child process connection
+    with connection:
+        while True:
+            try:
+                records.put(connection.recv())
+            except (OSError, EOFError):
+                return
+
+
+def _accept(listener, records: queue.SimpleQueue):
+    from multiprocessing import AuthenticationError
+
+    while True:
+        try:
+            connection = listener.accept()
+        except AuthenticationError:
+            continue
+        except OSError:
+            # Listener closed
+            return
+        threading.Thread(target=_receive, args=(connection, records), daemon=True).start()
+
+
+class _LoggingState:
+    """
+    Package-wide sinks. Loggers only put records into an in-memory queue, a single listener thread formats and
+    writes them to stdout and the rotating file, so slow disks or terminals never block the caller.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.queue_handler = _ProcessHandler()
+        self.listener = None
+        self.receiver = None
+        self.pid = None
+        self.exit_hook = False
+
+
+_STATE = _LoggingState()
+
+
+def configure_logging(path: Optional[str] = None, level=logging.INFO, json_format: bool = False,
+                      stream: bool = True, max_bytes: int = 10 * 1024 ** 2, backup_count: int = 5):
+    """
+    (Re)configure package-wide log sinks, should be called once at the start of a run. Calling it again replaces
+    the sinks, loggers from `get_logger()` keep working. Child processes of the configuring process ignore it, their
+    records are written by these sinks.
+
+    Args:
+        path: Log file path, rotated by size. If None then only log to stdout.
+        level: Minimum level written by sinks, each logger also has its own level.
+        json_format: If True then write JSON lines, else text lines.
+        stream: If True then also write to stdout.
+        max_bytes: Rotate the log file when it's about to exceed this size.
+        backup_count: Number of rotated files kept, i.e. log.txt.1 ... log.txt.5.
+    """
+    if _is_child_process():
+        return
+    with _STATE.lock:
+        _stop_listener()
+
+        formatter = JsonFormatter() if json_format else TextFormatter()
+        handlers = []
+        if stream:
+            handlers.append(logging.StreamHandler(stream=sys.stdout))
+        if path is not None:
+            log_dir = os.path.dirname(path)
+            if log_dir:
+                os.makedirs(log_dir, exist_ok=True)
+            handlers.append(logging.handlers.RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+            ))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+            handler.setLevel(level)
+
+        _STATE.listener = logging.handlers.QueueListener(_STATE.queue_handler.queue, *handlers,
+                                                         respect_handler_level=True)
+        _STATE.listener.start()
+        _STATE.pid = os.getpid()
+        if _STATE.receiver is None:
+            _start_receiver()
+        if not _STATE.exit_hook:
+            # The listener thread is a daemon, flush queued records at exit
+            atexit.register(_shutdown)
+            _STATE.exit_hook = True
+
+        os.environ[ENV_LOG_PID] = str(os.getpid())
+        os.environ[ENV_LOG_JSON] = '1' if json_format else ''
+
+
+def _start_receiver():
+    # Authenticated local socket (a Unix socket, or a named pipe on Windows) receiving pickled records of children
+    from multiprocessing.connection import Listener
+
+    authkey = os.urandom(16)
+    _STATE.receiver = Listener(authkey=authkey)
+    threading.Thread(target=_accept, args=(_STATE.receiver, _STATE.queue_handler.queue), daemon=True).start()
+    os.environ[ENV_LOG_ADDRESS] = _STATE.receiver.address
+    os.environ[ENV_LOG_AUTHKEY] = authkey.hex()
+
+
+def _stop_listener():
+    if _STATE.listener is not None and _STATE.pid == os.getpid():
+        # Flushes queued records before the sinks are closed
+        _STATE.listener.stop()
+        for handler in _STATE.listener.handlers:
+            handler.close()
+    _STATE.listener = None
+
+
+def _shutdown():
+    _stop_listener()
+    if _STATE.receiver is not None and _STATE.pid == os.getpid():
+        # Also removes the Unix socket file
+        _STATE.receiver.close()
+    _STATE.receiver = None
+
+
+def _ensure_configured():
+    if _STATE.listener is not None or _is_child_process():
+        return
+    with _STATE.lock:
+        if _STATE.listener is None:
+            configure_logging()
 
 
-# TODO: Add functionality to output logs to a file.
 def get_logger(name, level=logging.INFO, context=None):
     """
     Get a custom logger.
@@ -11,6 +258,8 @@ def get_logger(name, level=logging.INFO, context=None):
     some customization to the default logger by specifying the caller (file name and line number) to make
     tracking pipeline progress easier during iteration and exposing unexpected behavior with more
     robust debugging information.
+    Calling it again with the same name doesn't add handlers, all loggers share one queue handler, see
+    `configure_logging()` for file and JSON output. Nothing is configured until the first record is logged.
 
     To use:
         from utils import get_logger
@@ -20,6 +269,8 @@ def get_logger(name, level=logging.INFO, context=None):
         LOGGER.info("some information about this program")
         LOGGER.warning("a warning about something bad")
         LOGGER.debug("extra stuff for developers")
+        # structured fields
+        LOGGER.info("upsert done", extra={'stage': 'update', 'rows': 1200, 'duration': 3.2})
 
     Args:
         name: str, the name of the logger
@@ -31,14 +282,13 @@ def get_logger(name, level=logging.INFO, context=None):
     """
     logger = logging.getLogger(name)
     logger.setLevel(level)
+    # Records go to the package sinks only, not again through root handlers
+    logger.propagate = False
 
-    fmt = "%(asctime)s %(levelname)-4s %(filename)s:%(lineno)d - %(message)s"
+    if _STATE.queue_handler not in logger.handlers:
+        logger.addHandler(_STATE.queue_handler)
+    for log_filter in [f for f in logger.filters if isinstance(f, _ContextFilter)]:
+        logger.removeFilter(log_filter)
     if context is not None:
-        fmt = context + " " + fmt
-    formatter = logging.Formatter(fmt=fmt, datefmt="%Y-%m-%d %H:%M:%S")
-
-    handler = logging.StreamHandler(stream=sys.stdout)
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+        logger.addFilter(_ContextFilter(context))
     return logger
-
@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+def get_rss_mb() -> float:
+    """
+    Current resident set size (MB) of this process. Falls back to the peak RSS where /proc isn't available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS but in kilobytes on Linux
+        return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+class MetricsRecorder:
+    """
+    Record timing spans of pipeline stages into a JSON-lines metrics file. Each line is a finished span:
+        {"run_id", "stage", "parent", "start", "duration", "rows", "rss_mb", ...extra fields}
+
+    To use:
+        from utils.metrics import configure_metrics, span
+        configure_metrics('data/metrics.jsonl')
+        with span('parse', set_name='carat_range_1_101') as record:
+            records = scrapper.get_record()
+            record['rows'] = len(records)
+    """
+    def __init__(self, path: Optional[str] = None, run_id: str = None):
+        """
+        Args:
+            path: Metrics file path. If None then spans are timed but not written anywhere.
+            run_id: Identifier shared by all spans of one run, default is a timestamp plus random suffix.
+        """
+        self.path = path
+        self.run_id = run_id or '{}_{}'.format(datetime.now().strftime('%Y%m%d_%H%M%S'), uuid.uuid4().hex[:6])
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def _stack(self) -> List:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, stage: str, rows: int = None, **fields):
+        """
+        Time the enclosed block as one stage. The yielded dict can be filled with `rows` or other fields.
+
+        Args:
+            stage: Stage name, i.e. one of ['launch', 'filter_set', 'scroll', 'parse', 'transform', 'save', 'update'].
+            rows: Number of rows processed in the stage.
+            fields: Extra JSON serializable fields.
+        """
+        record = OrderedDict(run_id=self.run_id, stage=stage,
+                             parent=self._stack[-1] if self._stack else None,
+                             start=datetime.now().isoformat(timespec='seconds'))
+        record['rows'] = rows
+        record.update(fields)
+        self._stack.append(stage)
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            record['failed'] = True
+            raise
+        finally:
+            record['duration'] = round(time.perf_counter() - start, 4)
+            record['rss_mb'] = round(get_rss_mb(), 1)
+            self._stack.pop()
+            self.write(record)
+
+    def write(self, record: Dict):
+        if self.path is None:
+            return
+        line = json.dumps(record, default=str)
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+
+
+_RECORDER = MetricsRecorder()
+
+
+def configure_metrics(path: Optional[str] = 'data/metrics.jsonl', run_id: str = None) -> MetricsRecorder:
+    """
+    Replace the package-wide recorder used by `span()`, should be called once at the start of a run.
+    """
+    global _RECORDER
+    _RECORDER = MetricsRecorder(path=path, run_id=run_id)
+    return _RECORDER
+
+
+def span(stage: str, rows: int = None, **fields):
+    """
+    Time a stage with the package-wide recorder, see `MetricsRecorder.span()`.
+    """
+    return _RECORDER.span(stage, rows=rows, **fields)
+
+
+def load_spans(path: str) -> List[Dict]:
+    spans = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                spans.append(json.loads(line))
+    return spans
+
+
+def summarize_runs(spans: List[Dict]) -> "OrderedDict[str, Dict]":
+    """
+    Aggregate spans by run and stage.
+
+    Returns: OrderedDict in run order, {run_id: {stage: {'count', 'duration', 'rows', 'rss_mb'}}}
+
+    """
+    runs = OrderedDict()
+    for record in spans:
+        stages = runs.setdefault(record['run_id'], OrderedDict())
+        stat = stages.setdefault(record['stage'], {'count': 0, 'duration': 0.0, 'rows': 0, 'rss_mb': 0.0})
+        stat['count'] += 1
+        stat['duration'] += record.get('duration') or 0.0
+        stat['rows'] += record.get('rows') or 0
+        stat['rss_mb'] = max(stat['rss_mb'], record.get('rss_mb') or 0.0)
+    return runs
+
+
+def find_regressions(runs: "OrderedDict[str, Dict]", run_id: str, window: int = 7, threshold: float = 1.5) -> Dict:
+    """
+    Compare each stage's duration of given run against the trailing median of the previous `window` runs.
+
+    Returns: Dict, {stage: (duration, trailing median)} for stages slower than `threshold` * trailing median.
+
+    """
+    run_ids = list(runs)
+    previous = run_ids[max(0, run_ids.index(run_id) - window):run_ids.index(run_id)]
+    regressions = {}
+    for stage, stat in runs[run_id].items():
+        history = [runs[prev][stage]['duration'] for prev in previous if stage in runs[prev]]
+        if not history:
+            continue
+        median = statistics.median(history)
+        if median > 0 and stat['duration'] > threshold * median:
+            regressions[stage] = (stat['duration'], median)
+    return regressions
+
+
+def report(path: str = 'data/metrics.jsonl', run_id: str = None, window: int = 7, threshold: float = 1.5) -> str:
+    """
+    Build a plain text report showing where the time of one run went, default is the latest run.
+    """
+    spans = load_spans(path)
+    runs = summarize_runs(spans)
+    if not runs:
+        return 'No spans in {}'.format(path)
+    if run_id is None:
+        run_id = list(runs)[-1]
+    if run_id not in runs:
+        raise ValueError("Unknown run_id '{}', should be one of {}".format(run_id, list(runs)))
+    stages = runs[run_id]
+    regressions = find_regressions(runs, run_id, window=window, threshold=threshold)
+    # Top level spans sum up to the run's wall time
+    total = sum(record.get('duration') or 0.0 for record in spans
+                if record['run_id'] == run_id and record.get('parent') is None)
+
+    lines = ['Run {}, {:.1f} seconds'.format(run_id, total),
+             '{:<14}{:>7}{:>12}{:>8}{:>12}{:>10}'.format('stage', 'count', 'seconds', 'share', 'rows', 'rss_mb')]
+    for stage, stat in sorted(stages.items(), key=lambda item: -item[1]['duration']):
+        line = '{:<14}{:>7}{:>12.2f}{:>7.1f}%{:>12}{:>10.1f}'.format(
+            stage, stat['count'], stat['duration'], 100 * stat['duration'] / total if total else 0.0,
+            stat['rows'], stat['rss_mb'])
+        if stage in regressions:
+            line += '  REGRESSION: {:.1f}x trailing median {:.2f}s'.format(
+                regressions[stage][0] / regressions[stage][1], regressions[stage][1])
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main(argv: List = None):
+    parser = argparse.ArgumentParser(description='Summarize pipeline timing spans.')
+    parser.add_argument('--path', default='data/metrics.jsonl', help='JSON-lines metrics file.')
+    parser.add_argument('--run-id', default=None, help='Run to report, default is the latest one.')
+    parser.add_argument('--window', type=int, default=7, help='Number of previous runs for the trailing median.')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='Flag stages slower than threshold * trailing median.')
+    args = parser.parse_args(argv)
+    print(report(path=args.path, run_id=args.run_id, window=args.window, threshold=args.threshold))
+
+
+if __name__ == "__main__":
+    main()